@@ -0,0 +1,43 @@
+"""Add broadcasts table
+
+Revision ID: 3b8d2f6c1a90
+Revises: 740943f4276a
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8d2f6c1a90'
+down_revision: Union[str, Sequence[str], None] = '740943f4276a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('broadcasts',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('text', sa.String(), nullable=False),
+        sa.Column('segment', sa.String(), nullable=False),
+        sa.Column('language_code', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('cursor_user_id', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=True),
+        sa.Column('sent', sa.Integer(), nullable=True),
+        sa.Column('failed', sa.Integer(), nullable=True),
+        sa.Column('created_by', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('broadcasts')
@@ -0,0 +1,45 @@
+"""Add referral counters to users
+
+Revision ID: 5d0b3e9a7f21
+Revises: e7a93b04c1d8
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d0b3e9a7f21'
+down_revision: Union[str, Sequence[str], None] = 'e7a93b04c1d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('referral_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('inactive_referral_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('l2_referral_count', sa.Integer(), server_default='0', nullable=False))
+    # Backfill only the users that have referrals; the rest keep the default 0.
+    op.execute("""
+        UPDATE users SET
+            referral_count = (SELECT count(*) FROM users r WHERE r.referrer_id = users.telegram_id),
+            inactive_referral_count = (
+                SELECT count(*) FROM users r WHERE r.referrer_id = users.telegram_id AND NOT r.activated_first_vpn
+            ),
+            l2_referral_count = (
+                SELECT count(*) FROM users r JOIN users p ON r.referrer_id = p.telegram_id
+                WHERE p.referrer_id = users.telegram_id
+            )
+        WHERE telegram_id IN (SELECT referrer_id FROM users WHERE referrer_id IS NOT NULL)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'l2_referral_count')
+    op.drop_column('users', 'inactive_referral_count')
+    op.drop_column('users', 'referral_count')
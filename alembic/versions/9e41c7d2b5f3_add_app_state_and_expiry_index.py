@@ -0,0 +1,39 @@
+"""Add app_state table and subscriptions (is_active, expires_at) index
+
+Revision ID: 9e41c7d2b5f3
+Revises: 3b8d2f6c1a90
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e41c7d2b5f3'
+down_revision: Union[str, Sequence[str], None] = '3b8d2f6c1a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('app_state',
+        sa.Column('key', sa.String(), nullable=False),
+        sa.Column('value', sa.String(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key')
+    )
+    # CONCURRENTLY keeps subscriptions writable while the index builds; it can't run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_subscriptions_is_active_expires_at', 'subscriptions', ['is_active', 'expires_at'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_subscriptions_is_active_expires_at', table_name='subscriptions', postgresql_concurrently=True)
+    op.drop_table('app_state')
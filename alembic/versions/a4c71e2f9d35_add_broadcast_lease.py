@@ -0,0 +1,30 @@
+"""Add broadcast owner and lease
+
+Revision ID: a4c71e2f9d35
+Revises: 5d0b3e9a7f21
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c71e2f9d35'
+down_revision: Union[str, Sequence[str], None] = '5d0b3e9a7f21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('broadcasts', sa.Column('owner', sa.String(), nullable=True))
+    op.add_column('broadcasts', sa.Column('lease_until', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('broadcasts', 'lease_until')
+    op.drop_column('broadcasts', 'owner')
@@ -0,0 +1,34 @@
+"""Add X-UI client settings to subscriptions
+
+Revision ID: b81f4d6e2c07
+Revises: a4c71e2f9d35
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b81f4d6e2c07'
+down_revision: Union[str, Sequence[str], None] = 'a4c71e2f9d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('subscriptions', sa.Column('total_gb', sa.BigInteger(), nullable=True))
+    op.add_column('subscriptions', sa.Column('flow', sa.String(), nullable=True))
+    op.add_column('subscriptions', sa.Column('limit_ip', sa.Integer(), nullable=True))
+    op.add_column('subscriptions', sa.Column('sub_id', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('subscriptions', 'sub_id')
+    op.drop_column('subscriptions', 'limit_ip')
+    op.drop_column('subscriptions', 'flow')
+    op.drop_column('subscriptions', 'total_gb')
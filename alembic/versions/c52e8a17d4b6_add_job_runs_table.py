@@ -0,0 +1,42 @@
+"""Add job_runs table
+
+Revision ID: c52e8a17d4b6
+Revises: 9e41c7d2b5f3
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52e8a17d4b6'
+down_revision: Union[str, Sequence[str], None] = '9e41c7d2b5f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # APScheduler creates its own apscheduler_jobs table on first start.
+    op.create_table('job_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_name', sa.String(), nullable=False),
+        sa.Column('instance', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('rows_processed', sa.Integer(), nullable=True),
+        sa.Column('error', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_runs_job_name_started_at', 'job_runs', ['job_name', 'started_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_job_runs_job_name_started_at', table_name='job_runs')
+    op.drop_table('job_runs')
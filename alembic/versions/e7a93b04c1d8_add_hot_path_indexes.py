@@ -0,0 +1,41 @@
+"""Add indexes for hot-path queries
+
+Revision ID: e7a93b04c1d8
+Revises: c52e8a17d4b6
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a93b04c1d8'
+down_revision: Union[str, Sequence[str], None] = 'c52e8a17d4b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY keeps the tables writable while the indexes build; it can't run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_subscriptions_user_id_server_id', 'subscriptions', ['user_id', 'server_id'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_subscriptions_active_user_id_expires_at', 'subscriptions', ['user_id', 'expires_at'],
+                        unique=False, postgresql_concurrently=True, postgresql_where=sa.text('is_active'))
+        op.create_index('ix_users_referrer_id_created_at', 'users', ['referrer_id', 'created_at'],
+                        unique=False, postgresql_concurrently=True)
+        op.create_index('ix_users_username', 'users', ['username'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_users_username', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_users_referrer_id_created_at', table_name='users', postgresql_concurrently=True)
+        op.drop_index('ix_subscriptions_active_user_id_expires_at', table_name='subscriptions', postgresql_concurrently=True)
+        op.drop_index('ix_subscriptions_user_id_server_id', table_name='subscriptions', postgresql_concurrently=True)
@@ -0,0 +1,85 @@
+# benchmarks/__main__.py
+#
+# Runs the benchmark suite and writes the results as JSON.
+#
+#   python -m benchmarks --output bench.json
+#   python -m benchmarks --quick
+
+import argparse
+import asyncio
+import json
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from loguru import logger
+
+from benchmarks import bench_inbound_parsing, bench_xui_client
+
+SUITES = ("parsing", "update", "links", "provisioning")
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args) -> dict:
+    quick = args.quick
+    results = {}
+    if "parsing" in args.only:
+        counts = [1000, 10000] if quick else [1000, 10000, 100000]
+        results["inbound_parsing"] = bench_inbound_parsing.run_all(counts, repeat=3 if quick else 5)
+    if "update" in args.only:
+        counts = [1000] if quick else [1000, 10000]
+        results["update_client"] = [
+            await bench_xui_client.bench_update_client(count, repeat=10 if quick else 50, latency=args.latency)
+            for count in counts
+        ]
+    if "links" in args.only:
+        results["link_generation"] = bench_xui_client.bench_link_generation(10000 if quick else 100000)
+    if "provisioning" in args.only:
+        results["provisioning"] = await bench_xui_client.bench_provisioning(
+            servers=args.servers,
+            clients_per_server=20 if quick else 200,
+            latency=args.latency
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="XUIClient benchmarks against an in-process fake panel.")
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--only", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--quick", action="store_true", help="Smaller inputs, for a smoke run")
+    parser.add_argument("--servers", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated panel latency in seconds")
+    args = parser.parse_args()
+
+    # Per-request INFO logging would dominate the measurements.
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    report = {
+        "meta": {
+            "revision": _git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick
+        },
+        "results": asyncio.run(run(args))
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# benchmarks/bench_inbound_parsing.py
+#
+# Compares full pydantic validation of an inbound payload with the light-weight
+# parsing helpers used on the bot's hot paths.
+#
+#   python -m benchmarks.bench_inbound_parsing --clients 10000
+
+import argparse
+import json
+from typing import Dict, Any, List
+
+from benchmarks.common import measure
+from core.services.xui_client import GetInboundResponse, RawInboundResponse, parse_inbound_stream, find_client_in_settings
+from tests.fake_xui_panel import FakeXUIPanel
+
+
+def make_inbound_payload(client_count: int) -> Dict[str, Any]:
+    """Builds a synthetic /panel/api/inbounds/get response with `client_count` clients."""
+    inbound = FakeXUIPanel().add_inbound(1, client_count=client_count)
+    return {"success": True, "msg": "", "obj": inbound.to_json()}
+
+
+def run(client_count: int, repeat: int) -> Dict[str, Any]:
+    payload = make_inbound_payload(client_count)
+    body = json.dumps(payload)
+    target = json.loads(payload["obj"]["settings"])["clients"][client_count // 2]["id"]
+
+    def full_validation():
+        GetInboundResponse.model_validate(json.loads(body))
+
+    def stream_only():
+        parse_inbound_stream(RawInboundResponse.model_validate(json.loads(body)).obj)
+
+    def single_client():
+        raw = RawInboundResponse.model_validate(json.loads(body)).obj
+        find_client_in_settings(raw["settings"], uuid=target)
+
+    return {
+        "clients": client_count,
+        "payload_kb": round(len(body) / 1024, 1),
+        "full_validation": measure(full_validation, repeat),
+        "stream_only": measure(stream_only, repeat),
+        "single_client": measure(single_client, repeat)
+    }
+
+
+def run_all(client_counts: List[int], repeat: int) -> List[Dict[str, Any]]:
+    return [run(client_count, repeat) for client_count in client_counts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inbound parsing cost versus client count.")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for result in run_all(args.clients, args.repeat):
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
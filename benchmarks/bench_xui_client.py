@@ -0,0 +1,99 @@
+# benchmarks/bench_xui_client.py
+#
+# End-to-end XUIClient benchmarks against in-process fake panels
+# (tests/fake_xui_panel.py): client update latency, VLESS link rendering
+# throughput and concurrent provisioning across several servers.
+
+import asyncio
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.common import summarize
+from core.services.inbound_cache import InboundMetadata
+from core.services.vless_links import VlessLinkTemplate
+from core.services.xui_client import XUIClient, ClientConfig, parse_inbound_stream
+from tests.fake_xui_panel import FakeXUIPanel, FakePanelConfig
+
+
+def _connect(panel: FakeXUIPanel) -> XUIClient:
+    return XUIClient(panel.url, panel.config.username, panel.config.password, transport=httpx.ASGITransport(app=panel.app))
+
+
+async def bench_update_client(client_count: int, repeat: int, latency: float) -> Dict[str, Any]:
+    """update_client latency with the client index warm versus a cold lookup on the panel."""
+    panel = FakeXUIPanel(FakePanelConfig(latency=latency), url=f"http://update-{client_count}.fake")
+    inbound = panel.add_inbound(1, client_count=client_count)
+    client_ids = list(inbound.clients)[:repeat]
+    xui_client = _connect(panel)
+    await xui_client.get_inbound_stream(1) # Log in outside the measurement
+
+    cold, warm = [], []
+    for client_id in client_ids:
+        xui_client._client_index.clear()
+        started = time.perf_counter()
+        await xui_client.update_client(1, client_id, 1)
+        cold.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await xui_client.update_client(1, client_id, 2)
+        warm.append(time.perf_counter() - started)
+
+    await xui_client.close()
+    return {"clients": client_count, "panel_latency_ms": latency * 1000, "cold": summarize(cold), "indexed": summarize(warm)}
+
+
+def bench_link_generation(links: int) -> Dict[str, Any]:
+    """Template compilation cost and render throughput."""
+    panel = FakeXUIPanel()
+    metadata = InboundMetadata.from_inbound(1, parse_inbound_stream(panel.add_inbound(1).to_json()))
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        template = VlessLinkTemplate.compile("https://vpn.example.com:2053", metadata)
+    compile_us = (time.perf_counter() - started) / 1000 * 1e6
+
+    user_uuids = [str(uuid.uuid4()) for _ in range(links)]
+    started = time.perf_counter()
+    for user_uuid in user_uuids:
+        template.render(user_uuid, f"Server-{user_uuid[:8]}")
+    elapsed = time.perf_counter() - started
+    return {"links": links, "compile_us": round(compile_us, 2), "links_per_second": round(links / elapsed)}
+
+
+async def bench_provisioning(servers: int, clients_per_server: int, latency: float) -> Dict[str, Any]:
+    """Concurrent add_client calls spread over several servers, as during a promo rush."""
+    panels = [FakeXUIPanel(FakePanelConfig(latency=latency, seed=i), url=f"http://provision-{i}.fake") for i in range(servers)]
+    for panel in panels:
+        panel.add_inbound(1)
+    xui_clients = [_connect(panel) for panel in panels]
+
+    latencies: List[float] = []
+
+    async def provision(xui_client: XUIClient, index: int):
+        config = ClientConfig(id=str(uuid.uuid4()), email=f"bench-{index}")
+        started = time.perf_counter()
+        await xui_client.add_client(1, config)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        provision(xui_client, index)
+        for index in range(clients_per_server)
+        for xui_client in xui_clients
+    ])
+    elapsed = time.perf_counter() - started
+
+    for xui_client in xui_clients:
+        await xui_client.close()
+    total = servers * clients_per_server
+    return {
+        "servers": servers,
+        "clients_per_server": clients_per_server,
+        "panel_latency_ms": latency * 1000,
+        "wall_seconds": round(elapsed, 3),
+        "clients_per_second": round(total / elapsed, 1),
+        "add_client": summarize(latencies)
+    }
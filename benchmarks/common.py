@@ -0,0 +1,32 @@
+# benchmarks/common.py
+
+import statistics
+import time
+from typing import Any, Callable, Dict, List
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds."""
+    ordered = sorted(seconds)
+
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(percentile(0.50), 3),
+        "p95_ms": round(percentile(0.95), 3),
+        "p99_ms": round(percentile(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3)
+    }
+
+
+def measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
@@ -7,6 +7,16 @@ class Settings(BaseSettings):
 
     BOT_TOKEN: str
     DB_URL: str
+    DB_ECHO: bool = False # Log every SQL statement; for debugging only
+    DB_POOL_SIZE: int = 10 # Connections kept open in the pool
+    DB_MAX_OVERFLOW: int = 20 # Extra connections opened under load on top of DB_POOL_SIZE
+    DB_POOL_TIMEOUT: float = 10 # Seconds to wait for a free connection before failing
+    DB_POOL_PRE_PING: bool = True # Check a connection is alive before handing it out
+    DB_POOL_RECYCLE: int = 1800 # Seconds after which a connection is replaced
+    DB_STATEMENT_CACHE_SIZE: int = 100 # Prepared statements cached per connection; 0 behind PgBouncer in transaction mode
+    DB_APPLICATION_NAME: str = "vpn-bot" # Shown in pg_stat_activity
+    DB_STATEMENT_TIMEOUT: int = 30000 # Milliseconds before Postgres cancels a query; 0 disables
+    DB_IDLE_IN_TRANSACTION_TIMEOUT: int = 0 # Milliseconds a session may sit idle inside a transaction; 0 disables (streamed job queries pause between fetches)
     ADMIN_IDS: str
     ADMIN_IDS_LIST: List[int] = Field(default_factory=list)
 
@@ -36,6 +46,26 @@ class Settings(BaseSettings):
     XUI_API_URL: str
     XUI_API_USER: str
     XUI_API_PASSWORD: str
+    XUI_INBOUND_CACHE_TTL: int = 300 # Seconds to cache inbound metadata used for VLESS links
+    XUI_CLIENT_INDEX_TTL: int = 60 # Seconds a client's panel config is reused for updates before it is read from the panel again
+    XUI_SESSION_STORE_PATH: Optional[str] = None # File where X-UI session cookies are kept (encrypted) across restarts
+    XUI_MAX_CONCURRENT_REQUESTS: int = 10 # In-flight requests per X-UI server
+    XUI_QUEUE_TIMEOUT: float = 5 # Seconds to wait for a free request slot before reporting the server as degraded
+    XUI_BREAKER_FAILURE_THRESHOLD: int = 5 # Consecutive failures that open a server's circuit
+    XUI_BREAKER_RECOVERY_TIMEOUT: float = 30 # Seconds an open circuit waits before letting a probe request through
+    TELEGRAM_CALLBACK_ANSWER_WINDOW: float = 15 # Seconds a user waits on a button press before Telegram gives up on the answer
+    EXPIRY_DELETE_CONCURRENCY: int = 5 # Parallel X-UI deletes per server in the expiry job
+    EXPIRY_CHECK_INTERVAL: int = 60 # Seconds between incremental expiry runs
+    JOB_RUN_RETENTION_DAYS: int = 14 # Scheduler job history kept in job_runs
+    TELEGRAM_GLOBAL_RATE: float = 25 # Outgoing messages per second, below Telegram's ~30/s bot limit
+    TELEGRAM_PER_CHAT_INTERVAL: float = 1.0 # Minimum seconds between two messages to the same chat
+    MESSAGE_QUEUE_LANE_SIZE: int = 5000 # Queued reminders/broadcast messages before producers wait
+    BROADCAST_PAGE_SIZE: int = 500 # Recipients fetched per page; the resume cursor is saved after each page
+    BROADCAST_LEASE_SECONDS: int = 120 # How long a broadcast stays claimed by its instance without a renewal; then another replica resumes it
+    ADMIN_USERS_PAGE_SIZE: int = 20 # Users per page of the admin user list; keep it within Telegram's 4096-character message limit
+    USER_CACHE_TTL: int = 60 # Seconds a user's language/ban snapshot is reused without a query
+    USER_CACHE_SIZE: int = 10000 # Users kept in the per-process snapshot cache
+    CATALOG_VERSION_CHECK_INTERVAL: int = 30 # Seconds between checks for server/tariff changes made on other replicas
 
     ENCRYPTION_KEY: str
 
@@ -1,13 +1,50 @@
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from core.config import settings
 from core.database.models import Base # Import Base from models.py
+from core.database.pool_metrics import MeteredQueuePool, instrument
 
 DATABASE_URL = settings.DB_URL
 
-async_engine = create_async_engine(DATABASE_URL, echo=True)
+
+def engine_options(url: str) -> dict:
+    """create_async_engine arguments from Settings. Pool and server options only apply to Postgres."""
+    options = {"echo": settings.DB_ECHO}
+    if make_url(url).get_backend_name() != "postgresql":
+        return options
+    server_settings = {"application_name": settings.DB_APPLICATION_NAME}
+    if settings.DB_STATEMENT_TIMEOUT:
+        server_settings["statement_timeout"] = str(settings.DB_STATEMENT_TIMEOUT)
+    if settings.DB_IDLE_IN_TRANSACTION_TIMEOUT:
+        server_settings["idle_in_transaction_session_timeout"] = str(settings.DB_IDLE_IN_TRANSACTION_TIMEOUT)
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        connect_args={
+            # asyncpg's own statement cache and SQLAlchemy's prepared statement cache
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": server_settings,
+        },
+    )
+    return options
+
+
+async_engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+instrument(async_engine)
 
 async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
 async def init_db():
     async with async_engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+
+def sync_database_url(url: str) -> str:
+    """The same database for a synchronous driver, e.g. for APScheduler's job store."""
+    parsed = make_url(url)
+    drivers = {"postgresql+asyncpg": "postgresql+psycopg2", "sqlite+aiosqlite": "sqlite"}
+    return parsed.set(drivername=drivers.get(parsed.drivername, parsed.drivername)).render_as_string(hide_password=False)
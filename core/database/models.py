@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, BigInteger, DateTime, Boolean, ForeignKey, JSON, Index, Float, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
@@ -9,7 +9,13 @@ class Base(DeclarativeBase):
 
 class User(Base):
     __tablename__ = 'users'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Referral count and "latest referrals" list on the main and referral menus.
+        Index('ix_users_referrer_id_created_at', 'referrer_id', 'created_at'),
+        # Admin search by username.
+        Index('ix_users_username', 'username'),
+        {'extend_existing': True}
+    )
 
     id = Column(Integer, primary_key=True)
     telegram_id = Column(BigInteger, unique=True, nullable=False)
@@ -26,6 +32,10 @@ class User(Base):
     bonus_days = Column(Integer, default=0)
     total_paid_out = Column(Integer, default=0)
     is_banned = Column(Boolean, default=False, nullable=False, server_default='f')
+    # Maintained by core.services.referral_service; repaired nightly.
+    referral_count = Column(Integer, default=0, nullable=False, server_default='0') # Users invited directly
+    inactive_referral_count = Column(Integer, default=0, nullable=False, server_default='0') # Of those, not activated a VPN yet
+    l2_referral_count = Column(Integer, default=0, nullable=False, server_default='0') # Users invited by the direct referrals
 
     subscriptions: Mapped[List["Subscription"]] = relationship(back_populates="user")
 
@@ -67,7 +77,18 @@ class Tariff(Base):
 
 class Subscription(Base):
     __tablename__ = 'subscriptions'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        # Serves the expiry jobs, which scan active subscriptions by expiry time.
+        Index('ix_subscriptions_is_active_expires_at', 'is_active', 'expires_at'),
+        # A user's subscription on a given server; the prefix also serves lookups by user alone.
+        Index('ix_subscriptions_user_id_server_id', 'user_id', 'server_id'),
+        # A user's active subscriptions that have not expired yet.
+        Index(
+            'ix_subscriptions_active_user_id_expires_at', 'user_id', 'expires_at',
+            postgresql_where=text('is_active'), sqlite_where=text('is_active')
+        ),
+        {'extend_existing': True}
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, ForeignKey('users.telegram_id'), nullable=False)
@@ -76,6 +97,13 @@ class Subscription(Base):
     expires_at = Column(DateTime, nullable=False)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=func.now())
+    # Panel-only settings of the X-UI client, kept so that a renewal can send the
+    # full client config without reading it back from the panel. NULL for
+    # subscriptions created before they were recorded.
+    total_gb = Column(BigInteger, nullable=True) # Traffic cap in bytes (X-UI's totalGB); 0 is unlimited
+    flow = Column(String, nullable=True)
+    limit_ip = Column(Integer, nullable=True)
+    sub_id = Column(String, nullable=True)
 
     user: Mapped["User"] = relationship(back_populates="subscriptions")
 
@@ -114,4 +142,62 @@ class GiftCode(Base):
     activated_at = Column(DateTime, nullable=True)
 
     def __repr__(self):
-        return f"<GiftCode(id={self.id}, code='{self.code}', buyer_user_id={self.buyer_user_id})>"
\ No newline at end of file
+        return f"<GiftCode(id={self.id}, code='{self.code}', buyer_user_id={self.buyer_user_id})>"
+
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+    __table_args__ = {'extend_existing': True}
+
+    id = Column(Integer, primary_key=True)
+    text = Column(String, nullable=False)
+    segment = Column(String, nullable=False, default='all')
+    language_code = Column(String, nullable=True) # None sends to every language
+    status = Column(String, nullable=False, default='pending')
+    cursor_user_id = Column(Integer, nullable=False, default=0) # users.id of the last recipient handled
+    owner = Column(String, nullable=True) # Instance sending the broadcast
+    lease_until = Column(DateTime, nullable=True) # Renewed by the owner while sending; another instance may take over once it passes
+    total = Column(Integer, default=0)
+    sent = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    created_by = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, segment='{self.segment}', status='{self.status}')>"
+
+
+class AppState(Base):
+    """Small key-value store for state that must survive restarts, e.g. job high-water marks."""
+    __tablename__ = 'app_state'
+    __table_args__ = {'extend_existing': True}
+
+    key = Column(String, primary_key=True)
+    value = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<AppState(key='{self.key}', value='{self.value}')>"
+
+
+class JobRun(Base):
+    """One execution of a scheduler job."""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        Index('ix_job_runs_job_name_started_at', 'job_name', 'started_at'),
+        {'extend_existing': True}
+    )
+
+    id = Column(Integer, primary_key=True)
+    job_name = Column(String, nullable=False)
+    instance = Column(String, nullable=False) # host:pid of the replica that ran it
+    status = Column(String, nullable=False) # running, success or failed
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    duration = Column(Float, nullable=True) # Seconds
+    rows_processed = Column(Integer, nullable=True)
+    error = Column(String, nullable=True)
+
+    def __repr__(self):
+        return f"<JobRun(id={self.id}, job_name='{self.job_name}', status='{self.status}')>"
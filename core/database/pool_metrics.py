@@ -0,0 +1,93 @@
+# core/database/pool_metrics.py
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+WAIT_WINDOW = 5000 # Recent checkout waits kept for percentiles
+
+
+class PoolMetrics:
+    """Connection pool counters: checkouts, connections in use and time spent waiting for one."""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.connects = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_WINDOW)
+
+    def record_wait(self, seconds: float):
+        self._waits.append(seconds)
+
+    def on_checkout(self):
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self):
+        self.in_use = max(0, self.in_use - 1)
+
+    def snapshot(self, pool=None) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> Optional[float]:
+            if not waits:
+                return None
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2)
+
+        stats = {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "connects": self.connects,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "wait_p50_ms": percentile(0.50),
+            "wait_p99_ms": percentile(0.99),
+            "wait_max_ms": round(waits[-1] * 1000, 2) if waits else None,
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            stats.update(pool_size=pool.size(), overflow=pool.overflow(), idle=pool.checkedin())
+        return stats
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """The default asyncio pool, timing how long each checkout waits for a free connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - started)
+
+
+def instrument(engine: AsyncEngine):
+    sync_engine = engine.sync_engine
+    event.listen(sync_engine, "checkout", lambda *args: pool_metrics.on_checkout())
+    event.listen(sync_engine, "checkin", lambda *args: pool_metrics.on_checkin())
+    event.listen(sync_engine, "connect", lambda *args: setattr(pool_metrics, "connects", pool_metrics.connects + 1))
+
+
+async def report_pool_metrics(engine: AsyncEngine, interval: float = 60):
+    """Logs pool metrics every `interval` seconds while there is traffic."""
+    last_checkouts = 0
+    while True:
+        await asyncio.sleep(interval)
+        if pool_metrics.checkouts != last_checkouts:
+            last_checkouts = pool_metrics.checkouts
+            logger.info(f"DB pool: {pool_metrics.snapshot(engine.pool)}")
@@ -1,18 +1,27 @@
 from aiogram import Router, F, Bot
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, BaseFilter, CommandObject
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, delete
-from sqlalchemy.orm import selectinload
 from loguru import logger
 from datetime import datetime, timedelta
 
-from core.database.models import Server, Tariff, User, Subscription, Transaction, GiftCode
+from core.database.models import Server, Tariff, User, Subscription, Transaction, GiftCode, Broadcast, JobRun
 from core.config import settings
 from core.utils.security import encrypt_password
-from core.services.xui_client import get_client, XUIClientError
+from core.services.xui_client import get_client, invalidate_client, XUIClientError
+from core.services.inbound_cache import invalidate_inbound_cache
+from core.services.user_cache import invalidate_user
+from core.services.catalog import bump_catalog_version, invalidate_catalog
+from core.services.referral_service import detach_referral
+from core.services.broadcast_service import (
+    BroadcastStatus, Segment, count_recipients, create_broadcast, cancel_broadcast, get_progress
+)
+from core.database.database import async_session_maker, async_engine
+from core.database.pool_metrics import pool_metrics
 
 router = Router()
 
@@ -40,6 +49,11 @@ class AdminFSM(StatesGroup):
     find_user = State()
     edit_user_balance = State()
     edit_user_days = State()
+    # Broadcast
+    broadcast_text = State()
+    broadcast_segment = State()
+    broadcast_language = State()
+    broadcast_confirm = State()
 
 # --- Клавиатуры для админки ---
 async def get_main_admin_keyboard():
@@ -47,6 +61,7 @@ async def get_main_admin_keyboard():
         [InlineKeyboardButton(text="Управление пользователями", callback_data="admin_users_menu")],
         [InlineKeyboardButton(text="Управление серверами", callback_data="admin_servers_menu")],
         [InlineKeyboardButton(text="Управление тарифами", callback_data="admin_tariffs_menu")],
+        [InlineKeyboardButton(text="Рассылки", callback_data="admin_broadcast_menu")],
         [InlineKeyboardButton(text="Статистика", callback_data="admin_stats")],
     ])
 
@@ -82,13 +97,13 @@ router.callback_query.filter(IsAdmin())
 
 
 
-@router.callback_query(F.data == "admin_main_menu")
+@router.callback_query(F.data == "admin_main_menu", flags={"db": False})
 async def cq_admin_panel(callback: CallbackQuery):
     await callback.answer()
     keyboard = await get_main_admin_keyboard()
     await callback.message.edit_text("<b>Панель администратора</b>", reply_markup=keyboard)
 
-@router.callback_query(F.data == "admin_panel_main")
+@router.callback_query(F.data == "admin_panel_main", flags={"db": False})
 async def callback_admin_panel_main(callback: CallbackQuery):
     await callback.answer()
     keyboard = await get_main_admin_keyboard()
@@ -101,7 +116,7 @@ async def callback_admin_panel_main(callback: CallbackQuery):
 
 # --- Управление серверами ---
 
-@router.callback_query(F.data == "admin_servers_menu")
+@router.callback_query(F.data == "admin_servers_menu", flags={"db": False})
 async def cq_servers_menu(callback: CallbackQuery):
     await callback.answer()
     keyboard = await get_servers_menu_keyboard()
@@ -141,7 +156,11 @@ async def cq_toggle_server(callback: CallbackQuery, session: AsyncSession):
         return
 
     server.is_active = not server.is_active
+    await bump_catalog_version(session)
     await session.commit()
+    invalidate_catalog()
+    invalidate_inbound_cache(server.id)
+    invalidate_client(server.id)
     status = "включен" if server.is_active else "отключен"
     await callback.answer(f"Сервер {server.name} {status}")
     logger.info(f"Admin {callback.from_user.id} toggled server {server_id} to {status}")
@@ -151,39 +170,88 @@ async def cq_toggle_server(callback: CallbackQuery, session: AsyncSession):
 
 # --- Управление тарифами ---
 
-@router.callback_query(F.data == "admin_users_menu")
+@router.callback_query(F.data == "admin_users_menu", flags={"db": False})
 async def cq_users_menu(callback: CallbackQuery):
     await callback.answer()
     keyboard = await get_users_menu_keyboard()
     await callback.message.edit_text("<b>Управление пользователями</b>", reply_markup=keyboard)
 
-@router.callback_query(F.data == "admin_list_users")
-async def cq_list_users(callback: CallbackQuery, session: AsyncSession):
-    await callback.answer()
-    users = (await session.execute(select(User).options(selectinload(User.subscriptions)).order_by(User.id))).scalars().all()
-
-    if not users:
-        await callback.message.edit_text(
-            "В базе данных нет ни одного пользователя.",
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_users_menu")]
-            ])
+async def _get_users_page(session: AsyncSession, cursor: int = 0, backwards: bool = False):
+    """
+    One page of the user list, keyset-paginated over users.id: the page after
+    `cursor`, or the one before it when going backwards. The active
+    subscription count is computed in SQL, so the cost stays O(page).
+    Returns (rows, has_prev, has_next).
+    """
+    page_size = settings.ADMIN_USERS_PAGE_SIZE
+    active_subscriptions = (
+        select(func.count(Subscription.id))
+        .where(
+            Subscription.user_id == User.telegram_id,
+            Subscription.is_active == True,
+            Subscription.expires_at > datetime.utcnow()
         )
-        return
+        .scalar_subquery()
+    )
+    query = select(
+        User.id, User.telegram_id, User.username, User.is_banned, User.unassigned_days, User.referral_balance,
+        active_subscriptions.label("active_subscriptions")
+    )
+    if backwards:
+        query = query.where(User.id < cursor).order_by(User.id.desc())
+    else:
+        query = query.where(User.id > cursor).order_by(User.id)
+    # One extra row tells whether there is a page beyond this one.
+    rows = (await session.execute(query.limit(page_size + 1))).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        # Going back from `cursor` means there is a page after this one.
+        return rows[::-1], has_more, True
+    return rows, cursor > 0, has_more
+
+async def _show_users_page(callback: CallbackQuery, session: AsyncSession, cursor: int = 0, backwards: bool = False):
+    rows, has_prev, has_next = await _get_users_page(session, cursor, backwards)
+    back_button = [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_users_menu")]
+
+    if not rows:
+        if cursor:
+            # The users past the cursor were deleted since the page was shown; start over.
+            rows, has_prev, has_next = await _get_users_page(session)
+        if not rows:
+            await callback.message.edit_text(
+                "В базе данных нет ни одного пользователя.",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[back_button])
+            )
+            return
 
     response_text = "<b>Список пользователей:</b>\n\n"
-    for user in users:
-        status = "✅" if not user.is_banned else "🚫"
-        response_text += f"{status} ID: <code>{user.telegram_id}</code> | @{user.username if user.username else 'N/A'}\n"
-        response_text += f"   Дни: {user.unassigned_days} | Баланс: {user.referral_balance / 100} RUB\n"
-        response_text += f"   Подписки: {len([s for s in user.subscriptions if s.is_active and s.expires_at > datetime.utcnow()])}\n\n"
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_users_menu")]
-    ])
+    for row in rows:
+        status = "✅" if not row.is_banned else "🚫"
+        response_text += f"{status} ID: <code>{row.telegram_id}</code> | @{row.username if row.username else 'N/A'}\n"
+        response_text += f"   Дни: {row.unassigned_days} | Баланс: {row.referral_balance / 100} RUB\n"
+        response_text += f"   Подписки: {row.active_subscriptions}\n\n"
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️ Пред.", callback_data=f"admin_users_page_prev_{rows[0].id}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="След. ▶️", callback_data=f"admin_users_page_next_{rows[-1].id}"))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation, back_button] if navigation else [back_button])
     await callback.message.edit_text(response_text, reply_markup=keyboard)
 
-@router.callback_query(F.data == "admin_tariffs_menu")
+@router.callback_query(F.data == "admin_list_users")
+async def cq_list_users(callback: CallbackQuery, session: AsyncSession):
+    await callback.answer()
+    await _show_users_page(callback, session)
+
+@router.callback_query(F.data.startswith("admin_users_page_"))
+async def cq_list_users_page(callback: CallbackQuery, session: AsyncSession):
+    await callback.answer()
+    _, _, _, direction, cursor = callback.data.split("_")
+    await _show_users_page(callback, session, int(cursor), backwards=direction == "prev")
+
+@router.callback_query(F.data == "admin_tariffs_menu", flags={"db": False})
 async def cq_tariffs_menu(callback: CallbackQuery):
     await callback.answer()
     keyboard = await get_tariffs_menu_keyboard()
@@ -244,7 +312,9 @@ async def cq_delete_tariff_execute(callback: CallbackQuery, session: AsyncSessio
         return
 
     tariff.is_active = False
+    await bump_catalog_version(session)
     await session.commit()
+    invalidate_catalog()
     logger.info(f"Admin {callback.from_user.id} deactivated tariff {tariff_id}")
     await callback.answer(f"Тариф ID {tariff_id} деактивирован и скрыт от пользователей.", show_alert=True)
     await cq_list_tariffs(callback, session)
@@ -259,7 +329,9 @@ async def cq_toggle_tariff(callback: CallbackQuery, session: AsyncSession):
         return
 
     tariff.is_active = not tariff.is_active
+    await bump_catalog_version(session)
     await session.commit()
+    invalidate_catalog()
     status = "включен" if tariff.is_active else "отключен"
     await callback.answer(f"Тариф {tariff.name} {status}")
     logger.info(f"Admin {callback.from_user.id} toggled tariff {tariff_id} to {status}")
@@ -269,6 +341,30 @@ async def cq_toggle_tariff(callback: CallbackQuery, session: AsyncSession):
 
 # --- Статистика ---
 
+JOB_RUN_STATUSES = {"running": "⏳", "success": "✅", "failed": "❌"}
+
+async def _job_runs_summary(session: AsyncSession, now: datetime) -> str:
+    """Last run of every scheduler job and its failures over the past 24 hours."""
+    last_run_ids = select(func.max(JobRun.id)).group_by(JobRun.job_name)
+    last_runs = (await session.execute(select(JobRun).where(JobRun.id.in_(last_run_ids)).order_by(JobRun.job_name))).scalars().all()
+    if not last_runs:
+        return ""
+    failures = dict((await session.execute(
+        select(JobRun.job_name, func.count(JobRun.id))
+        .where(JobRun.status == "failed", JobRun.started_at >= now - timedelta(days=1))
+        .group_by(JobRun.job_name)
+    )).all())
+
+    text = "\n\n⚙️ <b>Фоновые задачи</b>\n"
+    for run in last_runs:
+        duration = f"{run.duration:.1f} с" if run.duration is not None else "—"
+        rows = run.rows_processed if run.rows_processed is not None else "—"
+        text += (
+            f"{JOB_RUN_STATUSES.get(run.status, run.status)} <code>{run.job_name}</code>\n"
+            f"   {run.started_at:%d.%m %H:%M} UTC | {duration} | записей: {rows} | ошибок за 24 ч: {failures.get(run.job_name, 0)}\n"
+        )
+    return text
+
 @router.callback_query(F.data == "admin_stats")
 async def cq_stats(callback: CallbackQuery, session: AsyncSession):
     await callback.answer()
@@ -286,12 +382,173 @@ async def cq_stats(callback: CallbackQuery, session: AsyncSession):
         f"📈 Новых за 7 дней: <b>{users_week}</b>\n"
         f"🔑 Активных подписок: <b>{active_subs}</b>"
     )
+    stats_text += await _job_runs_summary(session, now)
+
+    pool = pool_metrics.snapshot(async_engine.pool)
+    if pool["wait_p99_ms"] is not None:
+        stats_text += (
+            f"\n🗄 <b>Пул соединений БД</b>\n"
+            f"   Занято: {pool['in_use']} (пик {pool['peak_in_use']}), размер пула: {pool.get('pool_size', '—')}\n"
+            f"   Ожидание: p50 {pool['wait_p50_ms']} мс, p99 {pool['wait_p99_ms']} мс | таймаутов: {pool['timeouts']}"
+        )
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main_menu")]
     ])
     await callback.message.edit_text(stats_text, reply_markup=keyboard)
 
+# --- Рассылки ---
+
+BROADCAST_SEGMENTS = {
+    Segment.ALL: "Все пользователи",
+    Segment.ACTIVE: "С активной подпиской",
+    Segment.EXPIRED: "С истекшей подпиской",
+    Segment.NO_SUBSCRIPTION: "Без подписки",
+}
+BROADCAST_LANGUAGES = {"any": "Все языки", "ru": "Русский", "en": "Английский", "fa": "Фарси"}
+BROADCAST_STATUSES = {
+    BroadcastStatus.PENDING: "⏳ Ожидает",
+    BroadcastStatus.RUNNING: "▶️ Идет",
+    BroadcastStatus.COMPLETED: "✅ Завершена",
+    BroadcastStatus.CANCELLED: "⏹ Остановлена",
+}
+
+def _broadcast_audience(segment: str, language_code: str | None) -> str:
+    return f"{BROADCAST_SEGMENTS[Segment(segment)]}, {BROADCAST_LANGUAGES[language_code or 'any']}"
+
+@router.callback_query(F.data == "admin_broadcast_menu")
+async def cq_broadcast_menu(callback: CallbackQuery, session: AsyncSession, state: FSMContext):
+    await callback.answer()
+    await state.clear()
+    broadcasts = (await session.execute(select(Broadcast).order_by(Broadcast.id.desc()).limit(5))).scalars().all()
+
+    response_text = "<b>Рассылки</b>\n\n"
+    buttons = [[InlineKeyboardButton(text="✉️ Новая рассылка", callback_data="admin_broadcast_new")]]
+    if not broadcasts:
+        response_text += "Рассылок еще не было."
+    for broadcast in broadcasts:
+        response_text += (
+            f"#{broadcast.id} {BROADCAST_STATUSES[BroadcastStatus(broadcast.status)]} | "
+            f"{_broadcast_audience(broadcast.segment, broadcast.language_code)} | "
+            f"{broadcast.sent}/{broadcast.total}\n"
+        )
+        buttons.append([InlineKeyboardButton(text=f"Рассылка #{broadcast.id}", callback_data=f"admin_broadcast_view_{broadcast.id}")])
+    buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_main_menu")])
+    await callback.message.edit_text(response_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+@router.callback_query(F.data == "admin_broadcast_new")
+async def cq_broadcast_new(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await state.set_state(AdminFSM.broadcast_text)
+    await callback.message.edit_text(
+        "<b>Шаг 1/3: Текст рассылки</b>\nОтправьте сообщение, которое получат пользователи. Форматирование сохранится.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_broadcast_menu")]
+        ])
+    )
+
+@router.message(AdminFSM.broadcast_text)
+async def msg_broadcast_text(message: Message, state: FSMContext):
+    if not message.text:
+        await message.answer("Рассылка поддерживает только текст. Попробуйте еще раз.")
+        return
+    await state.update_data(text=message.html_text)
+    await state.set_state(AdminFSM.broadcast_segment)
+    buttons = [[InlineKeyboardButton(text=title, callback_data=f"admin_broadcast_segment_{segment.value}")] for segment, title in BROADCAST_SEGMENTS.items()]
+    buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="admin_broadcast_menu")])
+    await message.answer("<b>Шаг 2/3: Получатели</b>\nКому отправить рассылку?", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+@router.callback_query(AdminFSM.broadcast_segment, F.data.startswith("admin_broadcast_segment_"))
+async def cq_broadcast_segment(callback: CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await state.update_data(segment=callback.data.removeprefix("admin_broadcast_segment_"))
+    await state.set_state(AdminFSM.broadcast_language)
+    buttons = [[InlineKeyboardButton(text=title, callback_data=f"admin_broadcast_lang_{code}")] for code, title in BROADCAST_LANGUAGES.items()]
+    buttons.append([InlineKeyboardButton(text="❌ Отмена", callback_data="admin_broadcast_menu")])
+    await callback.message.edit_text("<b>Шаг 3/3: Язык</b>\nОтправить пользователям с каким языком?", reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+
+@router.callback_query(AdminFSM.broadcast_language, F.data.startswith("admin_broadcast_lang_"))
+async def cq_broadcast_language(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    await callback.answer()
+    language_code = callback.data.removeprefix("admin_broadcast_lang_")
+    language_code = None if language_code == "any" else language_code
+    await state.update_data(language_code=language_code)
+    await state.set_state(AdminFSM.broadcast_confirm)
+
+    data = await state.get_data()
+    recipients = await count_recipients(session, data['segment'], language_code)
+    await callback.message.edit_text(
+        f"<b>Подтверждение</b>\n\nПолучатели: {_broadcast_audience(data['segment'], language_code)} — <b>{recipients}</b>\n\n{data['text']}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"🚀 Отправить ({recipients})", callback_data="admin_broadcast_confirm")],
+            [InlineKeyboardButton(text="❌ Отмена", callback_data="admin_broadcast_menu")]
+        ])
+    )
+
+@router.callback_query(AdminFSM.broadcast_confirm, F.data == "admin_broadcast_confirm")
+async def cq_broadcast_confirm(callback: CallbackQuery, state: FSMContext, session: AsyncSession, bot: Bot):
+    data = await state.get_data()
+    await state.clear()
+    broadcast = await create_broadcast(
+        session, bot, async_session_maker,
+        text=data['text'], segment=data['segment'], language_code=data['language_code'],
+        created_by=callback.from_user.id
+    )
+    await callback.answer("Рассылка запущена.")
+    await _show_broadcast(callback, session, broadcast.id)
+
+async def _show_broadcast(callback: CallbackQuery, session: AsyncSession, broadcast_id: int):
+    broadcast = await session.get(Broadcast, broadcast_id)
+    if not broadcast:
+        await callback.message.edit_text(
+            f"Рассылка #{broadcast_id} не найдена.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_broadcast_menu")]
+            ])
+        )
+        return
+    await session.refresh(broadcast)
+
+    sent, failed = broadcast.sent, broadcast.failed
+    progress = get_progress(broadcast.id)
+    if progress:
+        sent, failed = progress.sent, progress.failed
+    remaining = max(0, broadcast.total - sent - failed)
+
+    response_text = (
+        f"<b>Рассылка #{broadcast.id}</b> — {BROADCAST_STATUSES[BroadcastStatus(broadcast.status)]}\n"
+        f"Получатели: {_broadcast_audience(broadcast.segment, broadcast.language_code)}\n\n"
+        f"✅ Доставлено: <b>{sent}</b>\n"
+        f"❌ Ошибок: <b>{failed}</b>\n"
+        f"📨 Осталось: <b>{remaining}</b> из {broadcast.total}\n"
+    )
+    if progress and progress.rate() > 0:
+        response_text += f"⚡️ Скорость: {progress.rate():.1f} сообщ./с, осталось ~{int(remaining / progress.rate() / 60) + 1} мин.\n"
+
+    buttons = [[InlineKeyboardButton(text="🔄 Обновить", callback_data=f"admin_broadcast_view_{broadcast.id}")]]
+    if broadcast.status in (BroadcastStatus.PENDING, BroadcastStatus.RUNNING):
+        buttons.append([InlineKeyboardButton(text="⏹ Остановить", callback_data=f"admin_broadcast_cancel_{broadcast.id}")])
+    buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_broadcast_menu")])
+    try:
+        await callback.message.edit_text(response_text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons))
+    except TelegramBadRequest as e:
+        # Refreshing an unchanged view is not an error.
+        if "message is not modified" not in str(e):
+            raise
+
+@router.callback_query(F.data.startswith("admin_broadcast_view_"))
+async def cq_broadcast_view(callback: CallbackQuery, session: AsyncSession):
+    await callback.answer()
+    await _show_broadcast(callback, session, int(callback.data.split("_")[-1]))
+
+@router.callback_query(F.data.startswith("admin_broadcast_cancel_"))
+async def cq_broadcast_cancel(callback: CallbackQuery, session: AsyncSession):
+    broadcast_id = int(callback.data.split("_")[-1])
+    await cancel_broadcast(async_session_maker, broadcast_id)
+    logger.info(f"Admin {callback.from_user.id} stopped broadcast {broadcast_id}")
+    await callback.answer(f"Рассылка #{broadcast_id} остановлена.")
+    await _show_broadcast(callback, session, broadcast_id)
+
 # --- Процессы добавления (FSM) ---
 
 # Добавление тарифа
@@ -379,7 +636,9 @@ async def msg_add_tariff_price_stars(message: Message, state: FSMContext, sessio
             price_stars=data['price_stars']
         )
         session.add(new_tariff)
+        await bump_catalog_version(session)
         await session.commit()
+        invalidate_catalog()
         logger.info(f"Admin {message.from_user.id} successfully added new tariff: {data['name_ru']}")
         
         keyboard = await get_tariffs_menu_keyboard()
@@ -473,7 +732,10 @@ async def msg_add_server_inbound_id(message: Message, state: FSMContext, session
             inbound_id=data['inbound_id']
         )
         session.add(new_server)
+        await bump_catalog_version(session)
         await session.commit()
+        invalidate_catalog()
+        invalidate_inbound_cache(new_server.id)
         logger.info(f"Admin {message.from_user.id} successfully added new server: {data['server_name']}")
         
         keyboard = await get_servers_menu_keyboard()
@@ -587,6 +849,7 @@ async def cq_toggle_user_block(callback: CallbackQuery, session: AsyncSession):
 
     user.is_banned = not user.is_banned
     await session.commit()
+    invalidate_user(user.telegram_id)
     
     status = "заблокирован" if user.is_banned else "разблокирован"
 
@@ -613,13 +876,16 @@ async def cq_delete_user_confirm(callback: CallbackQuery, session: AsyncSession)
         reply_markup=keyboard
     )
 
-@router.callback_query(F.data.startswith("admin_delete_user_execute_"))
+# Deletes one panel client per subscription: each delete gets its own retry budget.
+@router.callback_query(F.data.startswith("admin_delete_user_execute_"), flags={"retry_policy": "background"})
 async def cq_delete_user_execute(callback: CallbackQuery, session: AsyncSession):
     user_telegram_id = int(callback.data.split("_")[-1])
     user = (await session.execute(select(User).where(User.telegram_id == user_telegram_id))).scalars().first()
     if not user:
         await callback.answer("Пользователь не найден.", show_alert=True)
         return
+    # The deletes can outlast the callback answer window; progress is shown in the message.
+    await callback.answer()
 
     # 1. Find all user subscriptions
     subscriptions = (await session.execute(
@@ -636,8 +902,8 @@ async def cq_delete_user_execute(callback: CallbackQuery, session: AsyncSession)
                 continue
             
             try:
-                xui_client = get_client(server)
-                await xui_client.delete_user(server.inbound_id, sub.xui_user_uuid)
+                xui_client = await get_client(server)
+                await xui_client.delete_client(server.inbound_id, sub.xui_user_uuid)
                 logger.info(f"Successfully deleted VLESS client {sub.xui_user_uuid} from server {server.name} for user {user.telegram_id}")
             except XUIClientError as e:
                 logger.error(f"Failed to delete VLESS client {sub.xui_user_uuid} from server {server.name}. Error: {e}")
@@ -652,13 +918,17 @@ async def cq_delete_user_execute(callback: CallbackQuery, session: AsyncSession)
     await session.execute(delete(GiftCode).where(GiftCode.buyer_user_id == user.telegram_id))
     await session.execute(delete(GiftCode).where(GiftCode.activated_by_user_id == user.telegram_id))
     
+    await detach_referral(session, user)
     await session.delete(user)
     await session.commit()
+    invalidate_user(user.telegram_id)
     
     logger.warning(f"Admin {callback.from_user.id} DELETED user {user.telegram_id} and all their data.")
-    await callback.answer(f"Пользователь {user.username or user.telegram_id} и все его данные удалены.", show_alert=True)
-    
-    await cq_users_menu(callback)
+    keyboard = await get_users_menu_keyboard()
+    await callback.message.edit_text(
+        f"✅ Пользователь {user.username or user.telegram_id} и все его данные удалены.\n\n<b>Управление пользователями</b>",
+        reply_markup=keyboard
+    )
 
 # Callback to show user details (used for cancellation)
 @router.callback_query(F.data.startswith("admin_show_user_details_"))
@@ -99,8 +99,8 @@ def get_instruction_text(os_type: str, lang: str) -> str:
 
 @router.callback_query(F.data.startswith("info_"))
 async def show_instruction(callback: CallbackQuery, session: AsyncSession):
-    from .user_handlers import _get_user_and_lang # Local import to avoid circular dependency
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    from .user_handlers import _get_lang # Local import to avoid circular dependency
+    lang = await _get_lang(session, callback.from_user.id)
 
     os_type = callback.data.split("_")[1]
     instruction_text = get_instruction_text(os_type, lang)
@@ -118,8 +118,8 @@ async def show_instruction(callback: CallbackQuery, session: AsyncSession):
 
 @router.callback_query(F.data == "how_to_connect")
 async def how_to_connect_menu(callback: CallbackQuery, session: AsyncSession):
-    from .user_handlers import _get_user_and_lang # Local import to avoid circular dependency
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    from .user_handlers import _get_lang # Local import to avoid circular dependency
+    lang = await _get_lang(session, callback.from_user.id)
 
     keyboard = await get_os_selection_keyboard(lang)
     await callback.message.edit_text(
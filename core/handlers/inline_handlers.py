@@ -4,7 +4,7 @@ from loguru import logger
 from sqlalchemy.ext.asyncio import AsyncSession
 import uuid
 
-from core.handlers.user_handlers import _get_user_and_lang
+from core.services.user_cache import get_user_snapshot
 from core.locales.translations import get_text
 
 router = Router()
@@ -24,13 +24,14 @@ async def inline_query_handler(inline_query: InlineQuery, bot: Bot, session: Asy
             return
 
         logger.info("Fetching user and language...")
-        user, lang = await _get_user_and_lang(session, user_id)
+        user = await get_user_snapshot(session, user_id)
         if not user:
             logger.warning(f"User {user_id} not found in DB. Offering to start the bot.")
             title = "Отправить приглашение"
             await inline_query.answer([], cache_time=1, switch_pm_text=title, switch_pm_parameter="start")
             logger.info("--- INLINE QUERY HANDLER END (USER NOT FOUND) ---")
             return
+        lang = user.language_code
         logger.info(f"User found. Language is '{lang}'.")
 
         logger.info("Getting bot info...")
@@ -1,5 +1,6 @@
 import loguru
 import asyncio
+from typing import Optional
 from aiogram import Router, F, Bot
 from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, LabeledPrice, PreCheckoutQuery, SuccessfulPayment, User as AiogramUser, InlineQuery, InlineQueryResultArticle, InputTextMessageContent
@@ -11,13 +12,17 @@ from aiocryptopay import AioCryptoPay, Networks
 
 import httpx
 from core.database.models import Server, Subscription, User, Tariff, GiftCode, Transaction
-from core.services.xui_client import get_client, XUIClientError, ClientConfig
+from core.services.xui_client import get_client, XUIClientError, XUIServerDegradedError, ClientConfig
+from core.services.inbound_cache import get_link_template
+from core.services.message_dispatcher import queue_message, Priority
+from core.services.user_cache import user_cache, get_user_snapshot, invalidate_user
+from core.services.catalog import get_catalog
+from core.services.referral_service import attach_referral, mark_first_vpn_activated
 from core.config import settings
 import uuid
 import secrets
 import string
 from datetime import datetime, timedelta
-from urllib.parse import urlparse
 from core import constants
 from core.locales.translations import get_text, get_db_text
 from core.database.database import async_session_maker # Import the session maker
@@ -31,56 +36,29 @@ def generate_unique_code(length=constants.GIFT_CODE_LENGTH):
     return ''.join(secrets.choice(alphabet) for i in range(length))
 
 async def _get_user_and_lang(session: AsyncSession, user_id: int) -> tuple[User | None, str]:
-    """Fetches user from DB and determines their language code."""
-    user = (await session.execute(select(User).where(User.telegram_id == user_id))).scalars().first()
+    """Fetches user from DB (once per update) and determines their language code."""
+    loaded_users = session.info.setdefault('users_by_telegram_id', {})
+    user = loaded_users.get(user_id)
+    if user is None:
+        user = (await session.execute(select(User).where(User.telegram_id == user_id))).scalars().first()
+        if user:
+            loaded_users[user_id] = user
+            user_cache.put(user)
     lang = user.language_code if user else 'ru'
     return user, lang
 
+async def _get_lang(session: AsyncSession, user_id: int) -> str:
+    """Determines the user's language from the user cache, for handlers that don't need the full row."""
+    snapshot = await get_user_snapshot(session, user_id)
+    return snapshot.language_code if snapshot else 'ru'
+
 async def _generate_vless_link(server: Server, user_uuid: str, lang: str) -> str:
-    """Generates a VLESS link by fetching the full inbound config from the server."""
+    """Generates a VLESS link from the cached link template of the server."""
     try:
-        xui_client = await get_client(server)
-        inbound = await xui_client.get_inbound(server.inbound_id)
-        if not inbound:
-            raise XUIClientError(f"Inbound {server.inbound_id} not found for link generation")
-
-        # Base parameters
-        parsed_url = urlparse(server.api_url)
-        host = parsed_url.hostname
-        port = inbound.port
-        params = {
-            "encryption": "none", # Standard for VLESS
-            "type": inbound.streamSettings.network
-        }
-
-        # Add security-specific parameters
-        security = inbound.streamSettings.security
-        params["security"] = security
-
-        if security == 'reality' and inbound.streamSettings.realitySettings:
-            reality_settings = inbound.streamSettings.realitySettings
-            # The public key and fingerprint are nested inside the 'settings' dict of realitySettings
-            nested_settings = reality_settings.settings
-            
-            if nested_settings.get('publicKey'):
-                params['pbk'] = nested_settings['publicKey']
-            if nested_settings.get('fingerprint'):
-                params['fp'] = nested_settings['fingerprint']
-            if nested_settings.get('spiderX'):
-                params['spx'] = nested_settings['spiderX']
-
-            if reality_settings.serverNames:
-                params['sni'] = reality_settings.serverNames[0]
-            if reality_settings.shortIds:
-                params['sid'] = reality_settings.shortIds[0]
-
-        # Construct the query string and fragment
-        query_string = "&".join([f"{k}={v}" for k, v in params.items()])
-        
+        template = await get_link_template(server)
         # Construct a more descriptive fragment
         fragment = f"{get_db_text(server.name, lang)}-{user_uuid[:8]}" # Use first 8 chars of UUID for a cleaner look
-
-        vless_link = f"vless://{user_uuid}@{host}:{port}?{query_string}#{fragment}"
+        vless_link = template.render(user_uuid, fragment)
         logger.info(f"Generated VLESS link: {vless_link}")
         return vless_link
 
@@ -88,6 +66,27 @@ async def _generate_vless_link(server: Server, user_uuid: str, lang: str) -> str
         logger.error(f"Could not generate VLESS link for UUID {user_uuid} on server {server.name}: {e}")
         raise
 
+def _stored_client_config(subscription: Subscription, user: User) -> Optional[ClientConfig]:
+    """The subscription's X-UI client as the bot created it, or None if its panel settings weren't recorded."""
+    if subscription.total_gb is None:
+        return None
+    return ClientConfig(
+        id=subscription.xui_user_uuid,
+        email=str(user.telegram_id),
+        tgId=str(user.telegram_id),
+        expiryTime=int(subscription.expires_at.timestamp() * 1000),
+        totalGB=subscription.total_gb,
+        flow=subscription.flow or "",
+        limitIp=subscription.limit_ip or 0,
+        subId=subscription.sub_id or ""
+    )
+
+def _record_client_config(subscription: Subscription, client_config: ClientConfig):
+    subscription.total_gb = client_config.totalGB
+    subscription.flow = client_config.flow
+    subscription.limit_ip = client_config.limitIp
+    subscription.sub_id = client_config.subId
+
 async def _create_or_update_vpn_key(session: AsyncSession, user: User, server: Server, days: int, lang: str, is_trial: bool = False) -> tuple[str, datetime]:
     """
     Creates a new VPN key or extends an existing one in X-UI and the local database.
@@ -121,18 +120,26 @@ async def _create_or_update_vpn_key(session: AsyncSession, user: User, server: S
         new_expire_time_ms = int(new_expire_time.timestamp() * 1000)
 
         try:
-            await xui_client.update_client(
+            # The stored panel settings make the extension a single updateClient call;
+            # older subscriptions are read from the panel once and recorded.
+            result = await xui_client.update_client(
                 inbound_id=server.inbound_id,
                 uuid=existing_subscription.xui_user_uuid,
                 new_expiry_time_ms=new_expire_time_ms,
-                new_total_gb=None # We don't modify traffic on extension
+                new_total_gb=None, # We don't modify traffic on extension
+                stored_config=_stored_client_config(existing_subscription, user)
             )
+            _record_client_config(existing_subscription, result["client"])
             existing_subscription.expires_at = new_expire_time
             existing_subscription.is_active = True
+            await mark_first_vpn_activated(session, user)
             logger.success(f"Successfully staged extension for subscription for user {user.telegram_id} until {new_expire_time.isoformat()}")
             vless_link = await _generate_vless_link(server, existing_subscription.xui_user_uuid, lang)
             return vless_link, new_expire_time
 
+        except XUIServerDegradedError:
+            # The panel wasn't contacted; recreating the key would fail the same way.
+            raise
         except XUIClientError as e:
             logger.error(f"XUIClientError while updating key for user {user.telegram_id}: {e}. Falling back to creating a new key.")
             await session.delete(existing_subscription)
@@ -166,7 +173,9 @@ async def _create_or_update_vpn_key(session: AsyncSession, user: User, server: S
             expires_at=expire_time,
             is_active=True
         )
+        _record_client_config(new_subscription, client_config)
         session.add(new_subscription)
+        await mark_first_vpn_activated(session, user)
         logger.info(f"New subscription for user {user.telegram_id} staged for creation in DB.")
 
         vless_link = await _generate_vless_link(server, new_uuid, lang)
@@ -179,28 +188,41 @@ async def _create_or_update_vpn_key(session: AsyncSession, user: User, server: S
         logger.error(f"Unexpected error during new key creation for user {user.telegram_id}: {e}")
         raise
 
-async def _get_main_menu_content(user: User, from_user: AiogramUser, session: AsyncSession) -> tuple[str, InlineKeyboardMarkup]:
-    """Prepares the text and keyboard for the main menu."""
-    lang = user.language_code
+def _main_menu_query(telegram_id: int, now: datetime):
+    """Everything the main menu shows, in one statement: the user's counters and their latest active expiry."""
+    latest_expiry = (
+        select(func.max(Subscription.expires_at))
+        .where(Subscription.user_id == User.telegram_id, Subscription.expires_at > now, Subscription.is_active == True)
+        .scalar_subquery()
+    )
+    return select(
+        User.language_code,
+        User.unassigned_days,
+        User.referral_balance,
+        User.l2_referral_balance,
+        User.referral_count,
+        latest_expiry.label('latest_expiry')
+    ).where(User.telegram_id == telegram_id)
+
+async def _get_main_menu_content(session: AsyncSession, from_user: AiogramUser) -> tuple[str, InlineKeyboardMarkup] | None:
+    """Prepares the text and keyboard for the main menu with a single query. Returns None if the user doesn't exist."""
+    menu = (await session.execute(_main_menu_query(from_user.id, datetime.utcnow()))).first()
+    if menu is None:
+        return None
+    lang = menu.language_code
     
     welcome_message = get_text('welcome', lang).format(full_name=from_user.full_name)
 
-    now = datetime.utcnow()
-    active_subscriptions = (await session.execute(
-        select(Subscription).where(Subscription.user_id == user.telegram_id, Subscription.expires_at > now, Subscription.is_active == True)
-    )).scalars().all()
-
-    if active_subscriptions:
-        latest_expiry = max([sub.expires_at for sub in active_subscriptions])
-        welcome_message += get_text('subscription_active_until', lang).format(expiry_date=latest_expiry.strftime('%Y-%m-%d %H:%M'))
+    if menu.latest_expiry:
+        welcome_message += get_text('subscription_active_until', lang).format(expiry_date=menu.latest_expiry.strftime('%Y-%m-%d %H:%M'))
     else:
         welcome_message += get_text('no_active_subscription', lang)
 
-    if user.unassigned_days > 0:
-        welcome_message += get_text('unassigned_days', lang).format(days=user.unassigned_days)
+    if menu.unassigned_days > 0:
+        welcome_message += get_text('unassigned_days', lang).format(days=menu.unassigned_days)
     
-    total_referrals = (await session.execute(select(func.count(User.id)).where(User.referrer_id == user.telegram_id))).scalar_one()
-    total_earnings = (user.referral_balance + user.l2_referral_balance) / 100
+    total_referrals = menu.referral_count
+    total_earnings = (menu.referral_balance + menu.l2_referral_balance) / 100
     
     if total_referrals > 0:
         welcome_message += get_text('referral_stats', lang).format(referrals=total_referrals, earnings=total_earnings)
@@ -257,7 +279,7 @@ async def command_start_handler(message: Message, command: CommandObject, sessio
             logger.info(f"User {user_id} trying to apply referral code: {referral_code}")
             referrer = (await session.execute(select(User).where(User.referral_code == referral_code))).scalars().first()
             if referrer and referrer.telegram_id != user_id:
-                user.referrer_id = referrer.telegram_id
+                await attach_referral(session, user, referrer)
                 # Give bonus to the new user
                 user.referral_balance += constants.REFERRAL_BONUS_RUPEES * 100
                 await message.answer(get_text('referral_bonus_applied', lang))
@@ -297,7 +319,7 @@ async def command_start_handler(message: Message, command: CommandObject, sessio
         ])
         await message.answer(get_text('welcome_new_user', lang), reply_markup=keyboard)
     else:
-        text, keyboard = await _get_main_menu_content(user, message.from_user, session)
+        text, keyboard = await _get_main_menu_content(session, message.from_user)
         logger.debug(f"Sending message text: {text}")
         await message.answer(text, reply_markup=keyboard)
 
@@ -321,16 +343,22 @@ async def referral_program_handler(message: Message | CallbackQuery, session: As
         user.referral_code = generate_unique_code()
         await session.commit()
 
-    l1_referrals = (await session.execute(select(User).where(User.referrer_id == user.telegram_id).order_by(User.created_at.desc()).limit(10))).scalars().all()
-    total_l1_referrals = (await session.execute(select(func.count(User.id)).where(User.referrer_id == user.telegram_id))).scalar_one()
-    not_activated_referrals = (await session.execute(select(User).where(User.referrer_id == user.telegram_id, User.activated_first_vpn == False).order_by(User.created_at.desc()).limit(10))).scalars().all()
+    # The counters are kept on the user row; the lists are only queried when they aren't empty.
+    total_l1_referrals = user.referral_count
+    l1_referrals = []
+    if user.referral_count:
+        l1_referrals = (await session.execute(select(User).where(User.referrer_id == user.telegram_id).order_by(User.created_at.desc()).limit(10))).scalars().all()
+    not_activated_referrals = []
+    if user.inactive_referral_count:
+        not_activated_referrals = (await session.execute(select(User).where(User.referrer_id == user.telegram_id, User.activated_first_vpn == False).order_by(User.created_at.desc()).limit(10))).scalars().all()
 
     text_parts = [
         get_text('ref_program_title', lang),
         get_text('ref_program_conditions', lang),
         get_text('ref_program_withdrawal', lang),
         "",
-        get_text('ref_total_referrals', lang).format(count=total_l1_referrals)
+        get_text('ref_total_referrals', lang).format(count=total_l1_referrals),
+        get_text('ref_total_l2_referrals', lang).format(count=user.l2_referral_count)
     ]
 
     if l1_referrals:
@@ -384,7 +412,7 @@ async def referral_program_handler(message: Message | CallbackQuery, session: As
 
 @router.message(Command("setlanguage"))
 async def command_set_language_handler(message: Message, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, message.from_user.id)
+    lang = await _get_lang(session, message.from_user.id)
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Русский 🇷🇺", callback_data="set_lang_ru")],
@@ -398,23 +426,23 @@ async def command_set_language_handler(message: Message, session: AsyncSession):
 @router.callback_query(F.data == "main_menu")
 async def callback_main_menu(callback: CallbackQuery, session: AsyncSession, bot: Bot):
     await callback.answer()
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
-    if not user:
+    menu = await _get_main_menu_content(session, callback.from_user)
+    if not menu:
         await callback.message.edit_text(get_text('user_not_found_error', 'ru'))
         return
     
-    text, keyboard = await _get_main_menu_content(user, callback.from_user, session)
+    text, keyboard = menu
     await callback.message.edit_text(text, reply_markup=keyboard)
 
 @router.callback_query(F.data == "show_main_menu_after_welcome")
 async def callback_show_main_menu_after_welcome(callback: CallbackQuery, session: AsyncSession, bot: Bot):
     await callback.answer()
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
-    if not user:
+    menu = await _get_main_menu_content(session, callback.from_user)
+    if not menu:
         await callback.message.edit_text(get_text('user_not_found_error', 'ru'))
         return
     
-    text, keyboard = await _get_main_menu_content(user, callback.from_user, session)
+    text, keyboard = menu
     await callback.message.edit_text(text, reply_markup=keyboard)
 
 @router.callback_query(F.data.startswith("set_lang_"))
@@ -422,8 +450,8 @@ async def callback_set_language(callback: CallbackQuery, session: AsyncSession,
     lang_code = callback.data.split('_')[-1]
     user_id = callback.from_user.id
 
-    user = (await session.execute(select(User).where(User.telegram_id == user_id))).scalars().first()
-    if user:
+    result = await session.execute(update(User).where(User.telegram_id == user_id).values(language_code=lang_code))
+    if result.rowcount:
         language_names = {
             'ru': 'Русский',
             'en': 'English',
@@ -431,12 +459,10 @@ async def callback_set_language(callback: CallbackQuery, session: AsyncSession,
         }
         language_name = language_names.get(lang_code, lang_code)
         await callback.answer(get_text('language_changed', lang_code).format(language=language_name))
-        user.language_code = lang_code
+        text, keyboard = await _get_main_menu_content(session, callback.from_user)
         await session.commit()
+        invalidate_user(user_id)
         
-        await session.refresh(user)
-        
-        text, keyboard = await _get_main_menu_content(user, callback.from_user, session)
         await callback.message.edit_text(text, reply_markup=keyboard)
     else:
         await callback.answer("User not found, please type /start first.", show_alert=True)
@@ -445,12 +471,10 @@ async def callback_set_language(callback: CallbackQuery, session: AsyncSession,
 async def callback_setup_vpn(callback: CallbackQuery, session: AsyncSession) -> None:
     await callback.answer()
     logger.info(f"User {callback.from_user.id} clicked setup_vpn")
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
 
     try:
-        stmt = select(Server).where(Server.is_active == True)
-        result = await session.execute(stmt)
-        servers = result.scalars().all()
+        servers = (await get_catalog(session)).servers
     except Exception as e:
         logger.error(f"Error querying servers: {e}")
         await callback.message.answer(get_text('error_generic', lang))
@@ -460,13 +484,7 @@ async def callback_setup_vpn(callback: CallbackQuery, session: AsyncSession) ->
         await callback.message.answer(get_text('no_servers_available', lang))
         return
 
-    buttons = []
-    for server in servers:
-        server_name_localized = get_db_text(server.name, lang)
-        flag_emoji = constants.COUNTRY_EMOJIS.get(server_name_localized, "")
-        lock_emoji = constants.UNLOCK_EMOJI if server.is_active else constants.LOCK_EMOJI
-        button_text = f"{flag_emoji} {server_name_localized} {lock_emoji}".strip()
-        buttons.append([InlineKeyboardButton(text=button_text, callback_data=f"select_server_{server.id}")])
+    buttons = [[InlineKeyboardButton(text=server.label(lang), callback_data=f"select_server_{server.id}")] for server in servers]
     buttons.append([InlineKeyboardButton(text=get_text('btn_main_menu', lang), callback_data="main_menu")])
     keyboard = InlineKeyboardMarkup(inline_keyboard=buttons)
     
@@ -539,6 +557,9 @@ async def callback_select_server(callback: CallbackQuery, session: AsyncSession,
                 vless_link=vless_link,
                 expiry_date=existing_subscription.expires_at.strftime('%Y-%m-%d %H:%M')
             )
+        except XUIServerDegradedError as e:
+            logger.warning(f"Server {selected_server.id} is degraded, not showing the key: {e}")
+            message_text = get_text('server_degraded', lang).format(server_name=get_db_text(selected_server.name, lang))
         except Exception as e:
             logger.error(f"Unexpected error showing subscription: {e}")
             message_text = get_text('show_subscription_error', lang)
@@ -560,7 +581,7 @@ async def callback_pay_with_referral_balance(callback: CallbackQuery, session: A
         await callback.message.answer(get_text('user_not_found_error', lang))
         return
 
-    tariffs = (await session.execute(select(Tariff).where(Tariff.is_active == True).order_by(Tariff.duration_days))).scalars().all()
+    tariffs = (await get_catalog(session)).tariffs
     if not tariffs:
         await callback.message.answer(get_text('no_tariffs_available', lang))
         return
@@ -671,7 +692,7 @@ async def activate_unassigned_days(callback: CallbackQuery, session: AsyncSessio
 async def callback_pay_subscription(callback: CallbackQuery, session: AsyncSession):
     logger.info(f"User {callback.from_user.id} clicked pay_subscription with data: {callback.data}")
     await callback.answer()    
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     server_id = None
     if callback.data.startswith("pay_subscription_for_server_"):
         try:
@@ -681,9 +702,7 @@ async def callback_pay_subscription(callback: CallbackQuery, session: AsyncSessi
             # server_id remains None, which is handled below
 
     try:
-        stmt = select(Tariff).where(Tariff.is_active == True).order_by(Tariff.duration_days)
-        result = await session.execute(stmt)
-        tariffs = result.scalars().all()
+        tariffs = (await get_catalog(session)).tariffs
     except Exception as e:
         logger.error(f"Error querying tariffs: {e}")
         await callback.message.answer(get_text('error_generic', lang))
@@ -693,7 +712,7 @@ async def callback_pay_subscription(callback: CallbackQuery, session: AsyncSessi
         await callback.message.answer(get_text('no_tariffs_available', lang))
         return
 
-    buttons = [[InlineKeyboardButton(text=f"{get_db_text(tariff.name, lang)} - {tariff.price_rub/100}₽ / {tariff.price_stars}", callback_data=f"select_tariff_{tariff.id}_{server_id if server_id else 'none'}")] for tariff in tariffs]    
+    buttons = [[InlineKeyboardButton(text=tariff.label(lang), callback_data=f"select_tariff_{tariff.id}_{server_id if server_id else 'none'}")] for tariff in tariffs]
     # Add a back button that goes to the server selection if a server was chosen, otherwise main menu
     if server_id:
         buttons.append([InlineKeyboardButton(text=get_text('btn_back_to_server_selection', lang), callback_data=f"select_server_{server_id}")])
@@ -710,11 +729,11 @@ async def process_tariff_selection(callback: CallbackQuery, session: AsyncSessio
     server_id_str = parts[3]
     server_id = int(server_id_str) if server_id_str != 'none' else None
     
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     
     logger.info(f"User {callback.from_user.id} selected tariff {tariff_id} for server {server_id}. Showing payment options.")
 
-    tariff = await session.get(Tariff, tariff_id)
+    tariff = (await get_catalog(session)).tariff(tariff_id)
     if not tariff:
         await callback.message.answer(get_text('tariff_not_found', lang))
         await callback.answer()
@@ -744,7 +763,7 @@ async def callback_pay_cryptobot(callback: CallbackQuery, session: AsyncSession)
     parts = callback.data.split("_")
     tariff_id = int(parts[2])
     server_id_str = parts[3]
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
 
     tariff = await session.get(Tariff, tariff_id)
     if not tariff:
@@ -820,7 +839,7 @@ async def callback_pay_stars(callback: CallbackQuery, session: AsyncSession):
     parts = callback.data.split("_")
     tariff_id = int(parts[2])
     server_id_str = parts[3]
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     
     logger.info(f"User {callback.from_user.id} selected tariff {tariff_id} for server {server_id_str} for Stars payment.")
 
@@ -899,22 +918,22 @@ async def successful_payment_handler(message: Message, session: AsyncSession, bo
                 if server:
                     try:
                         vless_link, _ = await _create_or_update_vpn_key(session, user, server, tariff.duration_days, lang)
-                        await bot.send_message(user.telegram_id, get_text('payment_success_key_created', lang).format(
+                        await queue_message(bot, user.telegram_id, get_text('payment_success_key_created', lang).format(
                             server_name=get_db_text(server.name, lang),
                             vless_link=vless_link,
                             days=tariff.duration_days
-                        ), parse_mode='HTML')
+                        ), parse_mode='HTML', priority=Priority.PAYMENT)
                     except Exception as e:
                         logger.error(f"[Stars Payment] Error creating VPN key for user {user.telegram_id}: {e}", exc_info=True)
                         user.unassigned_days += tariff.duration_days
-                        await bot.send_message(user.telegram_id, get_text('payment_success_key_error_webhook', lang).format(days=tariff.duration_days))
+                        await queue_message(bot, user.telegram_id, get_text('payment_success_key_error_webhook', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
                 else:
                     logger.error(f"[Stars Payment] Server {server_id} not found for user {user.telegram_id}")
                     user.unassigned_days += tariff.duration_days
-                    await bot.send_message(user.telegram_id, get_text('payment_success_days_added_server_fail', lang).format(days=tariff.duration_days))
+                    await queue_message(bot, user.telegram_id, get_text('payment_success_days_added_server_fail', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
             else:
                 user.unassigned_days += tariff.duration_days
-                await bot.send_message(user.telegram_id, get_text('payment_success_days_added', lang).format(days=tariff.duration_days))
+                await queue_message(bot, user.telegram_id, get_text('payment_success_days_added', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
 
             await session.commit()
 
@@ -938,12 +957,14 @@ async def successful_payment_handler(message: Message, session: AsyncSession, bo
             bot_user = await bot.get_me()
             gift_link = f"https://t.me/{bot_user.username}?start=G_{gift_code_str}"
 
-            await bot.send_message(
-                chat_id=buyer.telegram_id,
-                text=get_text('gift_purchase_success', lang).format(
+            await queue_message(
+                bot,
+                buyer.telegram_id,
+                get_text('gift_purchase_success', lang).format(
                     tariff_name=get_db_text(tariff.name, lang),
                     gift_link=gift_link
-                )
+                ),
+                priority=Priority.PAYMENT
             )
 
     except (ValueError, IndexError) as e:
@@ -958,50 +979,45 @@ async def callback_get_free_vpn(callback: CallbackQuery, session: AsyncSession,
     await callback.answer()
     logger.info(f"User {callback.from_user.id} clicked get_free_vpn")
 
+    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+
     # Enhanced check for trial period usage
-    async with async_session_maker() as check_session:
-        user_for_check = (await check_session.execute(select(User).where(User.telegram_id == callback.from_user.id))).scalars().first()
-        lang_for_check = user_for_check.language_code if user_for_check else 'ru'
-
-        if user_for_check and user_for_check.trial_used and callback.from_user.id not in settings.ADMIN_IDS_LIST:
-            # User has already used the trial. Let's give them useful info.
-            trial_server = await check_session.get(Server, settings.TRIAL_SERVER_ID)
-            if not trial_server:
-                await callback.message.edit_text(get_text('trial_already_used', lang_for_check))
-                return
-
-            existing_subscription = (await check_session.execute(
-                select(Subscription).where(
-                    Subscription.user_id == user_for_check.telegram_id,
-                    Subscription.server_id == trial_server.id,
-                    Subscription.is_active == True
-                )
-            )).scalars().first()
-
-            if existing_subscription and existing_subscription.expires_at > datetime.utcnow():
-                vless_link = await _generate_vless_link(trial_server, existing_subscription.xui_user_uuid, lang_for_check)
-                remaining_time = existing_subscription.expires_at - datetime.utcnow()
-                remaining_days = remaining_time.days
-                
-                message_text = get_text('trial_info_and_extend_offer', lang_for_check).format(
-                    vless_link=vless_link,
-                    remaining_days=remaining_days,
-                    expires_at=existing_subscription.expires_at.strftime('%Y-%m-%d %H:%M')
-                )
-
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text=get_text('btn_pay_subscription', lang_for_check), callback_data=f"pay_subscription_for_server_{trial_server.id}")],
-                    [InlineKeyboardButton(text=get_text('btn_main_menu', lang_for_check), callback_data="main_menu")]
-                ])
-
-                await callback.message.edit_text(message_text, reply_markup=keyboard, parse_mode='HTML', disable_web_page_preview=True)
-            else:
-                await callback.message.edit_text(get_text('trial_already_used', lang_for_check))
+    if user and user.trial_used and callback.from_user.id not in settings.ADMIN_IDS_LIST:
+        # User has already used the trial. Let's give them useful info.
+        trial_server = await session.get(Server, settings.TRIAL_SERVER_ID)
+        if not trial_server:
+            await callback.message.edit_text(get_text('trial_already_used', lang))
+            return
+
+        existing_subscription = (await session.execute(
+            select(Subscription).where(
+                Subscription.user_id == user.telegram_id,
+                Subscription.server_id == trial_server.id,
+                Subscription.is_active == True
+            )
+        )).scalars().first()
+
+        if existing_subscription and existing_subscription.expires_at > datetime.utcnow():
+            vless_link = await _generate_vless_link(trial_server, existing_subscription.xui_user_uuid, lang)
+            remaining_time = existing_subscription.expires_at - datetime.utcnow()
+            remaining_days = remaining_time.days
             
-            return # Stop further execution
+            message_text = get_text('trial_info_and_extend_offer', lang).format(
+                vless_link=vless_link,
+                remaining_days=remaining_days,
+                expires_at=existing_subscription.expires_at.strftime('%Y-%m-%d %H:%M')
+            )
 
-    # Continue with the original session from the middleware
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text=get_text('btn_pay_subscription', lang), callback_data=f"pay_subscription_for_server_{trial_server.id}")],
+                [InlineKeyboardButton(text=get_text('btn_main_menu', lang), callback_data="main_menu")]
+            ])
+
+            await callback.message.edit_text(message_text, reply_markup=keyboard, parse_mode='HTML', disable_web_page_preview=True)
+        else:
+            await callback.message.edit_text(get_text('trial_already_used', lang))
+        
+        return # Stop further execution
 
     if not settings.TRIAL_SERVER_ID:
         await callback.message.edit_text(get_text('trial_unavailable', lang))
@@ -1079,7 +1095,7 @@ async def callback_get_free_vpn(callback: CallbackQuery, session: AsyncSession,
 async def callback_gift_subscription(callback: CallbackQuery, session: AsyncSession):
     await callback.answer()
     logger.info(f"User {callback.from_user.id} initiated gift subscription purchase.")
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
 
     yearly_tariff = (await session.execute(select(Tariff).where(Tariff.duration_days >= 365, Tariff.is_active == True))).scalars().first()
 
@@ -1104,7 +1120,7 @@ async def callback_gift_subscription(callback: CallbackQuery, session: AsyncSess
 @router.callback_query(F.data.startswith("pay_gift_stars_"))
 async def callback_pay_gift_stars(callback: CallbackQuery, session: AsyncSession):
     tariff_id = int(callback.data.split('_')[-1])
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     
     tariff = await session.get(Tariff, tariff_id)
     if not tariff: 
@@ -1124,12 +1140,12 @@ async def callback_pay_gift_stars(callback: CallbackQuery, session: AsyncSession
 
 @router.callback_query(F.data == "why_vpn")
 async def callback_why_vpn(callback: CallbackQuery, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     await callback.answer(get_text('tbd', lang), show_alert=True)
 
 @router.callback_query(F.data == "help")
 async def callback_help(callback: CallbackQuery, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     await callback.answer() # Acknowledge the callback
 
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -1144,7 +1160,7 @@ async def callback_help(callback: CallbackQuery, session: AsyncSession):
 
 @router.callback_query(F.data == "terms_of_use")
 async def callback_terms_of_use(callback: CallbackQuery, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     await callback.answer() # Answer the callback query to remove the loading state
     # Create HTML links for terms of service and privacy policy
     terms_of_service_html = f"<a href=\"{settings.TERMS_OF_SERVICE_URL}\">{get_text('license_agreement', lang)}</a>"
@@ -1167,7 +1183,7 @@ async def callback_terms_of_use(callback: CallbackQuery, session: AsyncSession):
 
 @router.callback_query(F.data.startswith("pay_card_"))
 async def callback_pay_card(callback: CallbackQuery, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     await callback.answer()
 
     if not settings.YOOKASSA_SHOP_ID or not settings.YOOKASSA_SECRET_KEY:
@@ -1234,13 +1250,13 @@ async def callback_pay_card(callback: CallbackQuery, session: AsyncSession):
 
 @router.callback_query(F.data.startswith("pay_transfer_"))
 async def callback_pay_transfer(callback: CallbackQuery, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     await callback.answer(get_text('payment_transfer_unavailable', lang), show_alert=True)
 
 
 @router.callback_query(F.data.startswith("pay_gift_card_"))
 async def callback_pay_gift_card(callback: CallbackQuery, session: AsyncSession):
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
     await callback.answer()
 
     if not settings.YOOKASSA_SHOP_ID or not settings.YOOKASSA_SECRET_KEY:
@@ -1301,7 +1317,7 @@ async def callback_pay_trx(callback: CallbackQuery, session: AsyncSession):
     parts = callback.data.split("_")
     tariff_id = int(parts[2])
     server_id_str = parts[3]
-    user, lang = await _get_user_and_lang(session, callback.from_user.id)
+    lang = await _get_lang(session, callback.from_user.id)
 
     tariff = await session.get(Tariff, tariff_id)
     if not tariff:
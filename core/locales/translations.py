@@ -25,6 +25,10 @@ def _load_translations_from_json():
 _load_translations_from_json()
 
 
+def available_languages() -> list[str]:
+    """Language codes that have a translation file."""
+    return list(_loaded_translations)
+
 def get_text(key: str, lang_code: str = 'ru'):
     """
     Returns the translated text for a given key and language code.
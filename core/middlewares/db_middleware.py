@@ -1,10 +1,67 @@
-from typing import Callable, Dict, Any, Awaitable
+from typing import Callable, Dict, Any, Awaitable, Optional
 
 from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
 from aiogram.types import TelegramObject
-from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+
+class LazySession:
+    """
+    Stands in for an AsyncSession and opens the real one on first use, so
+    handlers that never touch the database never create a session. It also
+    remembers whether anything was written since the last commit.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker):
+        self._session_maker = session_maker
+        self._session: Optional[AsyncSession] = None
+        self._wrote = False
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_maker()
+            sync_session = self._session.sync_session
+            event.listen(sync_session, "do_orm_execute", self._on_execute)
+            event.listen(sync_session, "after_flush", self._mark_written)
+            event.listen(sync_session, "after_commit", self._reset_written)
+            event.listen(sync_session, "after_rollback", self._reset_written)
+        return self._session
+
+    @property
+    def opened(self) -> bool:
+        return self._session is not None
+
+    @property
+    def has_writes(self) -> bool:
+        """True if a flush or a DML statement ran, or ORM changes are pending, since the last commit."""
+        if self._session is None:
+            return False
+        return self._wrote or bool(self._session.new or self._session.dirty or self._session.deleted)
+
+    def _on_execute(self, orm_execute_state):
+        if not orm_execute_state.is_select:
+            self._wrote = True
+
+    def _mark_written(self, *args):
+        self._wrote = True
+
+    def _reset_written(self, *args):
+        self._wrote = False
+
+    def __getattr__(self, name: str):
+        return getattr(self.session, name)
+
 
 class DbSessionMiddleware(BaseMiddleware):
+    """
+    Gives handlers a lazily opened session as `session`. The commit is only
+    sent when the handler wrote something. Handlers registered with
+    flags={"db": False} get no session at all.
+    """
+
     def __init__(self, session_maker: async_sessionmaker):
         super().__init__()
         self.session_maker = session_maker
@@ -15,12 +72,20 @@ class DbSessionMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: Dict[str, Any],
     ) -> Any:
-        async with self.session_maker() as session:
-            data['session'] = session
-            try:
-                result = await handler(event, data)
+        if get_flag(data, "db", default=True) is False:
+            return await handler(event, data)
+
+        session = LazySession(self.session_maker)
+        data['session'] = session
+        try:
+            result = await handler(event, data)
+            if session.has_writes:
                 await session.commit()
-                return result
-            except Exception as e:
+            return result
+        except Exception as e:
+            if session.opened:
                 await session.rollback()
-                raise e
\ No newline at end of file
+            raise e
+        finally:
+            if session.opened:
+                await session.close()
@@ -0,0 +1,37 @@
+import time
+from typing import Callable, Dict, Any, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject, CallbackQuery
+
+from core.config import settings
+from core.services.retry_policy import retry_policy, INTERACTIVE
+
+
+def callback_answer_deadline() -> float:
+    """Monotonic time after which the user has stopped waiting on a callback query."""
+    return time.monotonic() + settings.TELEGRAM_CALLBACK_ANSWER_WINDOW
+
+
+class RetryPolicyMiddleware(BaseMiddleware):
+    """
+    Runs user-facing handlers under the INTERACTIVE X-UI retry policy. For
+    callback queries retries also stop once the answer window has passed.
+    Handlers registered with flags={"retry_policy": "background"} make several
+    panel calls and answer the callback up front; they run outside any block,
+    so each X-UI call gets its own BACKGROUND budget.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if get_flag(data, "retry_policy") == "background":
+            return await handler(event, data)
+
+        deadline = callback_answer_deadline() if isinstance(event, CallbackQuery) else None
+        with retry_policy(INTERACTIVE, deadline=deadline):
+            return await handler(event, data)
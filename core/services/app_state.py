@@ -0,0 +1,17 @@
+# core/services/app_state.py
+
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.database.models import AppState
+
+
+async def get_state(session: AsyncSession, key: str) -> Optional[str]:
+    state = await session.get(AppState, key)
+    return state.value if state else None
+
+
+async def set_state(session: AsyncSession, key: str, value: str):
+    """Inserts or updates the key. The caller commits."""
+    await session.merge(AppState(key=key, value=value))
@@ -0,0 +1,322 @@
+# core/services/broadcast_service.py
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from loguru import logger
+from sqlalchemy import select, func, update, exists, and_, not_, or_
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from core.config import settings
+from core.database.models import Broadcast, User, Subscription
+from core.services.job_runner import INSTANCE
+from core.services.message_dispatcher import queue_message, Priority
+
+
+class BroadcastStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+
+
+class Segment(str, Enum):
+    ALL = "all"
+    ACTIVE = "active" # Users with a subscription that has not expired
+    EXPIRED = "expired" # Users who had subscriptions, none of them active now
+    NO_SUBSCRIPTION = "no_subscription" # Users who never had a subscription
+
+
+def recipient_filters(segment: str, language_code: Optional[str] = None) -> list:
+    """WHERE clauses on User selecting the recipients of a segment. Banned users never receive broadcasts."""
+    now = datetime.utcnow()
+    has_active = exists().where(
+        Subscription.user_id == User.telegram_id,
+        Subscription.is_active == True,
+        Subscription.expires_at > now
+    )
+    has_any = exists().where(Subscription.user_id == User.telegram_id)
+
+    filters = [User.is_banned == False]
+    if segment == Segment.ACTIVE:
+        filters.append(has_active)
+    elif segment == Segment.EXPIRED:
+        filters.append(and_(has_any, not_(has_active)))
+    elif segment == Segment.NO_SUBSCRIPTION:
+        filters.append(not_(has_any))
+    elif segment != Segment.ALL:
+        raise ValueError(f"Unknown broadcast segment: {segment}")
+    if language_code:
+        filters.append(User.language_code == language_code)
+    return filters
+
+
+async def count_recipients(session, segment: str, language_code: Optional[str] = None) -> int:
+    return await session.scalar(select(func.count(User.id)).where(*recipient_filters(segment, language_code)))
+
+
+@dataclass
+class BroadcastProgress:
+    """Live counters of a broadcast running in this process; the database copy lags by up to a page."""
+    sent: int
+    failed: int
+    started_at: float = field(default_factory=time.monotonic)
+    _initial: int = 0
+
+    def __post_init__(self):
+        self._initial = self.sent + self.failed
+
+    def rate(self) -> float:
+        """Messages handled per second since this process picked the broadcast up."""
+        elapsed = time.monotonic() - self.started_at
+        return (self.sent + self.failed - self._initial) / elapsed if elapsed > 0 else 0.0
+
+
+_tasks: Dict[int, asyncio.Task] = {}
+_progress: Dict[int, BroadcastProgress] = {}
+
+
+def _delivered_prefix(page: List[Tuple[int, asyncio.Future]]) -> Tuple[Optional[int], int, int]:
+    """
+    Walks the page in recipient order up to the first undelivered message.
+    Returns the last user id of that prefix and its sent/failed counts.
+    """
+    cursor, sent, failed = None, 0, 0
+    for user_pk, future in page:
+        if not future.done() or future.cancelled():
+            break
+        cursor = user_pk
+        if future.exception() is None:
+            sent += 1
+        else:
+            failed += 1
+    return cursor, sent, failed
+
+
+async def _save_progress(session_maker: async_sessionmaker, broadcast_id: int, **values):
+    async with session_maker() as session:
+        await session.execute(update(Broadcast).where(Broadcast.id == broadcast_id).values(**values))
+        await session.commit()
+
+
+# --- Ownership ---
+# Every replica may start or resume broadcasts, so a broadcast is sent by the
+# instance that holds its lease. The owner renews the lease while it sends;
+# when an owner dies, another replica takes over once the lease has passed.
+
+def _lease_is_free(now: datetime):
+    return or_(Broadcast.owner.is_(None), Broadcast.owner == INSTANCE, Broadcast.lease_until < now)
+
+
+async def _claim(session_maker: async_sessionmaker, broadcast_id: int) -> bool:
+    """Takes the lease of an unfinished broadcast. Only one instance can win it."""
+    now = datetime.utcnow()
+    async with session_maker() as session:
+        result = await session.execute(
+            update(Broadcast)
+            .where(
+                Broadcast.id == broadcast_id,
+                Broadcast.status.in_([BroadcastStatus.PENDING, BroadcastStatus.RUNNING]),
+                _lease_is_free(now)
+            )
+            .values(owner=INSTANCE, lease_until=now + timedelta(seconds=settings.BROADCAST_LEASE_SECONDS))
+        )
+        await session.commit()
+    return result.rowcount == 1
+
+
+async def _save_owned_progress(session_maker: async_sessionmaker, broadcast_id: int, **values) -> bool:
+    """
+    Saves progress and renews the lease, as long as this instance still owns
+    the running broadcast. Returns False when it was cancelled or taken over.
+    """
+    values.setdefault("lease_until", datetime.utcnow() + timedelta(seconds=settings.BROADCAST_LEASE_SECONDS))
+    async with session_maker() as session:
+        result = await session.execute(
+            update(Broadcast)
+            .where(Broadcast.id == broadcast_id, Broadcast.owner == INSTANCE, Broadcast.status == BroadcastStatus.RUNNING)
+            .values(**values)
+        )
+        await session.commit()
+    return result.rowcount == 1
+
+
+async def _run(bot: Bot, session_maker: async_sessionmaker, broadcast_id: int):
+    if not await _claim(session_maker, broadcast_id):
+        logger.info(f"Broadcast {broadcast_id} is finished or sent by another instance; not starting it here.")
+        return
+
+    async with session_maker() as session:
+        broadcast = await session.get(Broadcast, broadcast_id)
+        if broadcast.status == BroadcastStatus.PENDING:
+            broadcast.status = BroadcastStatus.RUNNING
+            broadcast.started_at = datetime.utcnow()
+            broadcast.total = await count_recipients(session, broadcast.segment, broadcast.language_code)
+            await session.commit()
+        text, cursor = broadcast.text, broadcast.cursor_user_id
+        sent, failed = broadcast.sent, broadcast.failed
+        filters = recipient_filters(broadcast.segment, broadcast.language_code)
+
+    logger.info(f"Broadcast {broadcast_id}: running from user id {cursor}.")
+    progress = _progress[broadcast_id] = BroadcastProgress(sent, failed)
+
+    def on_done(future: asyncio.Future):
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            progress.sent += 1
+        else:
+            progress.failed += 1
+
+    while True:
+        if not await _save_owned_progress(session_maker, broadcast_id):
+            logger.info(f"Broadcast {broadcast_id} was cancelled or taken over; stopping.")
+            return
+        async with session_maker() as session:
+            # Keyset pagination: only one page of ids is ever held in memory.
+            rows = (await session.execute(
+                select(User.id, User.telegram_id)
+                .where(User.id > cursor, *filters)
+                .order_by(User.id)
+                .limit(settings.BROADCAST_PAGE_SIZE)
+            )).all()
+
+        if not rows:
+            await _save_owned_progress(
+                session_maker, broadcast_id,
+                status=BroadcastStatus.COMPLETED, finished_at=datetime.utcnow(), lease_until=None
+            )
+            logger.info(f"Broadcast {broadcast_id} completed: {sent} sent, {failed} failed.")
+            return
+
+        page: List[Tuple[int, asyncio.Future]] = []
+        try:
+            for user_pk, telegram_id in rows:
+                future = await queue_message(bot, telegram_id, text, priority=Priority.BROADCAST)
+                future.add_done_callback(on_done)
+                page.append((user_pk, future))
+            pending = {future for _, future in page}
+            while pending:
+                # A page can outlast the lease while Telegram makes us wait; keep renewing it.
+                _, pending = await asyncio.wait(pending, timeout=settings.BROADCAST_LEASE_SECONDS / 3)
+                if pending and not await _save_owned_progress(session_maker, broadcast_id):
+                    logger.info(f"Broadcast {broadcast_id} was cancelled or taken over; withdrawing the rest of the page.")
+                    for future in pending:
+                        future.cancel()
+                    return
+        except asyncio.CancelledError:
+            # Save what went out so a restart doesn't message those users again,
+            # withdraw the rest of the page from the dispatcher and give up the
+            # lease, so the next instance to start resumes right away.
+            for _, future in page:
+                future.cancel()
+            page_cursor, page_sent, page_failed = _delivered_prefix(page)
+            progress_values = {"owner": None, "lease_until": None}
+            if page_cursor is not None:
+                progress_values.update(cursor_user_id=page_cursor, sent=sent + page_sent, failed=failed + page_failed)
+            await _save_owned_progress(session_maker, broadcast_id, **progress_values)
+            raise
+
+        page_cursor, page_sent, page_failed = _delivered_prefix(page)
+        if page_cursor is None:
+            # The first message was withdrawn (e.g. the dispatcher stopped), so nothing
+            # on the page went out. Keep the cursor; the broadcast stays running and
+            # continues from here when it is resumed.
+            logger.warning(f"Broadcast {broadcast_id}: nothing delivered after user id {cursor}; pausing.")
+            return
+        cursor, sent, failed = page_cursor, sent + page_sent, failed + page_failed
+        if not await _save_owned_progress(session_maker, broadcast_id, cursor_user_id=cursor, sent=sent, failed=failed):
+            logger.info(f"Broadcast {broadcast_id} was cancelled or taken over; stopping.")
+            return
+
+
+async def _run_logged(bot: Bot, session_maker: async_sessionmaker, broadcast_id: int):
+    try:
+        await _run(bot, session_maker, broadcast_id)
+    except asyncio.CancelledError:
+        logger.info(f"Broadcast {broadcast_id} interrupted; progress saved.")
+        raise
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast_id} failed: {e}", exc_info=True)
+    finally:
+        _tasks.pop(broadcast_id, None)
+        _progress.pop(broadcast_id, None)
+
+
+def start_broadcast(bot: Bot, session_maker: async_sessionmaker, broadcast_id: int) -> asyncio.Task:
+    task = _tasks.get(broadcast_id)
+    if task is None or task.done():
+        task = _tasks[broadcast_id] = asyncio.create_task(_run_logged(bot, session_maker, broadcast_id))
+    return task
+
+
+async def create_broadcast(session, bot: Bot, session_maker: async_sessionmaker, text: str, segment: str,
+                           language_code: Optional[str], created_by: int) -> Broadcast:
+    broadcast = Broadcast(text=text, segment=segment, language_code=language_code, created_by=created_by)
+    session.add(broadcast)
+    await session.commit()
+    logger.info(f"Admin {created_by} started broadcast {broadcast.id} to segment '{segment}' (language: {language_code or 'any'}).")
+    start_broadcast(bot, session_maker, broadcast.id)
+    return broadcast
+
+
+async def cancel_broadcast(session_maker: async_sessionmaker, broadcast_id: int):
+    await _save_progress(
+        session_maker, broadcast_id,
+        status=BroadcastStatus.CANCELLED, finished_at=datetime.utcnow()
+    )
+    task = _tasks.get(broadcast_id)
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+async def resume_broadcasts(bot: Bot, session_maker: async_sessionmaker) -> int:
+    """
+    Starts the unfinished broadcasts nobody is sending: those interrupted by a
+    restart and those whose owner stopped renewing its lease. Returns how many
+    were started here; the claim in _run keeps two instances off one broadcast.
+    """
+    async with session_maker() as session:
+        broadcast_ids = (await session.execute(
+            select(Broadcast.id).where(
+                Broadcast.status.in_([BroadcastStatus.PENDING, BroadcastStatus.RUNNING]),
+                _lease_is_free(datetime.utcnow())
+            )
+        )).scalars().all()
+    resumed = 0
+    for broadcast_id in broadcast_ids:
+        task = _tasks.get(broadcast_id)
+        if task is not None and not task.done():
+            continue
+        logger.info(f"Resuming broadcast {broadcast_id}.")
+        start_broadcast(bot, session_maker, broadcast_id)
+        resumed += 1
+    return resumed
+
+
+async def watch_broadcasts(bot: Bot, session_maker: async_sessionmaker):
+    """Resumes orphaned broadcasts at startup and whenever an owner's lease runs out."""
+    while True:
+        try:
+            await resume_broadcasts(bot, session_maker)
+        except Exception as e:
+            logger.error(f"Could not resume broadcasts: {e}")
+        await asyncio.sleep(settings.BROADCAST_LEASE_SECONDS / 2)
+
+
+async def stop_broadcasts():
+    """Interrupts running broadcasts, saving their cursors and releasing their leases; they stay 'running' and are resumed by the next instance."""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_progress(broadcast_id: int) -> Optional[BroadcastProgress]:
+    return _progress.get(broadcast_id)
@@ -0,0 +1,151 @@
+# core/services/catalog.py
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+from pydantic import BaseModel
+from sqlalchemy import select, update, cast, Integer, String
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from core import constants
+from core.config import settings
+from core.database.models import AppState, Server, Tariff
+from core.locales.translations import available_languages, get_db_text
+from core.services.app_state import get_state, set_state
+
+CATALOG_VERSION_KEY = "catalog_version" # app_state key: bumped by every admin change to servers or tariffs
+
+
+class CatalogServer(BaseModel):
+    id: int
+    name: str
+    labels: Dict[str, str] # Server selection button text per language
+
+    def label(self, lang: Optional[str]) -> str:
+        return self.labels.get(lang) or self.labels['ru']
+
+
+class CatalogTariff(BaseModel):
+    id: int
+    name: Dict[str, str]
+    duration_days: int
+    price_rub: int
+    price_stars: int
+    price_trx: Optional[int] = None
+    labels: Dict[str, str] # Tariff selection button text per language
+
+    def label(self, lang: Optional[str]) -> str:
+        return self.labels.get(lang) or self.labels['ru']
+
+
+class Catalog(BaseModel):
+    """Active servers and tariffs as users see them, with button labels rendered for every language."""
+    version: int
+    servers: List[CatalogServer]
+    tariffs: List[CatalogTariff] # Ordered by duration
+
+    def tariff(self, tariff_id: int) -> Optional[CatalogTariff]:
+        return next((tariff for tariff in self.tariffs if tariff.id == tariff_id), None)
+
+
+def _server_entry(server: Server, languages: List[str]) -> CatalogServer:
+    labels = {}
+    for lang in languages:
+        name = get_db_text(server.name, lang)
+        flag_emoji = constants.COUNTRY_EMOJIS.get(name, "")
+        labels[lang] = f"{flag_emoji} {name} {constants.UNLOCK_EMOJI}".strip()
+    return CatalogServer(id=server.id, name=server.name, labels=labels)
+
+
+def _tariff_entry(tariff: Tariff, languages: List[str]) -> CatalogTariff:
+    labels = {
+        lang: f"{get_db_text(tariff.name, lang)} - {tariff.price_rub/100}₽ / {tariff.price_stars}"
+        for lang in languages
+    }
+    return CatalogTariff(
+        id=tariff.id, name=tariff.name, duration_days=tariff.duration_days, price_rub=tariff.price_rub,
+        price_stars=tariff.price_stars, price_trx=tariff.price_trx, labels=labels
+    )
+
+
+class CatalogCache:
+    """
+    In-memory copy of the catalog. Admin changes bump a version counter in
+    app_state; every replica compares it with its own copy at most once per
+    check interval and reloads when it differs. The replica that made the
+    change drops its copy right away.
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self._catalog: Optional[Catalog] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        # Bumped by invalidate(), so a load that raced with an admin change isn't kept.
+        self._generation = 0
+
+    async def get(self, session: AsyncSession) -> Catalog:
+        catalog = self._catalog
+        if catalog is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return catalog
+        async with self._lock:
+            # Another caller may have reloaded or checked while we waited.
+            if self._catalog is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._catalog
+            generation = self._generation
+            version = int(await get_state(session, CATALOG_VERSION_KEY) or 0)
+            catalog = self._catalog
+            if catalog is None or catalog.version != version:
+                catalog = await self._load(session, version)
+            if self._generation == generation:
+                self._catalog = catalog
+                self._checked_at = time.monotonic()
+            return catalog
+
+    async def _load(self, session: AsyncSession, version: int) -> Catalog:
+        languages = available_languages()
+        servers = (await session.execute(select(Server).where(Server.is_active == True).order_by(Server.id))).scalars().all()
+        tariffs = (await session.execute(
+            select(Tariff).where(Tariff.is_active == True).order_by(Tariff.duration_days)
+        )).scalars().all()
+        catalog = Catalog(
+            version=version,
+            servers=[_server_entry(server, languages) for server in servers],
+            tariffs=[_tariff_entry(tariff, languages) for tariff in tariffs],
+        )
+        logger.info(f"Catalog version {version} loaded: {len(catalog.servers)} servers, {len(catalog.tariffs)} tariffs.")
+        return catalog
+
+    def invalidate(self):
+        self._generation += 1
+        self._catalog = None
+
+
+catalog_cache = CatalogCache(check_interval=settings.CATALOG_VERSION_CHECK_INTERVAL)
+
+
+async def get_catalog(session: AsyncSession) -> Catalog:
+    return await catalog_cache.get(session)
+
+
+async def load_catalog(session_maker: async_sessionmaker):
+    """Loads the catalog at startup, so the first clicks don't wait for it."""
+    async with session_maker() as session:
+        await catalog_cache.get(session)
+
+
+async def bump_catalog_version(session: AsyncSession):
+    """Marks the catalog as changed for every replica. The caller commits, then calls invalidate_catalog()."""
+    result = await session.execute(
+        update(AppState)
+        .where(AppState.key == CATALOG_VERSION_KEY)
+        .values(value=cast(cast(AppState.value, Integer) + 1, String))
+    )
+    if result.rowcount == 0:
+        await set_state(session, CATALOG_VERSION_KEY, "1")
+
+
+def invalidate_catalog():
+    catalog_cache.invalidate()
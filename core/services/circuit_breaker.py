@@ -0,0 +1,55 @@
+# core/services/circuit_breaker.py
+
+import time
+from enum import Enum
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    CLOSED: calls pass; `failure_threshold` failures in a row open the circuit.
+    OPEN: calls are rejected until `recovery_timeout` seconds have passed.
+    HALF_OPEN: a single probe call is let through per `recovery_timeout`;
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int, recovery_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+
+    def allow_request(self) -> bool:
+        if self.state == CircuitState.CLOSED:
+            return True
+        if time.monotonic() - self._opened_at >= self.recovery_timeout:
+            # Re-arm the timer so that only one probe goes out per recovery window,
+            # even if the probe never reports back (e.g. its caller was cancelled).
+            self.state = CircuitState.HALF_OPEN
+            self._opened_at = time.monotonic()
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe will be allowed."""
+        if self.state == CircuitState.CLOSED:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+            self.state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
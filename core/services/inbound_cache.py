@@ -0,0 +1,131 @@
+# core/services/inbound_cache.py
+
+import asyncio
+import time
+from typing import Dict, Optional, Tuple, Union
+
+from loguru import logger
+from pydantic import BaseModel
+
+from core.config import settings
+from core.database.models import Server
+from core.services.xui_client import get_client, Inbound, InboundStream, XUIClientError
+from core.services.vless_links import VlessLinkTemplate
+
+
+class InboundMetadata(BaseModel):
+    """The part of an inbound configuration needed to build client links."""
+    inbound_id: int
+    port: int
+    network: str
+    security: str
+    public_key: Optional[str] = None
+    fingerprint: Optional[str] = None
+    spider_x: Optional[str] = None
+    server_name: Optional[str] = None
+    short_id: Optional[str] = None
+
+    @classmethod
+    def from_inbound(cls, inbound_id: int, inbound: Union[Inbound, InboundStream]) -> "InboundMetadata":
+        stream = inbound.streamSettings
+        metadata = cls(
+            inbound_id=inbound_id,
+            port=inbound.port,
+            network=stream.network,
+            security=stream.security
+        )
+        if stream.security == 'reality' and stream.realitySettings:
+            reality_settings = stream.realitySettings
+            # The public key and fingerprint are nested inside the 'settings' dict of realitySettings
+            nested_settings = reality_settings.settings
+            metadata.public_key = nested_settings.get('publicKey') or None
+            metadata.fingerprint = nested_settings.get('fingerprint') or None
+            metadata.spider_x = nested_settings.get('spiderX') or None
+            if reality_settings.serverNames:
+                metadata.server_name = reality_settings.serverNames[0]
+            if reality_settings.shortIds:
+                metadata.short_id = reality_settings.shortIds[0]
+        return metadata
+
+
+class InboundCache:
+    """
+    Per-server TTL cache of inbound metadata with single-flight refresh:
+    concurrent misses for the same server share one request to the panel.
+    Each entry also holds the compiled VLESS link template, which is only
+    rebuilt when the entry is refreshed.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, InboundMetadata, VlessLinkTemplate]] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._generations: Dict[int, int] = {}
+
+    async def get(self, server: Server) -> InboundMetadata:
+        metadata, _ = await self.get_with_template(server)
+        return metadata
+
+    async def get_template(self, server: Server) -> VlessLinkTemplate:
+        _, template = await self.get_with_template(server)
+        return template
+
+    async def get_with_template(self, server: Server) -> Tuple[InboundMetadata, VlessLinkTemplate]:
+        entry = self._entries.get(server.id)
+        if entry:
+            expires_at, metadata, template = entry
+            if (expires_at > time.monotonic()
+                    and template.inbound_id == server.inbound_id
+                    and template.api_url == server.api_url):
+                return metadata, template
+
+        task = self._inflight.get(server.id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh(server, self._generations.get(server.id, 0)))
+            self._inflight[server.id] = task
+        # Shielded so that a cancelled caller doesn't cancel the fetch other callers wait on.
+        return await asyncio.shield(task)
+
+    async def _refresh(self, server: Server, generation: int) -> Tuple[InboundMetadata, VlessLinkTemplate]:
+        try:
+            xui_client = await get_client(server)
+            # Only the stream settings are parsed; the client list is never validated here.
+            inbound = await xui_client.get_inbound_stream(server.inbound_id)
+            if not inbound:
+                raise XUIClientError(f"Inbound {server.inbound_id} not found on server {server.id}")
+            metadata = InboundMetadata.from_inbound(server.inbound_id, inbound)
+            template = VlessLinkTemplate.compile(server.api_url, metadata)
+            # Don't store a result that was fetched before an explicit invalidation.
+            if self._generations.get(server.id, 0) == generation:
+                self._entries[server.id] = (time.monotonic() + self.ttl, metadata, template)
+                logger.info(f"Inbound {server.inbound_id} metadata for server {server.id} cached for {self.ttl}s.")
+            return metadata, template
+        finally:
+            if self._inflight.get(server.id) is asyncio.current_task():
+                self._inflight.pop(server.id, None)
+
+    def invalidate(self, server_id: Optional[int] = None):
+        """Drops cached metadata for one server, or for all servers if no id is given."""
+        server_ids = [server_id] if server_id is not None else list(set(self._entries) | set(self._inflight))
+        for sid in server_ids:
+            self._entries.pop(sid, None)
+            self._inflight.pop(sid, None)
+            self._generations[sid] = self._generations.get(sid, 0) + 1
+        logger.info(f"Inbound metadata cache invalidated for servers: {server_ids}")
+
+
+inbound_cache = InboundCache(ttl=settings.XUI_INBOUND_CACHE_TTL)
+
+
+async def get_inbound_metadata(server: Server) -> InboundMetadata:
+    """Returns cached link-building metadata for the server's inbound."""
+    return await inbound_cache.get(server)
+
+
+async def get_link_template(server: Server) -> VlessLinkTemplate:
+    """Returns the compiled VLESS link template for the server's inbound."""
+    return await inbound_cache.get_template(server)
+
+
+def invalidate_inbound_cache(server_id: Optional[int] = None):
+    inbound_cache.invalidate(server_id)
@@ -0,0 +1,191 @@
+# core/services/job_runner.py
+
+import asyncio
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from loguru import logger
+from sqlalchemy import text, delete
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, async_sessionmaker
+
+from core.config import settings
+from core.database.models import JobRun
+from core.services.scheduler_jobs import check_expiring_subscriptions, deactivate_expired_users, process_new_expirations
+from core.services.referral_service import repair_referral_counters
+
+INSTANCE = f"{socket.gethostname()}:{os.getpid()}"
+LEADER_LOCK_ID = 4_817_301 # Postgres advisory lock key held by the replica that runs the jobs
+LEADER_CHECK_INTERVAL = 15 # Seconds between a replica's checks that it is (or can become) the leader
+
+
+class LeaderElection:
+    """
+    Only the replica holding a session-level Postgres advisory lock runs
+    scheduler jobs. The lock lives on a dedicated connection, so it is released
+    as soon as the leader exits or loses its database connection, and another
+    replica takes over on its next attempt. Other databases (SQLite in
+    development) have a single instance, which is always the leader.
+    """
+
+    def __init__(self, engine: AsyncEngine, lock_id: int = LEADER_LOCK_ID):
+        self.engine = engine
+        self.lock_id = lock_id
+        self._connection: Optional[AsyncConnection] = None
+
+    async def is_leader(self) -> bool:
+        if self.engine.dialect.name != "postgresql":
+            return True
+        if self._connection is not None:
+            try:
+                await self._connection.execute(text("SELECT 1"))
+                await self._connection.commit()
+                return True
+            except Exception as e:
+                logger.warning(f"Scheduler leader connection lost, re-electing: {e}")
+                await self._close()
+        connection = await self.engine.connect()
+        try:
+            acquired = await connection.scalar(text("SELECT pg_try_advisory_lock(:lock_id)"), {"lock_id": self.lock_id})
+            # Don't leave the connection idle in a transaction while it holds the lock.
+            await connection.commit()
+        except Exception:
+            await connection.close()
+            raise
+        if not acquired:
+            await connection.close()
+            return False
+        self._connection = connection
+        logger.info(f"{INSTANCE} is now the scheduler leader.")
+        return True
+
+    async def release(self):
+        if self._connection is not None:
+            try:
+                await self._connection.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": self.lock_id})
+                await self._connection.commit()
+            except Exception as e:
+                logger.warning(f"Could not release the scheduler leader lock: {e}")
+            await self._close()
+
+    async def _close(self):
+        # Invalidate rather than return to the pool: closing the underlying
+        # database session is what guarantees the lock is gone.
+        try:
+            await self._connection.invalidate()
+            await self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+
+
+_bot: Optional[Bot] = None
+_session_maker: Optional[async_sessionmaker] = None
+_leader: Optional[LeaderElection] = None
+
+
+def configure(bot: Bot, session_maker: async_sessionmaker, engine: AsyncEngine):
+    """Gives the job wrappers the objects they need; jobs are stored without arguments."""
+    global _bot, _session_maker, _leader
+    _bot, _session_maker, _leader = bot, session_maker, LeaderElection(engine)
+
+
+async def shutdown():
+    if _leader:
+        await _leader.release()
+
+
+async def _follow_leadership(scheduler: AsyncIOScheduler, add_jobs: Callable[[AsyncIOScheduler], None], leader: LeaderElection):
+    """Starts the scheduler when this replica becomes the leader and stops it when the lock is lost."""
+    try:
+        is_leader = await leader.is_leader()
+    except Exception as e:
+        logger.error(f"Scheduler leader election failed: {e}")
+        is_leader = False
+    if is_leader and not scheduler.running:
+        add_jobs(scheduler)
+        scheduler.start()
+        logger.info(f"Scheduler started on {INSTANCE}.")
+    elif not is_leader and scheduler.running:
+        scheduler.shutdown(wait=False)
+        # AsyncIOScheduler applies the shutdown on the next loop iteration.
+        await asyncio.sleep(0)
+        logger.warning(f"Scheduler stopped on {INSTANCE}: it is no longer the leader.")
+
+
+async def run_scheduler_on_leader(scheduler: AsyncIOScheduler, add_jobs: Callable[[AsyncIOScheduler], None]):
+    """
+    Runs the scheduler on the leader replica only. APScheduler's SQLAlchemy job
+    store is not safe to share between running schedulers: a follower would pick
+    up due runs and advance their next_run_time, so the leader never saw them.
+    Followers therefore neither start the scheduler nor register jobs; they keep
+    trying for the lock and take over when the leader goes away.
+    """
+    while True:
+        await _follow_leadership(scheduler, add_jobs, _leader)
+        await asyncio.sleep(LEADER_CHECK_INTERVAL)
+
+
+async def run_job(name: str, job: Callable[[], Awaitable[Optional[int]]]):
+    """Runs `job` on the leader replica only and records the run in job_runs."""
+    # Only the leader runs a scheduler; this catches a lock lost since the last leadership check.
+    if not await _leader.is_leader():
+        logger.warning(f"Skipping job {name}: {INSTANCE} lost the scheduler leadership.")
+        return
+
+    async with _session_maker() as session:
+        run = JobRun(job_name=name, instance=INSTANCE, status="running", started_at=datetime.utcnow())
+        session.add(run)
+        await session.commit()
+
+    started = time.monotonic()
+    try:
+        rows_processed = await job()
+        run.status = "success"
+        run.rows_processed = rows_processed
+    except Exception as e:
+        logger.error(f"Scheduler job {name} failed: {e}", exc_info=True)
+        run.status = "failed"
+        run.error = str(e)[:1000]
+    run.finished_at = datetime.utcnow()
+    run.duration = time.monotonic() - started
+
+    async with _session_maker() as session:
+        await session.merge(run)
+        await session.commit()
+
+
+async def prune_job_runs() -> int:
+    cutoff = datetime.utcnow() - timedelta(days=settings.JOB_RUN_RETENTION_DAYS)
+    async with _session_maker() as session:
+        result = await session.execute(delete(JobRun).where(JobRun.started_at < cutoff))
+        await session.commit()
+    return result.rowcount
+
+
+# --- Job entry points ---
+# The persistent job store keeps a reference to the function only, so every
+# job is a module-level coroutine without arguments.
+
+async def expiring_subscriptions_job():
+    await run_job("check_expiring_subscriptions", lambda: check_expiring_subscriptions(_bot, _session_maker))
+
+
+async def expired_users_sweep_job():
+    await run_job("deactivate_expired_users", lambda: deactivate_expired_users(_session_maker))
+
+
+async def new_expirations_job():
+    await run_job("process_new_expirations", lambda: process_new_expirations(_session_maker))
+
+
+async def prune_job_runs_job():
+    await run_job("prune_job_runs", prune_job_runs)
+
+
+async def referral_counters_repair_job():
+    await run_job("repair_referral_counters", lambda: repair_referral_counters(_session_maker))
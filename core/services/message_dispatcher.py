@@ -0,0 +1,275 @@
+# core/services/message_dispatcher.py
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError, TelegramServerError
+from loguru import logger
+
+from core.config import settings
+from core.services.rate_limiter import TokenBucket
+
+
+class Priority(IntEnum):
+    """Send lanes, served strictly in this order."""
+    PAYMENT = 0 # Payment confirmations and keys the user just paid for
+    ADMIN = 1 # Notices to admins
+    REMINDER = 2 # Scheduled reminders
+    BROADCAST = 3 # Mass mailings
+
+
+# Lanes that can be filled in bulk are bounded, so producers wait instead of
+# buffering everything in memory. Payment and admin lanes never block.
+_BOUNDED_LANES = (Priority.REMINDER, Priority.BROADCAST)
+
+MAX_SEND_ATTEMPTS = 3
+LATENCY_WINDOW = 1000 # Recent messages kept for latency percentiles
+
+
+@dataclass
+class OutgoingMessage:
+    chat_id: int
+    text: str
+    priority: Priority
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+    send_at: Optional[float] = None # Reserved per-chat slot of the next attempt
+
+
+class MessageDispatcher:
+    """
+    Central outbound queue for bot messages. Respects Telegram's global limit
+    with a token bucket, paces messages to the same chat, serves priority lanes
+    in order and waits out 429 `retry_after` responses for all workers. A
+    message whose chat slot is still ahead is set aside until then, so the
+    worker moves on to the next message instead of waiting for it.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float, per_chat_interval: float, lane_size: int, workers: int = 8):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self._bucket = TokenBucket(global_rate)
+        self._lanes: Dict[Priority, Deque[OutgoingMessage]] = {priority: deque() for priority in Priority}
+        self._lane_slots = {priority: asyncio.Semaphore(lane_size) for priority in _BOUNDED_LANES}
+        self._available = asyncio.Semaphore(0) # Number of queued messages across all lanes
+        # chat_id -> earliest time of the chat's next send. Slots in the past are
+        # pruned every minute, so only recently messaged chats are kept.
+        self._chat_next_at: Dict[int, float] = {}
+        # id(message) -> (timer that puts it back on its lane, message)
+        self._deferred: Dict[int, Tuple[asyncio.TimerHandle, OutgoingMessage]] = {}
+        self._paused_until = 0.0
+        self._tasks: list = []
+        self._counters = {"sent": 0, "failed": 0, "retried": 0, "flood_waits": 0}
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    # --- Producer API ---
+
+    async def enqueue(self, chat_id: int, text: str, priority: Priority = Priority.REMINDER, **kwargs) -> asyncio.Future:
+        """
+        Queues a message and returns a future resolved with the sent Message or
+        the final error. Waits for room when a bulk lane is full.
+        """
+        if priority in self._lane_slots:
+            await self._lane_slots[priority].acquire()
+        future = asyncio.get_running_loop().create_future()
+        # Fire-and-forget callers never look at the result; don't warn about it.
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._put(OutgoingMessage(chat_id, text, priority, kwargs, future))
+        return future
+
+    async def send(self, chat_id: int, text: str, priority: Priority = Priority.PAYMENT, **kwargs):
+        """Queues a message and waits until it is delivered."""
+        return await (await self.enqueue(chat_id, text, priority, **kwargs))
+
+    def _put(self, message: OutgoingMessage, front: bool = False):
+        lane = self._lanes[message.priority]
+        lane.appendleft(message) if front else lane.append(message)
+        self._available.release()
+
+    def _take(self) -> OutgoingMessage:
+        for priority in Priority:
+            lane = self._lanes[priority]
+            if lane:
+                message = lane.popleft()
+                if priority in self._lane_slots and message.attempts == 0 and message.send_at is None:
+                    self._lane_slots[priority].release()
+                return message
+        raise RuntimeError("Message queue signalled but empty")
+
+    # --- Workers ---
+
+    async def _worker(self):
+        while True:
+            await self._available.acquire()
+            message = self._take()
+            try:
+                await self._deliver(message)
+            except asyncio.CancelledError:
+                if not message.future.done():
+                    message.future.cancel()
+                raise
+
+    async def _deliver(self, message: OutgoingMessage):
+        if message.future.cancelled():
+            return # The producer withdrew it, e.g. a stopped broadcast
+        now = time.monotonic()
+        if message.send_at is None:
+            # Reserve the chat's next slot so later messages to it queue up behind this one.
+            message.send_at = max(now, self._chat_next_at.get(message.chat_id, 0.0))
+            self._chat_next_at[message.chat_id] = message.send_at + self.per_chat_interval
+        if message.send_at > now:
+            self._defer(message, message.send_at - now)
+            return
+        if self._paused_until > time.monotonic():
+            await asyncio.sleep(self._paused_until - time.monotonic())
+        await self._bucket.acquire()
+
+        message.attempts += 1
+        try:
+            result = await self.bot.send_message(chat_id=message.chat_id, text=message.text, **message.kwargs)
+        except TelegramRetryAfter as e:
+            self._counters["flood_waits"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            logger.warning(f"Telegram flood control: pausing all sends for {e.retry_after}s.")
+            self._retry_or_fail(message, e)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            self._retry_or_fail(message, e)
+        except Exception as e:
+            self._fail(message, e)
+        else:
+            self._counters["sent"] += 1
+            self._latencies.append(time.monotonic() - message.enqueued_at)
+            if not message.future.done():
+                message.future.set_result(result)
+
+    def _retry_or_fail(self, message: OutgoingMessage, error: Exception):
+        if message.attempts >= MAX_SEND_ATTEMPTS:
+            self._fail(message, error)
+            return
+        self._counters["retried"] += 1
+        message.send_at = None
+        self._put(message, front=True)
+
+    def _defer(self, message: OutgoingMessage, delay: float):
+        """Puts `message` back on its lane after `delay` seconds."""
+        key = id(message)
+
+        def _release():
+            del self._deferred[key]
+            self._put(message)
+
+        self._deferred[key] = (asyncio.get_running_loop().call_later(delay, _release), message)
+
+    def _fail(self, message: OutgoingMessage, error: Exception):
+        self._counters["failed"] += 1
+        logger.error(f"Failed to send message to {message.chat_id} after {message.attempts} attempt(s): {error}")
+        if not message.future.done():
+            message.future.set_exception(error)
+
+    # --- Lifecycle and metrics ---
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._housekeeping()))
+        logger.info(f"Message dispatcher started with {self.workers} workers.")
+
+    async def stop(self, drain_timeout: float = 10):
+        """Gives queued messages up to `drain_timeout` seconds to go out, then stops the workers."""
+        deadline = time.monotonic() + drain_timeout
+        while self.queue_depth() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for handle, message in self._deferred.values():
+            handle.cancel()
+            message.future.cancel()
+        self._deferred.clear()
+        for lane in self._lanes.values():
+            while lane:
+                lane.popleft().future.cancel()
+        logger.info(f"Message dispatcher stopped. {self.stats()}")
+
+    def queue_depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values()) + len(self._deferred)
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3)
+
+        return {
+            **self._counters,
+            "queued": {priority.name.lower(): len(lane) for priority, lane in self._lanes.items()},
+            "deferred": len(self._deferred),
+            "latency_p50_s": percentile(0.50),
+            "latency_p99_s": percentile(0.99),
+            "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+
+    def _prune_chat_slots(self):
+        """Forgets chats whose next slot has passed; their next message can go out right away anyway."""
+        now = time.monotonic()
+        self._chat_next_at = {chat_id: next_at for chat_id, next_at in self._chat_next_at.items() if next_at > now}
+
+    async def _housekeeping(self):
+        while True:
+            await asyncio.sleep(60)
+            self._prune_chat_slots()
+            if self.queue_depth() or self._latencies:
+                logger.info(f"Message dispatcher: {self.stats()}")
+
+
+_dispatcher: Optional[MessageDispatcher] = None
+
+
+def start_dispatcher(bot: Bot) -> MessageDispatcher:
+    global _dispatcher
+    _dispatcher = MessageDispatcher(
+        bot,
+        global_rate=settings.TELEGRAM_GLOBAL_RATE,
+        per_chat_interval=settings.TELEGRAM_PER_CHAT_INTERVAL,
+        lane_size=settings.MESSAGE_QUEUE_LANE_SIZE
+    )
+    _dispatcher.start()
+    return _dispatcher
+
+
+async def stop_dispatcher():
+    global _dispatcher
+    if _dispatcher:
+        await _dispatcher.stop()
+        _dispatcher = None
+
+
+def get_dispatcher() -> Optional[MessageDispatcher]:
+    return _dispatcher
+
+
+async def queue_message(bot: Bot, chat_id: int, text: str, priority: Priority = Priority.REMINDER, **kwargs) -> asyncio.Future:
+    """
+    Queues a message on the running dispatcher. Outside the application (scripts,
+    tests without a dispatcher) the message is sent right away instead.
+    """
+    if _dispatcher is not None:
+        return await _dispatcher.enqueue(chat_id, text, priority, **kwargs)
+    future = asyncio.get_running_loop().create_future()
+    try:
+        future.set_result(await bot.send_message(chat_id=chat_id, text=text, **kwargs))
+    except Exception as e:
+        logger.error(f"Failed to send message to {chat_id}: {e}")
+        future.set_exception(e)
+        future.exception() # Mark as retrieved for fire-and-forget callers
+    return future
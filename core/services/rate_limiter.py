@@ -0,0 +1,32 @@
+# core/services/rate_limiter.py
+
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    Token bucket for pacing outgoing calls: `rate` tokens per second, bursts of
+    up to `capacity`. Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
@@ -0,0 +1,118 @@
+# core/services/referral_service.py
+
+from loguru import logger
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import aliased
+
+from core.database.models import User
+
+REPAIR_BATCH_SIZE = 5000 # User ids checked per statement by the repair job
+
+
+async def attach_referral(session: AsyncSession, user: User, referrer: User):
+    """
+    Makes `referrer` the user's direct referrer and updates the referral
+    counters of the referrer and of the referrer's own referrer. Counters are
+    incremented in SQL, so concurrent sign-ups under one referrer don't
+    overwrite each other. The caller commits.
+    """
+    user.referrer_id = referrer.telegram_id
+    await session.execute(
+        update(User)
+        .where(User.telegram_id == referrer.telegram_id)
+        .values(
+            referral_count=User.referral_count + 1,
+            inactive_referral_count=User.inactive_referral_count + (0 if user.activated_first_vpn else 1),
+            # The user's own referrals become second-level referrals of the referrer.
+            l2_referral_count=User.l2_referral_count + (user.referral_count or 0),
+        )
+    )
+    if referrer.referrer_id:
+        await session.execute(
+            update(User)
+            .where(User.telegram_id == referrer.referrer_id)
+            .values(l2_referral_count=User.l2_referral_count + 1)
+        )
+
+
+async def mark_first_vpn_activated(session: AsyncSession, user: User):
+    """Flags the user's first VPN activation and takes them off their referrer's not-activated count. The caller commits."""
+    if user.activated_first_vpn:
+        return
+    # Conditional update, so two concurrent activations decrement the referrer only once.
+    result = await session.execute(
+        update(User)
+        .where(User.telegram_id == user.telegram_id, User.activated_first_vpn == False)
+        .values(activated_first_vpn=True)
+    )
+    if result.rowcount and user.referrer_id:
+        await session.execute(
+            update(User)
+            .where(User.telegram_id == user.referrer_id)
+            .values(inactive_referral_count=User.inactive_referral_count - 1)
+        )
+
+
+async def detach_referral(session: AsyncSession, user: User):
+    """Removes a user who is about to be deleted from the counters of their referrers. The caller commits."""
+    if not user.referrer_id:
+        return
+    referrer = (await session.execute(select(User).where(User.telegram_id == user.referrer_id))).scalars().first()
+    if not referrer:
+        return
+    await session.execute(
+        update(User)
+        .where(User.telegram_id == referrer.telegram_id)
+        .values(
+            referral_count=User.referral_count - 1,
+            inactive_referral_count=User.inactive_referral_count - (0 if user.activated_first_vpn else 1),
+            l2_referral_count=User.l2_referral_count - user.referral_count,
+        )
+    )
+    if referrer.referrer_id:
+        await session.execute(
+            update(User)
+            .where(User.telegram_id == referrer.referrer_id)
+            .values(l2_referral_count=User.l2_referral_count - 1)
+        )
+
+
+def _expected_counters() -> dict:
+    """Correlated subqueries computing each counter from the referrer_id links of the outer users row."""
+    referral = aliased(User)
+    parent = aliased(User)
+    return {
+        "referral_count": select(func.count()).select_from(referral)
+            .where(referral.referrer_id == User.telegram_id).scalar_subquery(),
+        "inactive_referral_count": select(func.count()).select_from(referral)
+            .where(referral.referrer_id == User.telegram_id, referral.activated_first_vpn == False).scalar_subquery(),
+        "l2_referral_count": select(func.count()).select_from(referral)
+            .join(parent, referral.referrer_id == parent.telegram_id)
+            .where(parent.referrer_id == User.telegram_id).scalar_subquery(),
+    }
+
+
+async def repair_referral_counters(session_maker: async_sessionmaker) -> int:
+    """
+    Recomputes the referral counters and fixes the users whose stored values
+    drifted. Walks the table in id ranges, so each statement stays short.
+    Returns the number of users fixed.
+    """
+    expected = _expected_counters()
+    drifted = or_(*[getattr(User, column) != value for column, value in expected.items()])
+    repaired = 0
+    async with session_maker() as session:
+        max_id = (await session.execute(select(func.max(User.id)))).scalar() or 0
+        for start in range(0, max_id, REPAIR_BATCH_SIZE):
+            result = await session.execute(
+                update(User)
+                .where(User.id > start, User.id <= start + REPAIR_BATCH_SIZE, drifted)
+                .values(**expected)
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            repaired += result.rowcount
+    if repaired:
+        logger.warning(f"Repaired referral counters of {repaired} users.")
+    return repaired
@@ -0,0 +1,74 @@
+# core/services/retry_policy.py
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from tenacity import RetryCallState, wait_exponential_jitter
+from tenacity.stop import stop_base
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How hard a class of X-UI calls retries transient failures."""
+    name: str
+    max_attempts: int
+    budget: float # Seconds for the whole call, retries and backoff included
+    initial_backoff: float
+    max_backoff: float
+    jitter: float
+
+    def wait(self, deadline: float):
+        """Exponential backoff with jitter that never sleeps past the deadline."""
+        backoff = wait_exponential_jitter(initial=self.initial_backoff, max=self.max_backoff, jitter=self.jitter)
+        return lambda retry_state: max(0.0, min(backoff(retry_state), deadline - time.monotonic()))
+
+
+# A user is waiting on the other end: give up quickly and show an error.
+INTERACTIVE = RetryPolicy("interactive", max_attempts=3, budget=8, initial_backoff=0.25, max_backoff=1, jitter=0.25)
+# Scheduler jobs and scripts: nobody is waiting, ride out short panel outages.
+BACKGROUND = RetryPolicy("background", max_attempts=5, budget=120, initial_backoff=1, max_backoff=20, jitter=1)
+
+
+class stop_at_deadline(stop_base):
+    """Stops retrying when not even the shortest backoff fits before the deadline."""
+
+    def __init__(self, deadline: float, min_backoff: float):
+        self.deadline = deadline
+        self.min_backoff = min_backoff
+
+    def __call__(self, retry_state: RetryCallState) -> bool:
+        return time.monotonic() + self.min_backoff >= self.deadline
+
+
+_current_policy: ContextVar[Optional[Tuple[RetryPolicy, float]]] = ContextVar("xui_retry_policy", default=None)
+
+
+@contextmanager
+def retry_policy(policy: RetryPolicy, deadline: Optional[float] = None):
+    """
+    Applies `policy` to every X-UI call made inside the block. `deadline` is an
+    absolute `time.monotonic()` value; the effective deadline is the earliest of
+    it, the policy budget and the deadline of an enclosing block.
+    """
+    effective_deadline = time.monotonic() + policy.budget
+    if deadline is not None:
+        effective_deadline = min(effective_deadline, deadline)
+    outer = _current_policy.get()
+    if outer is not None:
+        effective_deadline = min(effective_deadline, outer[1])
+    token = _current_policy.set((policy, effective_deadline))
+    try:
+        yield
+    finally:
+        _current_policy.reset(token)
+
+
+def current_retry_policy() -> Tuple[RetryPolicy, float]:
+    """Returns the active policy and its absolute deadline. Calls outside any block use BACKGROUND."""
+    current = _current_policy.get()
+    if current is None:
+        return BACKGROUND, time.monotonic() + BACKGROUND.budget
+    return current
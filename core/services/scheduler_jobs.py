@@ -1,78 +1,231 @@
 # core/services/scheduler_jobs.py
 
+import asyncio
 from aiogram import Bot
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy import select, update
 from loguru import logger
 from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
 
-from core.database.models import Subscription, User, Server, Tariff
-from core.services.xui_client import get_client, XUIClientError
+from core.config import settings
+from core.database.models import Subscription, User, Server
+from core.services.xui_client import get_client, XUIClientError, XUIServerDegradedError
+from core.services.retry_policy import retry_policy, BACKGROUND
+from core.services.message_dispatcher import queue_message, Priority
+from core.services.app_state import get_state, set_state
+from core.locales.translations import get_text, get_db_text
 
-async def check_expiring_subscriptions(bot: Bot, session: AsyncSession):
+DEACTIVATION_BATCH_SIZE = 500 # Subscription ids per UPDATE statement
+REMINDER_FETCH_SIZE = 1000 # Rows per round trip of the streamed reminder query
+EXPIRY_HIGH_WATER_MARK_KEY = "expiry_high_water_mark" # app_state key: expiry time processed up to
+
+async def check_expiring_subscriptions(bot: Bot, session_maker: async_sessionmaker) -> int:
+    """
+    Sends a renewal reminder for every subscription expiring in about three days.
+    Rows are streamed from a single joined query straight into the message
+    dispatcher's reminder lane; a full lane pauses the query, so memory stays
+    flat however many subscriptions expire.
+    """
     logger.info("Scheduler job: Checking for expiring subscriptions...")
-    three_days_from_now = datetime.utcnow() + timedelta(days=3)
+    now = datetime.utcnow()
 
-    stmt = select(Subscription).where(
-        Subscription.is_active == True,
-        Subscription.expires_at >= datetime.utcnow() + timedelta(days=2, hours=23),
-        Subscription.expires_at < three_days_from_now
+    stmt = (
+        select(Subscription.user_id, Subscription.server_id, User.username, User.language_code, Server.name)
+        .join(User, User.telegram_id == Subscription.user_id)
+        .join(Server, Server.id == Subscription.server_id)
+        .where(
+            Subscription.is_active == True,
+            Subscription.expires_at >= now + timedelta(days=2, hours=23),
+            Subscription.expires_at < now + timedelta(days=3)
+        )
+        .execution_options(yield_per=REMINDER_FETCH_SIZE)
     )
-    result = await session.execute(stmt)
-    expiring_subscriptions = await (await result.scalars()).all()
 
-    logger.info(f"Found {len(expiring_subscriptions)} subscriptions expiring soon.")
+    stats = {"sent": 0, "failed": 0}
+    pending = set()
 
-    for sub in expiring_subscriptions:
-        user = await session.get(User, sub.user_id)
-        server = await session.get(Server, sub.server_id)
-        if user and server:
-            try:
-                # TODO: Add a renewal button
-                await bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=f"Здравствуйте, {user.username or 'пользователь'}!\n\n"
-                         f"Ваша подписка на сервер \"{server.name}\" истекает через 3 дня.\n\n"
-                         f"Чтобы продлить ее и не потерять доступ, пожалуйста, оплатите подписку."
-                )
-                logger.info(f"Sent renewal reminder to user {user.telegram_id} for server {server.name}")
-            except Exception as e:
-                logger.error(f"Failed to send renewal reminder to {user.telegram_id}: {e}")
+    def _on_sent(future: asyncio.Future, chat_id: int):
+        pending.discard(future)
+        if future.cancelled() or future.exception():
+            stats["failed"] += 1
+            logger.error(f"Failed to send renewal reminder to {chat_id}: {'cancelled' if future.cancelled() else future.exception()}")
+        else:
+            stats["sent"] += 1
 
-async def deactivate_expired_users(session: AsyncSession):
+    found = 0
+    async with session_maker() as session:
+        result = await session.stream(stmt)
+        async for user_id, server_id, username, lang, server_name in result:
+            found += 1
+            lang = lang or 'ru'
+            text = get_text('subscription_expiry_reminder', lang).format(
+                name=username or get_text('default_user_name', lang),
+                server_name=get_db_text(server_name, lang)
+            )
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+                InlineKeyboardButton(text=get_text('btn_renew_subscription', lang), callback_data=f"select_server_{server_id}")
+            ]])
+            future = await queue_message(bot, user_id, text, priority=Priority.REMINDER, reply_markup=keyboard)
+            pending.add(future)
+            future.add_done_callback(lambda f, chat_id=user_id: _on_sent(f, chat_id))
+
+    logger.info(f"Found {found} subscriptions expiring soon.")
+    if pending:
+        await asyncio.gather(*list(pending), return_exceptions=True)
+    logger.info(f"Renewal reminders: {stats['sent']} sent, {stats['failed']} failed.")
+    return found
+
+
+async def deactivate_expired_users(session_maker: async_sessionmaker) -> int:
+    """
+    Daily sweep: removes every expired client from X-UI and marks its
+    subscription inactive. The minute-by-minute `process_new_expirations`
+    handles almost everything; the sweep catches what it left behind,
+    e.g. deletes that failed while a panel was down.
+    """
     logger.info("Scheduler job: Deactivating expired users...")
     now = datetime.utcnow()
 
-    stmt = select(Subscription).where(
-        Subscription.is_active == True,
-        Subscription.expires_at < now
-    )
-    result = await session.execute(stmt)
-    expired_subscriptions = await (await result.scalars()).all()
-
-    logger.info(f"Found {len(expired_subscriptions)} expired subscriptions to deactivate.")
-
-    for sub in expired_subscriptions:
-        user = await session.get(User, sub.user_id)
-        server = await session.get(Server, sub.server_id)
-        if not (user and server):
-            continue
-
-        try:
-            logger.info(f"Deactivating client {sub.xui_user_uuid} on server {server.name} for user {user.telegram_id}")
-            xui_client = get_client(server)
-            await xui_client.delete_user(server.inbound_id, sub.xui_user_uuid)
-            sub.is_active = False
-            # We don't notify the user upon deactivation to avoid being spammy
-            # They will find out when they try to use the VPN or check the bot
-            logger.info(f"Successfully deactivated user {user.telegram_id} from server {server.name}")
-        except XUIClientError as e:
-            if "Client not found" in str(e): # Handle cases where client is already deleted in X-UI
-                sub.is_active = False
-                logger.warning(f"Client {sub.xui_user_uuid} was already deleted in X-UI. Marking as inactive in DB.")
-            else:
-                logger.error(f"XUI error deactivating {user.telegram_id} from server {server.name}: {e}")
-        except Exception as e:
-            logger.error(f"Unexpected error deactivating {user.telegram_id} from server {server.name}: {e}")
-    
-    await session.commit()
+    async with session_maker() as session:
+        rows = (await session.execute(
+            select(Subscription.id, Subscription.xui_user_uuid, Server)
+            .join(Server, Server.id == Subscription.server_id)
+            .where(Subscription.is_active == True, Subscription.expires_at < now)
+        )).all()
+
+    logger.info(f"Found {len(rows)} expired subscriptions to deactivate.")
+    return len(await _deactivate_subscriptions(session_maker, rows, now))
+
+
+async def process_new_expirations(session_maker: async_sessionmaker) -> int:
+    """
+    Incremental expiry: deactivates subscriptions that expired since the
+    previous run. The high-water mark is kept in app_state, so each run reads
+    only the delta through the (is_active, expires_at) index. It only moves
+    past rows that were deactivated: a failed delete holds it back, so the
+    next run retries that row.
+    """
+    now = datetime.utcnow()
+
+    async with session_maker() as session:
+        stored = await get_state(session, EXPIRY_HIGH_WATER_MARK_KEY)
+        # On the very first run look back one day; anything older is left to the daily sweep.
+        since = datetime.fromisoformat(stored) if stored else now - timedelta(days=1)
+        rows = (await session.execute(
+            select(Subscription.id, Subscription.xui_user_uuid, Server, Subscription.expires_at)
+            .join(Server, Server.id == Subscription.server_id)
+            .where(
+                Subscription.is_active == True,
+                Subscription.expires_at >= since,
+                Subscription.expires_at < now
+            )
+        )).all()
+
+    deactivated_ids = set()
+    if rows:
+        logger.info(f"Found {len(rows)} subscriptions expired since {since.isoformat()}.")
+        deactivated_ids = set(await _deactivate_subscriptions(
+            session_maker, [(subscription_id, xui_user_uuid, server) for subscription_id, xui_user_uuid, server, _ in rows], now
+        ))
+
+    # Rows that are still active are read again by the next run; ones renewed
+    # meanwhile no longer match its query, so they don't hold the mark for long.
+    left_behind = [expires_at for subscription_id, _, _, expires_at in rows if subscription_id not in deactivated_ids]
+    high_water_mark = min(left_behind) if left_behind else now
+    if left_behind:
+        logger.warning(f"{len(left_behind)} expired subscriptions were not deactivated; holding the expiry mark at {high_water_mark.isoformat()}.")
+    async with session_maker() as session:
+        await set_state(session, EXPIRY_HIGH_WATER_MARK_KEY, high_water_mark.isoformat())
+        await session.commit()
+    return len(deactivated_ids)
+
+
+async def _deactivate_subscriptions(session_maker: async_sessionmaker, rows, now: datetime) -> List[int]:
+    """
+    Deletes the clients of `rows` (subscription id, client uuid, server) from
+    X-UI and marks the deleted ones inactive. Servers are processed
+    concurrently, each with at most EXPIRY_DELETE_CONCURRENCY deletes in flight.
+    Returns the ids of the subscriptions deactivated.
+    """
+    if not rows:
+        return []
+
+    by_server: Dict[int, Tuple[Server, List[Tuple[int, str]]]] = {}
+    for subscription_id, xui_user_uuid, server in rows:
+        by_server.setdefault(server.id, (server, []))[1].append((subscription_id, xui_user_uuid))
+
+    results = await asyncio.gather(*[
+        _delete_expired_clients(session_maker, server, subscriptions, now)
+        for server, subscriptions in by_server.values()
+    ])
+    deactivated_ids = [subscription_id for server_ids in results for subscription_id in server_ids]
+
+    async with session_maker() as session:
+        for start in range(0, len(deactivated_ids), DEACTIVATION_BATCH_SIZE):
+            batch = deactivated_ids[start:start + DEACTIVATION_BATCH_SIZE]
+            # A subscription extended while the job was running keeps its active flag.
+            await session.execute(
+                update(Subscription)
+                .where(Subscription.id.in_(batch), Subscription.expires_at < now)
+                .values(is_active=False)
+            )
+        await session.commit()
+
+    logger.info(f"Deactivated {len(deactivated_ids)} of {len(rows)} expired subscriptions on {len(by_server)} servers.")
+    return deactivated_ids
+
+
+async def _is_still_expired(session_maker: async_sessionmaker, subscription_id: int, now: datetime) -> bool:
+    async with session_maker() as session:
+        return await session.scalar(
+            select(Subscription.id).where(Subscription.id == subscription_id, Subscription.expires_at < now)
+        ) is not None
+
+
+async def _delete_expired_clients(session_maker: async_sessionmaker, server: Server, subscriptions: List[Tuple[int, str]], now: datetime) -> List[int]:
+    """Deletes the clients of one server and returns the ids of subscriptions that are gone from X-UI."""
+    try:
+        xui_client = await get_client(server)
+    except Exception as e:
+        logger.error(f"Could not create X-UI client for server {server.name}: {e}")
+        return []
+
+    deactivated: List[int] = []
+    pending = iter(subscriptions)
+    degraded = False
+
+    async def worker():
+        nonlocal degraded
+        for subscription_id, xui_user_uuid in pending:
+            if degraded:
+                return
+            try:
+                # The ids were picked before any panel call; a renewal since then has
+                # already extended the client on the panel, which must not be deleted.
+                if not await _is_still_expired(session_maker, subscription_id, now):
+                    logger.info(f"Subscription {subscription_id} was renewed while expiring; keeping client {xui_user_uuid}.")
+                    continue
+                # Each delete gets its own budget; a long job must not starve the last ones.
+                with retry_policy(BACKGROUND):
+                    await xui_client.delete_client(server.inbound_id, xui_user_uuid)
+                deactivated.append(subscription_id)
+                # We don't notify the user upon deactivation to avoid being spammy
+                # They will find out when they try to use the VPN or check the bot
+            except XUIServerDegradedError as e:
+                degraded = True
+                logger.error(f"Server {server.name} is degraded, postponing its remaining deactivations: {e}")
+            except XUIClientError as e:
+                if "Client not found" in str(e): # Handle cases where client is already deleted in X-UI
+                    deactivated.append(subscription_id)
+                    logger.warning(f"Client {xui_user_uuid} was already deleted in X-UI. Marking as inactive in DB.")
+                else:
+                    logger.error(f"XUI error deactivating client {xui_user_uuid} on server {server.name}: {e}")
+            except Exception as e:
+                logger.error(f"Unexpected error deactivating client {xui_user_uuid} on server {server.name}: {e}")
+
+    workers = min(settings.EXPIRY_DELETE_CONCURRENCY, len(subscriptions))
+    await asyncio.gather(*[worker() for _ in range(workers)])
+    logger.info(f"Server {server.name}: {len(deactivated)} of {len(subscriptions)} expired clients removed.")
+    return deactivated
@@ -0,0 +1,102 @@
+# core/services/user_cache.py
+
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from loguru import logger
+from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.config import settings
+from core.database.models import User
+
+
+class UserSnapshot(BaseModel):
+    """The rarely changing part of a user row that most handlers need before doing anything else."""
+    telegram_id: int
+    language_code: Optional[str] = None
+    is_banned: bool = False
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(telegram_id=user.telegram_id, language_code=user.language_code, is_banned=bool(user.is_banned))
+
+
+class UserCache:
+    """
+    Per-process LRU of user snapshots with a short TTL. Writers invalidate
+    entries after they commit; other replicas see the change once their entry
+    expires. Balances, days and subscriptions are never cached: handlers that
+    show or spend them load the row.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Tuple[float, UserSnapshot]]" = OrderedDict()
+        # Bumped by every invalidation, so a load that raced with one isn't stored.
+        self._generation = 0
+
+    def peek(self, telegram_id: int) -> Optional[UserSnapshot]:
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at <= time.monotonic():
+            del self._entries[telegram_id]
+            return None
+        self._entries.move_to_end(telegram_id)
+        return snapshot
+
+    async def get(self, session: AsyncSession, telegram_id: int) -> Optional[UserSnapshot]:
+        """Returns the cached snapshot, loading it with `session` on a miss. Unknown users are not cached."""
+        snapshot = self.peek(telegram_id)
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        generation = self._generation
+        row = (await session.execute(
+            select(User.telegram_id, User.language_code, User.is_banned).where(User.telegram_id == telegram_id)
+        )).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(telegram_id=row.telegram_id, language_code=row.language_code, is_banned=bool(row.is_banned))
+        if self._generation == generation:
+            self._store(snapshot)
+        return snapshot
+
+    def put(self, user: User):
+        """Refreshes the entry from a row the caller has just read anyway."""
+        self._store(UserSnapshot.from_user(user))
+
+    def _store(self, snapshot: UserSnapshot):
+        self._entries[snapshot.telegram_id] = (time.monotonic() + self.ttl, snapshot)
+        self._entries.move_to_end(snapshot.telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id: Optional[int] = None):
+        """Drops one user's snapshot, or every snapshot if no id is given."""
+        self._generation += 1
+        if telegram_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(telegram_id, None)
+        logger.debug(f"User cache invalidated for: {telegram_id if telegram_id is not None else 'all users'}")
+
+
+user_cache = UserCache(ttl=settings.USER_CACHE_TTL, max_size=settings.USER_CACHE_SIZE)
+
+
+async def get_user_snapshot(session: AsyncSession, telegram_id: int) -> Optional[UserSnapshot]:
+    return await user_cache.get(session, telegram_id)
+
+
+def invalidate_user(telegram_id: Optional[int] = None):
+    user_cache.invalidate(telegram_id)
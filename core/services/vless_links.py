@@ -0,0 +1,48 @@
+# core/services/vless_links.py
+
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse, urlencode, quote
+
+if TYPE_CHECKING:
+    from core.services.inbound_cache import InboundMetadata
+
+
+class VlessLinkTemplate:
+    """
+    A VLESS link with everything except the client UUID and the fragment
+    pre-computed: host, port and the encoded query string.
+    """
+    __slots__ = ('api_url', 'inbound_id', 'authority', 'query')
+
+    def __init__(self, api_url: str, inbound_id: int, authority: str, query: str):
+        self.api_url = api_url
+        self.inbound_id = inbound_id
+        self.authority = authority
+        self.query = query
+
+    @classmethod
+    def compile(cls, api_url: str, metadata: "InboundMetadata") -> "VlessLinkTemplate":
+        host = urlparse(api_url).hostname
+        if host and ':' in host:
+            host = f"[{host}]" # IPv6 literal
+        params = {
+            "encryption": "none", # Standard for VLESS
+            "type": metadata.network,
+            "security": metadata.security
+        }
+        if metadata.security == 'reality':
+            reality_params = {
+                'pbk': metadata.public_key,
+                'fp': metadata.fingerprint,
+                'spx': metadata.spider_x,
+                'sni': metadata.server_name,
+                'sid': metadata.short_id
+            }
+            params.update({k: v for k, v in reality_params.items() if v})
+
+        query = urlencode(params, quote_via=quote, safe='')
+        return cls(api_url, metadata.inbound_id, f"{host}:{metadata.port}", query)
+
+    def render(self, user_uuid: str, fragment: str) -> str:
+        """Substitutes the client UUID and the URL-encoded fragment into the template."""
+        return f"vless://{user_uuid}@{self.authority}?{self.query}#{quote(fragment, safe='')}"
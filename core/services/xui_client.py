@@ -1,17 +1,30 @@
+import asyncio
 import httpx
 import json
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+import os
+import time
+from tenacity import AsyncRetrying, RetryCallState, stop_after_attempt, retry_if_exception_type, retry_if_result
 from loguru import logger
 from pydantic import BaseModel, Field, ValidationError, model_validator
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Set, Tuple
 
+from core.config import settings
 from core.database.models import Server
-from core.utils.security import decrypt_password
+from core.services.circuit_breaker import CircuitBreaker, CircuitState
+from core.services.retry_policy import current_retry_policy, stop_at_deadline
+from core.utils.security import encrypt_password, decrypt_password
 
 class XUIClientError(Exception):
     """Custom exception for XUI client errors."""
     pass
 
+class XUIServerDegradedError(XUIClientError):
+    """Raised without contacting the panel when its circuit is open or its request queue is full."""
+    def __init__(self, api_url: str, retry_after: float):
+        self.api_url = api_url
+        self.retry_after = retry_after
+        super().__init__(f"X-UI panel {api_url} is degraded, retry in {retry_after:.0f}s")
+
 # --- Pydantic Models for API Requests and Responses ---
 
 class XUIBaseResponse(BaseModel):
@@ -91,9 +104,57 @@ class Inbound(BaseModel):
                     pass
         return values
 
+class InboundStream(BaseModel):
+    """An inbound without its client list: everything needed to build client links."""
+    id: Optional[int] = None
+    port: Optional[int] = None
+    protocol: Optional[str] = None
+    streamSettings: StreamSettings
+
 class GetInboundResponse(XUIBaseResponse):
     obj: Optional[Inbound] = None
 
+class RawInboundResponse(XUIBaseResponse):
+    obj: Optional[Dict[str, Any]] = None
+
+# --- Light-weight parsing helpers ---
+# Full `Inbound` validation builds a ClientConfig for every client of the inbound,
+# which dominates CPU on inbounds with thousands of clients. These helpers work
+# on the raw panel payload and only build the models a caller actually needs.
+
+def parse_inbound_stream(raw_inbound: Dict[str, Any]) -> InboundStream:
+    """Parses port/protocol/stream settings of a raw inbound, leaving `settings.clients` untouched."""
+    stream_settings = raw_inbound.get('streamSettings')
+    if isinstance(stream_settings, str):
+        stream_settings = json.loads(stream_settings)
+    return InboundStream(
+        id=raw_inbound.get('id'),
+        port=raw_inbound.get('port'),
+        protocol=raw_inbound.get('protocol'),
+        streamSettings=stream_settings
+    )
+
+def find_client_in_settings(raw_settings: Any, uuid: Optional[str] = None, email: Optional[str] = None) -> Optional[ClientConfig]:
+    """Finds one client by UUID or email in a raw inbound `settings` value without validating the others."""
+    if uuid is None and email is None:
+        raise ValueError("Either uuid or email must be given.")
+    if isinstance(raw_settings, str):
+        raw_settings = json.loads(raw_settings)
+    for raw_client in (raw_settings or {}).get('clients', []):
+        if (uuid is not None and raw_client.get('id') == uuid) or (email is not None and raw_client.get('email') == email):
+            return ClientConfig.model_validate(raw_client)
+    return None
+
+def find_clients_in_settings(raw_settings: Any, uuids: Set[str]) -> Dict[str, ClientConfig]:
+    """Finds the clients with the given UUIDs in a raw inbound `settings` value, validating only those."""
+    if isinstance(raw_settings, str):
+        raw_settings = json.loads(raw_settings)
+    return {
+        raw_client['id']: ClientConfig.model_validate(raw_client)
+        for raw_client in (raw_settings or {}).get('clients', [])
+        if raw_client.get('id') in uuids
+    }
+
 class AddClientResponse(XUIBaseResponse):
     obj: Optional[Any] = None
 
@@ -103,67 +164,258 @@ class UpdateClientResponse(XUIBaseResponse):
 class DeleteClientResponse(XUIBaseResponse):
     obj: Optional[Any] = None
 
+class BulkClientResult(BaseModel):
+    """Outcome of a single client within a bulk add/update operation."""
+    uuid: str
+    email: str = ""
+    success: bool
+    error: Optional[str] = None
+
+# Gateway errors worth another attempt; other statuses are final answers from the panel.
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
 class XUIClient:
     """A robust asynchronous client for X-UI panel API."""
 
-    def __init__(self, api_url: str, username: str, password: str):
+    request_timeout = 30
+
+    def __init__(self, api_url: str, username: str, password: str, transport: Optional[httpx.AsyncBaseTransport] = None):
         self.api_url = api_url.rstrip('/')
         self.username = username
         self.password = password
-        self.client = httpx.AsyncClient(base_url=self.api_url, timeout=30, verify=False)
+        # `transport` lets tests and benchmarks route requests to an in-process panel.
+        self.client = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=self.request_timeout,
+            verify=False,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            transport=transport
+        )
         self._is_authenticated = False
-
-    async def _login(self):
-        """Authenticates with the X-UI panel."""
-        if self._is_authenticated:
-            return
-
-        logger.info(f"Attempting to log in to X-UI at {self.api_url}")
-        try:
-            response = await self.client.post(
-                "/login",
-                data={"username": self.username, "password": self.password}
+        # Every call to the panel passes both: the semaphore bounds in-flight
+        # requests, the breaker fails fast while the panel keeps failing.
+        self._semaphore = asyncio.Semaphore(settings.XUI_MAX_CONCURRENT_REQUESTS)
+        self._breaker = CircuitBreaker(
+            failure_threshold=settings.XUI_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.XUI_BREAKER_RECOVERY_TIMEOUT
+        )
+        # Generation of the shared session whose cookies this client currently holds.
+        self._session_generation = 0
+        # Requests started on this client and not finished yet; a replaced client
+        # is only closed once this drops to zero (see _retire_client).
+        self.in_flight = 0
+        # inbound_id -> {uuid -> (indexed_at, ClientConfig)}. Filled from panel reads
+        # and kept current by our own add/update/delete calls, so updates don't
+        # have to re-download every client of the inbound. Entries expire after
+        # XUI_CLIENT_INDEX_TTL, so edits made on the panel itself are picked up.
+        self._client_index: Dict[int, Dict[str, Tuple[float, ClientConfig]]] = {}
+
+    def get_indexed_client(self, inbound_id: int, uuid: str) -> Optional[ClientConfig]:
+        """Returns the locally known config of a client, if it is still fresh."""
+        entry = self._client_index.get(inbound_id, {}).get(uuid)
+        if entry is None:
+            return None
+        indexed_at, config = entry
+        if time.monotonic() - indexed_at >= settings.XUI_CLIENT_INDEX_TTL:
+            del self._client_index[inbound_id][uuid]
+            return None
+        return config
+
+    def _index_clients(self, inbound_id: int, client_configs: List[ClientConfig]):
+        now = time.monotonic()
+        index = self._client_index.setdefault(inbound_id, {})
+        for config in client_configs:
+            index[config.id] = (now, config)
+
+    async def _login(self, stale_generation: Optional[int] = None):
+        """
+        Authenticates with the X-UI panel. Logins are serialized per panel account:
+        if a session newer than the one the caller last used (`stale_generation`)
+        already exists, its cookies are adopted instead of logging in again.
+        """
+        if stale_generation is None:
+            if self._is_authenticated:
+                return
+            stale_generation = self._session_generation
+
+        key = (self.api_url, self.username)
+        async with _login_locks.setdefault(key, asyncio.Lock()):
+            session = _get_session(key)
+            if session and session.generation > stale_generation:
+                self._adopt_session(session)
+                logger.info(f"Reusing existing X-UI session for {self.api_url}")
+                return
+
+            logger.info(f"Attempting to log in to X-UI at {self.api_url}")
+            try:
+                response = await self.client.post(
+                    "/login",
+                    data={"username": self.username, "password": self.password}
+                )
+                response.raise_for_status()
+                result = response.json()
+                login_response = LoginResponse.model_validate(result)
+
+                if login_response.success:
+                    self._is_authenticated = True
+                    logger.success(f"Successfully logged in to {self.api_url}")
+                else:
+                    raise XUIClientError(f"Login failed: {login_response.msg or 'Unknown error'}")
+
+            except httpx.HTTPStatusError as e:
+                logger.error(f"HTTP error during XUI login to {self.api_url}: {e.response.status_code} - {e.response.text}")
+                raise XUIClientError(f"HTTP error during XUI login: {e.response.status_code}") from e
+            except httpx.RequestError as e:
+                logger.error(f"Network error during XUI login to {self.api_url}: {e}")
+                raise XUIClientError(f"Network error during XUI login: {e}") from e
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON decode error during XUI login to {self.api_url}: {e}")
+                raise XUIClientError(f"JSON decode error during XUI login: {e}") from e
+            except ValidationError as e:
+                logger.error(f"Pydantic validation error during XUI login: {e} - Response: {result}")
+                raise XUIClientError(f"Pydantic validation error during XUI login: {e}") from e
+
+            session = PanelSession(
+                generation=(session.generation if session else 0) + 1,
+                cookies=[
+                    {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+                    for c in self.client.cookies.jar
+                ]
             )
-            response.raise_for_status()
-            result = response.json()
-            login_response = LoginResponse.model_validate(result)
+            _store_session(key, session)
+            self._session_generation = session.generation
 
-            if login_response.success:
-                self._is_authenticated = True
-                logger.success(f"Successfully logged in to {self.api_url}")
-            else:
-                raise XUIClientError(f"Login failed: {login_response.msg or 'Unknown error'}")
-
-        except httpx.HTTPStatusError as e:
-            logger.error(f"HTTP error during XUI login to {self.api_url}: {e.response.status_code} - {e.response.text}")
-            raise XUIClientError(f"HTTP error during XUI login: {e.response.status_code}") from e
-        except httpx.RequestError as e:
-            logger.error(f"Network error during XUI login to {self.api_url}: {e}")
-            raise XUIClientError(f"Network error during XUI login: {e}") from e
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error during XUI login to {self.api_url}: {e}")
-            raise XUIClientError(f"JSON decode error during XUI login: {e}") from e
-        except ValidationError as e:
-            logger.error(f"Pydantic validation error during XUI login: {e} - Response: {result}")
-            raise XUIClientError(f"Pydantic validation error during XUI login: {e}") from e
+    def _adopt_session(self, session: "PanelSession"):
+        self.client.cookies.clear()
+        for cookie in session.cookies:
+            self.client.cookies.set(cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"])
+        self._session_generation = session.generation
+        self._is_authenticated = True
 
     async def _ensure_authenticated(self):
         """Ensures that the client has an active session, logging in if necessary."""
         if not self._is_authenticated:
             await self._login()
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2), retry=retry_if_exception_type(httpx.RequestError))
-    async def get_inbound(self, inbound_id: int) -> Optional[Inbound]:
-        """Retrieves details for a specific inbound configuration."""
+    def _is_session_expired(self, response: httpx.Response) -> bool:
+        """
+        Tells a rejected session apart from other errors: a 401, a redirect to
+        the login page (older panels), or a 404 from the /panel/api/ endpoints,
+        which 3x-ui 2.x hides from unauthenticated callers. A 404 anywhere else
+        is a wrong path or a missing resource and is returned as is.
+        """
+        base_path = self.client.base_url.path.rstrip('/')
+        if response.status_code == 401:
+            return True
+        if response.status_code == 404:
+            return response.request.url.path.startswith(f"{base_path}/panel/api/")
+        if response.is_redirect:
+            location = response.request.url.join(response.headers.get("location", "")).path.rstrip('/')
+            return location in (base_path, f"{base_path}/login")
+        return False
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request to the panel, retrying network errors and gateway errors
+        according to the retry policy of the calling context (see retry_policy).
+        Backoff is exponential with jitter and no attempt starts after the deadline.
+        """
+        policy, deadline = current_retry_policy()
+
+        def _log_retry(retry_state: RetryCallState):
+            outcome = retry_state.outcome
+            reason = outcome.exception() if outcome.failed else f"HTTP {outcome.result().status_code}"
+            logger.warning(
+                f"X-UI {method} {url} on {self.api_url} failed ({reason}), attempt {retry_state.attempt_number}/"
+                f"{policy.max_attempts} ({policy.name}), retrying in {retry_state.next_action.sleep:.2f}s."
+            )
+
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(policy.max_attempts) | stop_at_deadline(deadline, policy.initial_backoff),
+            wait=policy.wait(deadline),
+            retry=retry_if_exception_type(httpx.TransportError) | retry_if_result(lambda r: r.status_code in RETRYABLE_STATUS_CODES),
+            before_sleep=_log_retry,
+            # Out of attempts: re-raise the last error or hand back the last response.
+            retry_error_callback=lambda retry_state: retry_state.outcome.result()
+        )
+        return await retrying(self._attempt, method, url, deadline, **kwargs)
+
+    async def _attempt(self, method: str, url: str, deadline: float, **kwargs) -> httpx.Response:
+        """
+        A single request through the per-server concurrency limit and circuit
+        breaker. Raises XUIServerDegradedError instead of waiting when the circuit
+        is open or no request slot frees up within XUI_QUEUE_TIMEOUT.
+        """
+        self.in_flight += 1
+        try:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise XUIClientError(f"Deadline exceeded before {method} {url} on {self.api_url}")
+            if not self._breaker.allow_request():
+                raise XUIServerDegradedError(self.api_url, self._breaker.retry_after())
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=min(settings.XUI_QUEUE_TIMEOUT, remaining))
+            except asyncio.TimeoutError:
+                logger.warning(f"All {settings.XUI_MAX_CONCURRENT_REQUESTS} request slots for {self.api_url} are busy.")
+                raise XUIServerDegradedError(self.api_url, settings.XUI_QUEUE_TIMEOUT) from None
+
+            kwargs["timeout"] = min(self.request_timeout, max(deadline - time.monotonic(), 0.1))
+            try:
+                response = await self._send_authenticated(method, url, **kwargs)
+            except httpx.RequestError:
+                self._record_failure()
+                raise
+            except XUIClientError as e:
+                # Login errors wrap the underlying network error.
+                if isinstance(e.__cause__, httpx.RequestError):
+                    self._record_failure()
+                raise
+            finally:
+                self._semaphore.release()
+
+            if response.status_code >= 500:
+                self._record_failure()
+            else:
+                self._breaker.record_success()
+            return response
+        finally:
+            self.in_flight -= 1
+
+    def _record_failure(self):
+        previous_state = self._breaker.state
+        self._breaker.record_failure()
+        if previous_state != CircuitState.OPEN and self._breaker.state == CircuitState.OPEN:
+            logger.error(f"Circuit for X-UI panel {self.api_url} opened, failing fast for {self._breaker.recovery_timeout}s.")
+
+    async def _send_authenticated(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends an authenticated request to the panel. If the panel reports that the
+        session has expired, logs in again once and replays the request.
+        """
         await self._ensure_authenticated()
+        generation = self._session_generation
+        response = await self.client.request(method, url, **kwargs)
+        if not self._is_session_expired(response):
+            return response
+
+        logger.warning(f"X-UI session for {self.api_url} expired ({response.status_code}), logging in again.")
+        self._is_authenticated = False
+        await self._login(stale_generation=generation)
+        response = await self.client.request(method, url, **kwargs)
+        if self._is_session_expired(response):
+            raise XUIClientError(f"X-UI panel {self.api_url} still answers {response.status_code} for {url} after a fresh login")
+        return response
+
+    async def get_inbound_raw(self, inbound_id: int) -> Dict[str, Any]:
+        """Retrieves an inbound as the raw panel payload, with nested settings still JSON-encoded."""
         logger.info(f"Getting inbound {inbound_id} details...")
         try:
-            response = await self.client.get(f"/panel/api/inbounds/get/{inbound_id}")
+            response = await self._request("GET", f"/panel/api/inbounds/get/{inbound_id}")
             response.raise_for_status()
             if not response.text:
                 raise XUIClientError("Empty response from server")
             result = response.json()
-            get_inbound_response = GetInboundResponse.model_validate(result)
+            get_inbound_response = RawInboundResponse.model_validate(result)
             if get_inbound_response.success and get_inbound_response.obj:
                 logger.info(f"Inbound {inbound_id} details retrieved successfully.")
                 return get_inbound_response.obj
@@ -173,10 +425,41 @@ class XUIClient:
             logger.error(f"Error getting inbound {inbound_id}: {e}")
             raise XUIClientError(f"Error getting inbound: {e}") from e
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2), retry=retry_if_exception_type(httpx.RequestError))
+    async def get_inbound(self, inbound_id: int) -> Optional[Inbound]:
+        """Retrieves a specific inbound with every client fully validated. Meant for admin tooling."""
+        raw_inbound = await self.get_inbound_raw(inbound_id)
+        try:
+            inbound = Inbound.model_validate(raw_inbound)
+        except ValidationError as e:
+            logger.error(f"Error getting inbound {inbound_id}: {e}")
+            raise XUIClientError(f"Error getting inbound: {e}") from e
+        self._client_index[inbound_id] = {}
+        self._index_clients(inbound_id, inbound.settings.clients)
+        return inbound
+
+    async def get_inbound_stream(self, inbound_id: int) -> InboundStream:
+        """Retrieves only the stream settings of an inbound, skipping client validation."""
+        raw_inbound = await self.get_inbound_raw(inbound_id)
+        try:
+            return parse_inbound_stream(raw_inbound)
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.error(f"Error parsing stream settings of inbound {inbound_id}: {e}")
+            raise XUIClientError(f"Error getting inbound: {e}") from e
+
+    async def find_client(self, inbound_id: int, uuid: Optional[str] = None, email: Optional[str] = None) -> Optional[ClientConfig]:
+        """Finds a single client of an inbound by UUID or email, validating only that client."""
+        raw_inbound = await self.get_inbound_raw(inbound_id)
+        try:
+            client = find_client_in_settings(raw_inbound.get('settings'), uuid=uuid, email=email)
+        except (json.JSONDecodeError, ValidationError) as e:
+            logger.error(f"Error parsing clients of inbound {inbound_id}: {e}")
+            raise XUIClientError(f"Error getting inbound: {e}") from e
+        if client:
+            self._index_clients(inbound_id, [client])
+        return client
+
     async def add_client(self, inbound_id: int, client_config: ClientConfig) -> dict:
         """Adds a new client to a specific inbound configuration."""
-        await self._ensure_authenticated()
         logger.info(f"Adding client {client_config.email} to inbound {inbound_id}...")
         payload = {
             "id": inbound_id,
@@ -184,7 +467,7 @@ class XUIClient:
         }
         logger.info(f"Отправка данных: {payload}")
         try:
-            response = await self.client.post("/panel/api/inbounds/addClient", data=payload)
+            response = await self._request("POST", "/panel/api/inbounds/addClient", data=payload)
             response.raise_for_status()
             if not response.text:
                 raise XUIClientError("Empty response from server")
@@ -192,6 +475,7 @@ class XUIClient:
             add_client_response = AddClientResponse.model_validate(result)
             if add_client_response.success:
                 logger.info(f"User {client_config.email} created successfully.")
+                self._index_clients(inbound_id, [client_config])
                 return {"success": True, "uuid": client_config.id}
             else:
                 raise XUIClientError(f"Failed to create user {client_config.email}: {add_client_response.msg or 'Unknown error'}")
@@ -199,27 +483,26 @@ class XUIClient:
             logger.error(f"Error creating user {client_config.email}: {e}")
             raise XUIClientError(f"Error creating user: {e}") from e
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2), retry=retry_if_exception_type(httpx.RequestError))
-    async def update_client(self, inbound_id: int, uuid: str, new_expiry_time_ms: int, new_total_gb: Optional[int] = None) -> dict:
-        """Updates an existing client's settings by sending a payload similar to add_client."""
-        await self._ensure_authenticated()
+    async def update_client(self, inbound_id: int, uuid: str, new_expiry_time_ms: int, new_total_gb: Optional[int] = None, stored_config: Optional[ClientConfig] = None) -> dict:
+        """
+        Updates an existing client's settings by sending a payload similar to add_client.
+        The original client config is `stored_config` (the full config the caller
+        recorded when it created the client), else the local client index, else the
+        client as read from the panel. Returns the config that was sent under "client".
+        """
         logger.info(f"Attempting to update client {uuid} in inbound {inbound_id} (v3 logic)...")
 
-        # First, we need the original client details to ensure we only change what's necessary.
-        inbound = await self.get_inbound(inbound_id)
-        if not inbound:
-            raise XUIClientError(f"Inbound {inbound_id} not found, cannot update client.")
+        original_client = stored_config or self.get_indexed_client(inbound_id, uuid)
+        if original_client is None:
+            # We need the original client details to ensure we only change what's necessary.
+            original_client = await self.find_client(inbound_id, uuid=uuid)
 
-        client_to_update_model = None
-        for client in inbound.settings.clients:
-            if client.id == uuid:
-                # Create a copy to modify, preserving the original model's other fields
-                client_to_update_model = client.model_copy(deep=True)
-                break
-
-        if not client_to_update_model:
+        if not original_client:
             raise XUIClientError(f"Client {uuid} not found in inbound {inbound_id}")
 
+        # Create a copy to modify, preserving the original model's other fields
+        client_to_update_model = original_client.model_copy(deep=True)
+
         # Apply the updates to our copy
         client_to_update_model.expiryTime = new_expiry_time_ms
         if new_total_gb is not None:
@@ -227,8 +510,15 @@ class XUIClient:
         else: # Ensure we send the original value if not changing
             client_to_update_model.totalGB = client_to_update_model.totalGB or 0
 
+        result = await self._post_update_client(inbound_id, client_to_update_model)
+        return {**result, "client": client_to_update_model}
+
+    async def _post_update_client(self, inbound_id: int, client_config: ClientConfig) -> dict:
+        """Sends the full, already updated client config to the panel."""
+        uuid = client_config.id
+
         # Mimic the structure of addClient: `{"clients": [...]}`
-        update_payload_obj = {"clients": [client_to_update_model.model_dump(by_alias=True)]}
+        update_payload_obj = {"clients": [client_config.model_dump(by_alias=True)]}
         settings_json_string = json.dumps(update_payload_obj)
 
         payload = {
@@ -238,7 +528,7 @@ class XUIClient:
         logger.info(f"Sending update payload for client {uuid}: {payload}")
 
         try:
-            response = await self.client.post(f"/panel/api/inbounds/updateClient/{uuid}", data=payload)
+            response = await self._request("POST", f"/panel/api/inbounds/updateClient/{uuid}", data=payload)
             response.raise_for_status()
             if not response.text:
                 raise XUIClientError("Empty response from server on client update")
@@ -248,6 +538,7 @@ class XUIClient:
 
             if update_response.success:
                 logger.success(f"Client {uuid} updated successfully in inbound {inbound_id}.")
+                self._index_clients(inbound_id, [client_config])
                 return {"success": True}
             else:
                 logger.error(f"Failed to update client {uuid}. Panel msg: {update_response.msg}. Full response: {response.text}")
@@ -259,29 +550,116 @@ class XUIClient:
                 logger.error(f"Response body: {e.response.text}")
             raise XUIClientError(f"Error updating client: {e}") from e
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2), retry=retry_if_exception_type(httpx.RequestError))
+    async def _post_add_clients(self, inbound_id: int, client_configs: List[ClientConfig]):
+        """Adds several clients with a single addClient call. The panel applies the batch atomically."""
+        payload = {
+            "id": inbound_id,
+            "settings": json.dumps({"clients": [config.model_dump(by_alias=True) for config in client_configs]})
+        }
+        try:
+            response = await self._request("POST", "/panel/api/inbounds/addClient", data=payload)
+            response.raise_for_status()
+            if not response.text:
+                raise XUIClientError("Empty response from server")
+            add_client_response = AddClientResponse.model_validate(response.json())
+            if not add_client_response.success:
+                raise XUIClientError(f"Failed to add clients: {add_client_response.msg or 'Unknown error'}")
+            self._index_clients(inbound_id, client_configs)
+        except (httpx.HTTPStatusError, httpx.RequestError, json.JSONDecodeError, ValidationError) as e:
+            logger.error(f"Error adding {len(client_configs)} clients to inbound {inbound_id}: {e}")
+            raise XUIClientError(f"Error adding clients: {e}") from e
+
+    async def add_clients(self, inbound_id: int, client_configs: List[ClientConfig], chunk_size: int = 100) -> List[BulkClientResult]:
+        """
+        Adds many clients using one addClient request per chunk.
+        If a chunk is rejected, its clients are retried one by one so that
+        the failing entries can be reported individually.
+        """
+        results: List[BulkClientResult] = []
+        for start in range(0, len(client_configs), chunk_size):
+            chunk = client_configs[start:start + chunk_size]
+            logger.info(f"Adding {len(chunk)} clients to inbound {inbound_id} (batch starting at {start})...")
+            try:
+                await self._post_add_clients(inbound_id, chunk)
+                results.extend(BulkClientResult(uuid=c.id, email=c.email, success=True) for c in chunk)
+                continue
+            except XUIClientError as e:
+                if len(chunk) == 1:
+                    results.append(BulkClientResult(uuid=chunk[0].id, email=chunk[0].email, success=False, error=str(e)))
+                    continue
+                logger.warning(f"Batch add to inbound {inbound_id} failed ({e}), retrying clients individually.")
+
+            for config in chunk:
+                try:
+                    await self._post_add_clients(inbound_id, [config])
+                    results.append(BulkClientResult(uuid=config.id, email=config.email, success=True))
+                except XUIClientError as e:
+                    results.append(BulkClientResult(uuid=config.id, email=config.email, success=False, error=str(e)))
+
+        failed = sum(1 for r in results if not r.success)
+        logger.info(f"Bulk add to inbound {inbound_id} finished: {len(results) - failed} added, {failed} failed.")
+        return results
+
+    async def update_clients(self, inbound_id: int, new_expiry_times_ms: Dict[str, int], new_total_gb: Optional[int] = None, chunk_size: int = 10) -> List[BulkClientResult]:
+        """
+        Extends or updates many clients of one inbound. The inbound is fetched
+        once; the panel only accepts one client per updateClient call, so the
+        updates are sent concurrently in chunks of `chunk_size`.
+        """
+        clients_by_uuid = {}
+        for uuid in new_expiry_times_ms:
+            indexed = self.get_indexed_client(inbound_id, uuid)
+            if indexed:
+                clients_by_uuid[uuid] = indexed
+        missing = {uuid for uuid in new_expiry_times_ms if uuid not in clients_by_uuid}
+        if missing:
+            raw_inbound = await self.get_inbound_raw(inbound_id)
+            try:
+                found = find_clients_in_settings(raw_inbound.get('settings'), missing)
+            except (json.JSONDecodeError, ValidationError) as e:
+                logger.error(f"Error parsing clients of inbound {inbound_id}: {e}")
+                raise XUIClientError(f"Error getting inbound: {e}") from e
+            self._index_clients(inbound_id, list(found.values()))
+            clients_by_uuid.update(found)
+
+        async def _update_one(uuid: str, expiry_time_ms: int) -> BulkClientResult:
+            client = clients_by_uuid.get(uuid)
+            if not client:
+                return BulkClientResult(uuid=uuid, success=False, error=f"Client {uuid} not found in inbound {inbound_id}")
+            updated = client.model_copy(update={"expiryTime": expiry_time_ms})
+            if new_total_gb is not None:
+                updated.totalGB = new_total_gb
+            try:
+                await self._post_update_client(inbound_id, updated)
+                return BulkClientResult(uuid=uuid, email=client.email, success=True)
+            except XUIClientError as e:
+                return BulkClientResult(uuid=uuid, email=client.email, success=False, error=str(e))
+
+        items = list(new_expiry_times_ms.items())
+        results: List[BulkClientResult] = []
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            results.extend(await asyncio.gather(*[_update_one(uuid, expiry) for uuid, expiry in chunk]))
+
+        failed = sum(1 for r in results if not r.success)
+        logger.info(f"Bulk update in inbound {inbound_id} finished: {len(results) - failed} updated, {failed} failed.")
+        return results
+
     async def get_client_by_email(self, inbound_id: int, email: str) -> Optional[ClientConfig]:
         """Finds a client within an inbound by their email."""
-        inbound = await self.get_inbound(inbound_id)
-        if not inbound:
-            raise XUIClientError(f"Inbound {inbound_id} not found, cannot search for client.")
-
-        for client in inbound.settings.clients:
-            if client.email == email:
-                logger.info(f"Found client with email {email} in inbound {inbound_id}.")
-                return client
-        
-        logger.info(f"Client with email {email} not found in inbound {inbound_id}.")
-        return None
-
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2), retry=retry_if_exception_type(httpx.RequestError))
+        client = await self.find_client(inbound_id, email=email)
+        if client:
+            logger.info(f"Found client with email {email} in inbound {inbound_id}.")
+        else:
+            logger.info(f"Client with email {email} not found in inbound {inbound_id}.")
+        return client
+
     async def delete_client(self, inbound_id: int, uuid: str) -> dict:
         """Deletes a client from a specific inbound configuration."""
-        await self._ensure_authenticated()
         logger.info(f"Deleting client {uuid} from inbound {inbound_id}...")
         try:
             # Note: The delete endpoint requires the UUID in the URL path
-            response = await self.client.post(f"/panel/api/inbounds/{inbound_id}/delClient/{uuid}")
+            response = await self._request("POST", f"/panel/api/inbounds/{inbound_id}/delClient/{uuid}")
             response.raise_for_status()
             if not response.text:
                 raise XUIClientError("Empty response from server")
@@ -289,6 +667,7 @@ class XUIClient:
             delete_client_response = DeleteClientResponse.model_validate(result)
             if delete_client_response.success:
                 logger.info(f"Client {uuid} deleted successfully.")
+                self._client_index.get(inbound_id, {}).pop(uuid, None)
                 return {"success": True}
             else:
                 raise XUIClientError(f"Failed to delete client {uuid}: {delete_client_response.msg or 'Unknown error'}")
@@ -301,11 +680,151 @@ class XUIClient:
         if not self.client.is_closed:
             await self.client.aclose()
 
+# --- Shared panel sessions ---
+
+class PanelSession(BaseModel):
+    """Session cookies of one panel account. `generation` grows with every login."""
+    generation: int
+    cookies: List[Dict[str, str]]
+
+
+# Sessions keyed by (api_url, username), shared by every XUIClient of the same
+# panel account so that restarts, credential edits and concurrent requests don't
+# each trigger a login. Optionally persisted to XUI_SESSION_STORE_PATH.
+_sessions: Dict[Tuple[str, str], PanelSession] = {}
+_login_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+_sessions_loaded = False
+
+
+def _get_session(key: Tuple[str, str]) -> Optional[PanelSession]:
+    _load_sessions()
+    return _sessions.get(key)
+
+
+def _store_session(key: Tuple[str, str], session: PanelSession):
+    _sessions[key] = session
+    _save_sessions()
+
+
+def _load_sessions():
+    """Reads persisted sessions once per process. A missing or unreadable file just means fresh logins."""
+    global _sessions_loaded
+    if _sessions_loaded:
+        return
+    _sessions_loaded = True
+    path = settings.XUI_SESSION_STORE_PATH
+    if not path or not os.path.exists(path):
+        return
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+        for entry in stored:
+            cookies = json.loads(decrypt_password(entry["cookies"]))
+            _sessions.setdefault((entry["api_url"], entry["username"]), PanelSession(generation=1, cookies=cookies))
+        logger.info(f"Loaded {len(stored)} X-UI sessions from {path}")
+    except Exception as e:
+        logger.warning(f"Could not load X-UI sessions from {path}: {e}")
+
+
+def _save_sessions():
+    path = settings.XUI_SESSION_STORE_PATH
+    if not path:
+        return
+    stored = [
+        {"api_url": api_url, "username": username, "cookies": encrypt_password(json.dumps(session.cookies))}
+        for (api_url, username), session in _sessions.items()
+    ]
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not save X-UI sessions to {path}: {e}")
+
+
+# --- Connection-pooled client registry ---
+
+# One long-lived, authenticated client per Server.id. Each entry remembers the
+# connection fingerprint it was built from so that an admin edit of the panel
+# URL or credentials transparently replaces the stale client.
+_client_registry: Dict[int, Tuple[Tuple[str, str, str], XUIClient]] = {}
+RETIRED_CLIENT_GRACE = 5 # Seconds a replaced client stays open for requests already running on it
+
+
+def _server_fingerprint(server: Server) -> Tuple[str, str, str]:
+    return (server.api_url, server.api_user, server.api_password)
+
+
 async def get_client(server: Server) -> XUIClient:
-    """Returns an authenticated XUIClient instance for a specific server."""
+    """Returns the shared, connection-pooled XUIClient for a specific server."""
+    fingerprint = _server_fingerprint(server)
+    entry = _client_registry.get(server.id)
+    if entry:
+        cached_fingerprint, cached_client = entry
+        if cached_fingerprint == fingerprint and not cached_client.client.is_closed:
+            return cached_client
+        logger.info(f"Connection settings for server {server.id} changed, recreating X-UI client.")
+        _retire_client(cached_client)
+
+    # The new client is registered before anything is awaited, so concurrent
+    # callers never build two clients for the same server.
     decrypted_password = decrypt_password(server.api_password)
-    return XUIClient(
+    xui_client = XUIClient(
         api_url=server.api_url,
         username=server.api_user,
         password=decrypted_password
-    )
\ No newline at end of file
+    )
+    _client_registry[server.id] = (fingerprint, xui_client)
+    return xui_client
+
+
+def invalidate_client(server_id: int):
+    """Drops the cached client of a server, e.g. after an admin disables it. The next get_client() builds a new one."""
+    entry = _client_registry.pop(server_id, None)
+    if entry:
+        _retire_client(entry[1])
+        logger.info(f"X-UI client for server {server_id} invalidated.")
+
+
+# Replaced clients that are still open, with the task that closes each of them.
+_retired_clients: Dict[XUIClient, asyncio.Task] = {}
+
+
+def _retire_client(xui_client: XUIClient):
+    """
+    Closes a replaced client once nothing uses it any more. Coroutines that
+    fetched it earlier may still be between two requests of one operation, so
+    the close waits for a grace period in which no request is in flight.
+    """
+    if xui_client in _retired_clients or xui_client.client.is_closed:
+        return
+
+    async def _close_when_idle():
+        try:
+            await asyncio.sleep(RETIRED_CLIENT_GRACE)
+            while xui_client.in_flight:
+                await asyncio.sleep(RETIRED_CLIENT_GRACE)
+            await xui_client.close()
+        except Exception as e:
+            logger.error(f"Error closing replaced X-UI client for {xui_client.api_url}: {e}")
+        finally:
+            _retired_clients.pop(xui_client, None)
+
+    _retired_clients[xui_client] = asyncio.create_task(_close_when_idle())
+
+
+async def close_all_clients():
+    """Closes every pooled X-UI client. Called from the application shutdown hook."""
+    entries = list(_client_registry.values())
+    _client_registry.clear()
+    for task in _retired_clients.values():
+        task.cancel()
+    entries += [(None, xui_client) for xui_client in _retired_clients]
+    _retired_clients.clear()
+    for _, xui_client in entries:
+        try:
+            await xui_client.close()
+        except Exception as e:
+            logger.error(f"Error closing X-UI client for {xui_client.api_url}: {e}")
+    logger.info(f"Closed {len(entries)} pooled X-UI clients.")
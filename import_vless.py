@@ -59,7 +59,7 @@ async def import_vless_clients():
         password=decrypted_password
     )
 
-    successful_imports = 0
+    client_configs = []
     failed_imports = 0
 
     for link in VLESS_LINKS:
@@ -74,29 +74,32 @@ async def import_vless_clients():
             query_params = parse_qs(parsed_link.query)
             flow = query_params.get('flow', [''])[0] # Извлекаем flow, если есть
 
-            client_config = ClientConfig(
+            client_configs.append(ClientConfig(
                 id=uuid_part,
                 email=remark, # Используем remark как email для идентификации
                 flow=flow,
                 totalGB=0, # Неограниченный трафик
                 expiryTime=0, # Никогда не истекает
                 enable=True
-            )
-
-            logger.info(f"Попытка добавить клиента {remark} (UUID: {uuid_part[:8]}...) в inbound {INBOUND_ID}")
-            add_response = await xui_client.add_client(INBOUND_ID, client_config)
-
-            if add_response.get("success"):
-                logger.success(f"Успешно добавлен клиент: {remark}")
-                successful_imports += 1
-            else:
-                logger.error(f"Не удалось добавить клиента {remark}: {add_response.get('msg', 'Неизвестная ошибка')}")
-                failed_imports += 1
+            ))
 
         except Exception as e:
             logger.error(f"Ошибка при обработке ссылки {link}: {e}")
             failed_imports += 1
 
+    # Все клиенты добавляются пачками, одним запросом на пачку
+    logger.info(f"Попытка добавить {len(client_configs)} клиентов в inbound {INBOUND_ID}")
+    results = await xui_client.add_clients(INBOUND_ID, client_configs)
+
+    successful_imports = 0
+    for result in results:
+        if result.success:
+            logger.success(f"Успешно добавлен клиент: {result.email}")
+            successful_imports += 1
+        else:
+            logger.error(f"Не удалось добавить клиента {result.email}: {result.error}")
+            failed_imports += 1
+
     await xui_client.close()
     logger.info(f"--- Импорт завершен. Успешно: {successful_imports}, Ошибок: {failed_imports} ---")
 
@@ -5,6 +5,7 @@ import ipaddress
 from aiogram import Bot, Dispatcher
 from fastapi import FastAPI, Request, APIRouter
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from loguru import logger
 import uvicorn
 import json
@@ -17,10 +18,16 @@ from sqlalchemy import select
 
 from core.config import settings
 from core.handlers import user_handlers, admin_handlers, info_handlers
-from core.database.database import init_db, async_session_maker
+from core.database.database import init_db, async_session_maker, async_engine, sync_database_url
+from core.database.pool_metrics import report_pool_metrics
 from core.database.models import User, Tariff, Server, Transaction, GiftCode
 from core.middlewares.db_middleware import DbSessionMiddleware
-from core.services.scheduler_jobs import check_expiring_subscriptions, deactivate_expired_users
+from core.middlewares.retry_policy_middleware import RetryPolicyMiddleware
+from core.services import job_runner
+from core.services.xui_client import close_all_clients
+from core.services.message_dispatcher import start_dispatcher, stop_dispatcher, queue_message, Priority
+from core.services.broadcast_service import watch_broadcasts, stop_broadcasts
+from core.services.catalog import load_catalog
 from core.handlers.user_handlers import _create_or_update_vpn_key, _get_user_and_lang, generate_unique_code
 from core.locales.translations import get_text, get_db_text
 
@@ -36,7 +43,12 @@ dp.include_router(user_handlers.router)
 dp.include_router(admin_handlers.router)
 dp.include_router(info_handlers.router)
 
-dp.update.middleware(DbSessionMiddleware(session_maker=async_session_maker))
+# Inner middlewares run after routing, so the DB middleware can read the handler's flags.
+db_session_middleware = DbSessionMiddleware(session_maker=async_session_maker)
+for observer in (dp.message, dp.callback_query, dp.pre_checkout_query, dp.inline_query):
+    observer.middleware(db_session_middleware)
+dp.message.middleware(RetryPolicyMiddleware())
+dp.callback_query.middleware(RetryPolicyMiddleware())
 
 # Инициализация FastAPI приложения
 app = FastAPI()
@@ -64,22 +76,22 @@ async def process_successful_payment(session: AsyncSession, bot: Bot, transactio
             if not server:
                 logger.error(f"[YooKassa Webhook] Server {server_id} not found for transaction {transaction.id}")
                 user.unassigned_days += tariff.duration_days
-                await bot.send_message(user.telegram_id, get_text('payment_success_days_added_server_fail', lang).format(days=tariff.duration_days))
+                await queue_message(bot, user.telegram_id, get_text('payment_success_days_added_server_fail', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
             else:
                 try:
                     vless_link, _ = await _create_or_update_vpn_key(session, user, server, tariff.duration_days, lang, is_trial=False)
-                    await bot.send_message(user.telegram_id, get_text('payment_success_key_created', lang).format(
+                    await queue_message(bot, user.telegram_id, get_text('payment_success_key_created', lang).format(
                         server_name=get_db_text(server.name, lang),
                         vless_link=vless_link,
                         days=tariff.duration_days
-                    ), parse_mode='HTML')
+                    ), parse_mode='HTML', priority=Priority.PAYMENT)
                 except Exception as e:
                     logger.error(f"[YooKassa Webhook] Error creating VPN key for transaction {transaction.id}: {e}", exc_info=True)
                     user.unassigned_days += tariff.duration_days
-                    await bot.send_message(user.telegram_id, get_text('payment_success_key_error_webhook', lang).format(days=tariff.duration_days))
+                    await queue_message(bot, user.telegram_id, get_text('payment_success_key_error_webhook', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
         else:
             user.unassigned_days += tariff.duration_days
-            await bot.send_message(user.telegram_id, get_text('payment_success_days_added', lang).format(days=tariff.duration_days))
+            await queue_message(bot, user.telegram_id, get_text('payment_success_days_added', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
 
     elif payment_type == 'gift':
         gift_code_str = generate_unique_code()
@@ -88,12 +100,14 @@ async def process_successful_payment(session: AsyncSession, bot: Bot, transactio
         
         bot_user = await bot.get_me()
         gift_link = f"https://t.me/{bot_user.username}?start=G_{gift_code_str}"
-        await bot.send_message(
-            chat_id=user.telegram_id,
-            text=get_text('gift_purchase_success', lang).format(
+        await queue_message(
+            bot,
+            user.telegram_id,
+            get_text('gift_purchase_success', lang).format(
                 tariff_name=get_db_text(tariff.name, lang),
                 gift_link=gift_link
-            )
+            ),
+            priority=Priority.PAYMENT
         )
         logger.info(f"[YooKassa Webhook] User {user.telegram_id} purchased a gift subscription. Code: {gift_code_str}")
 
@@ -132,26 +146,26 @@ async def process_cryptobot_payment(session: AsyncSession, bot: Bot, transaction
                 logger.error(f"[CryptoBot Webhook] Server object with id {server_id} not found in DB.")
                 logger.info(f"[CryptoBot Webhook] Adding {tariff.duration_days} unassigned days to user {user.id}.")
                 user.unassigned_days += tariff.duration_days
-                await bot.send_message(user.telegram_id, get_text('payment_success_days_added_server_fail', lang).format(days=tariff.duration_days))
+                await queue_message(bot, user.telegram_id, get_text('payment_success_days_added_server_fail', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
             else:
                 logger.info(f"[CryptoBot Webhook] Server object found: {server.name}. Attempting to create/update VPN key.")
                 try:
                     vless_link, _ = await _create_or_update_vpn_key(session, user, server, tariff.duration_days, lang, is_trial=False)
                     logger.info(f"[CryptoBot Webhook] Key created/updated successfully. Sending success message to user {user.id}.")
-                    await bot.send_message(user.telegram_id, get_text('payment_success_key_created', lang).format(
+                    await queue_message(bot, user.telegram_id, get_text('payment_success_key_created', lang).format(
                         server_name=get_db_text(server.name, lang),
                         vless_link=vless_link,
                         days=tariff.duration_days
-                    ), parse_mode='HTML')
+                    ), parse_mode='HTML', priority=Priority.PAYMENT)
                 except Exception as e:
                     logger.error(f"[CryptoBot Webhook] Error creating VPN key for transaction {transaction.id}: {e}", exc_info=True)
                     logger.info(f"[CryptoBot Webhook] Adding {tariff.duration_days} unassigned days to user {user.id} due to key creation error.")
                     user.unassigned_days += tariff.duration_days
-                    await bot.send_message(user.telegram_id, get_text('payment_success_key_error_webhook', lang).format(days=tariff.duration_days))
+                    await queue_message(bot, user.telegram_id, get_text('payment_success_key_error_webhook', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
         else:
             logger.info(f"[CryptoBot Webhook] No Server ID found. Adding {tariff.duration_days} unassigned days to user {user.id}.")
             user.unassigned_days += tariff.duration_days
-            await bot.send_message(user.telegram_id, get_text('payment_success_days_added', lang).format(days=tariff.duration_days))
+            await queue_message(bot, user.telegram_id, get_text('payment_success_days_added', lang).format(days=tariff.duration_days), priority=Priority.PAYMENT)
 
     transaction.status = 'succeeded'
     logger.info(f"[CryptoBot Webhook] Committing transaction {transaction.id} as 'succeeded'.")
@@ -256,7 +270,7 @@ async def cryptobot_webhook(request: Request):
                 return {"status": "ok"}
 
             try:
-                await bot.send_message(settings.ADMIN_IDS_LIST[0], f"Found transaction {transaction.id} with status: {transaction.status}")
+                await queue_message(bot, settings.ADMIN_IDS_LIST[0], f"Found transaction {transaction.id} with status: {transaction.status}", priority=Priority.ADMIN)
             except Exception as e:
                 logger.error(f"Failed to send debug message: {e}")
 
@@ -276,19 +290,42 @@ async def startup_event():
     logger.info("FastAPI application started!")
     app.state.bot = bot # Сохраняем экземпляр бота в состояние FastAPI
     await init_db()
+    await load_catalog(async_session_maker)
+    app.state.pool_metrics_task = asyncio.create_task(report_pool_metrics(async_engine))
+    start_dispatcher(bot)
+    app.state.broadcast_watch_task = asyncio.create_task(watch_broadcasts(bot, async_session_maker))
     logger.info(f"YooKassa Secret Key (from settings): {settings.YOOKASSA_SECRET_KEY}") # ADD THIS LINE
     
-    # Добавляем задачи в планировщик
-    # Передаем session_maker в задачи, чтобы они могли создавать свои сессии
-    scheduler.add_job(check_expiring_subscriptions, 'cron', hour=9, minute=0, args=(bot, async_session_maker))
-    scheduler.add_job(deactivate_expired_users, 'cron', hour=0, minute=5, args=(async_session_maker,))
-    scheduler.start()
-    logger.info("Scheduler started.")
+    # Планировщик и его задачи запускаются только на реплике-лидере (advisory lock в Postgres):
+    # общий SQLAlchemyJobStore нельзя использовать из нескольких работающих планировщиков.
+    # Задачи хранятся в БД без аргументов; бот и session_maker передаются через job_runner.configure.
+    job_runner.configure(bot, async_session_maker, async_engine)
+    scheduler.configure(
+        jobstores={"default": SQLAlchemyJobStore(url=sync_database_url(settings.DB_URL))},
+        job_defaults={"coalesce": True, "max_instances": 1, "misfire_grace_time": 300}
+    )
+    app.state.scheduler_leader_task = asyncio.create_task(job_runner.run_scheduler_on_leader(scheduler, add_scheduler_jobs))
+
+def add_scheduler_jobs(scheduler: AsyncIOScheduler):
+    """Registers the scheduler jobs; called on the leader right before its scheduler starts."""
+    scheduler.add_job(job_runner.expiring_subscriptions_job, 'cron', hour=9, minute=0, id="check_expiring_subscriptions", replace_existing=True)
+    scheduler.add_job(job_runner.expired_users_sweep_job, 'cron', hour=0, minute=5, id="deactivate_expired_users", replace_existing=True)
+    scheduler.add_job(job_runner.new_expirations_job, 'interval', seconds=settings.EXPIRY_CHECK_INTERVAL, id="process_new_expirations", replace_existing=True)
+    scheduler.add_job(job_runner.prune_job_runs_job, 'cron', hour=0, minute=30, id="prune_job_runs", replace_existing=True)
+    scheduler.add_job(job_runner.referral_counters_repair_job, 'cron', hour=3, minute=0, id="repair_referral_counters", replace_existing=True)
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("FastAPI application stopped!")
-    scheduler.shutdown()
+    app.state.scheduler_leader_task.cancel()
+    if scheduler.running:
+        scheduler.shutdown()
+    await job_runner.shutdown()
+    app.state.broadcast_watch_task.cancel()
+    await stop_broadcasts()
+    await stop_dispatcher()
+    await close_all_clients()
+    app.state.pool_metrics_task.cancel()
     await bot.session.close()
 
 async def start_bot_polling():
@@ -0,0 +1,276 @@
+# tests/fake_xui_panel.py
+#
+# An in-process imitation of the 3x-ui panel API, for exercising XUIClient,
+# the scheduler jobs and the payment flows without a real panel.
+#
+# In tests, talk to it without a network socket:
+#     panel = FakeXUIPanel()
+#     panel.add_inbound(1, client_count=10000)
+#     client = XUIClient(panel.url, "admin", "admin", transport=httpx.ASGITransport(app=panel.app))
+#
+# Or run it as a server:
+#     python -m tests.fake_xui_panel --port 2053 --clients 100000 --latency 0.05
+
+import argparse
+import asyncio
+import json
+import random
+import secrets
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+
+SESSION_COOKIE = "3x-ui"
+
+REALITY_STREAM_SETTINGS = {
+    "network": "tcp",
+    "security": "reality",
+    "externalProxy": [],
+    "realitySettings": {
+        "show": False, "xver": 0, "dest": "yahoo.com:443", "serverNames": ["yahoo.com"],
+        "privateKey": "fake-private-key", "minClient": "", "maxClient": "", "maxTimediff": 0,
+        "shortIds": ["bb"], "settings": {"publicKey": "fake-public-key", "fingerprint": "chrome", "spiderX": "/"}
+    },
+    "tcpSettings": {"header": {"type": "none"}}
+}
+
+
+def synthetic_client(index: int, rng: random.Random) -> Dict[str, Any]:
+    """A client entry shaped like the ones the bot creates."""
+    telegram_id = str(100000000 + index)
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "email": telegram_id,
+        "flow": "",
+        "limitIp": 0,
+        "totalGB": 0,
+        "expiryTime": 1893456000000,
+        "enable": True,
+        "tgId": telegram_id,
+        "subId": ""
+    }
+
+
+@dataclass
+class FakePanelConfig:
+    username: str = "admin"
+    password: str = "admin"
+    latency: float = 0.0 # Seconds added to every API call
+    latency_jitter: float = 0.0 # Extra random latency, uniformly 0..latency_jitter
+    error_rate: float = 0.0 # Share of API calls answered with HTTP 500
+    session_ttl: Optional[float] = None # Sessions stop working after this many seconds
+    seed: int = 0
+
+
+class FakeInbound:
+    def __init__(self, inbound_id: int, port: int, stream_settings: Dict[str, Any]):
+        self.id = inbound_id
+        self.port = port
+        self.stream_settings = stream_settings
+        self.clients: Dict[str, Dict[str, Any]] = {}
+        self._emails: Dict[str, str] = {}
+        self._settings_json: Optional[str] = None
+
+    def add(self, client: Dict[str, Any]):
+        self.clients[client["id"]] = client
+        self._emails[client["email"]] = client["id"]
+        self._settings_json = None
+
+    def remove(self, client_id: str):
+        client = self.clients.pop(client_id)
+        self._emails.pop(client["email"], None)
+        self._settings_json = None
+
+    def has_email(self, email: str) -> bool:
+        return email in self._emails
+
+    def to_json(self) -> Dict[str, Any]:
+        # Serializing 100k clients is slow; the string is rebuilt only after changes.
+        if self._settings_json is None:
+            self._settings_json = json.dumps({"clients": list(self.clients.values()), "decryption": "none", "fallbacks": []})
+        return {
+            "id": self.id, "up": 0, "down": 0, "total": 0, "remark": f"fake-{self.id}", "enable": True,
+            "expiryTime": 0, "clientStats": None, "listen": "", "port": self.port, "protocol": "vless",
+            "settings": self._settings_json,
+            "streamSettings": json.dumps(self.stream_settings),
+            "tag": f"inbound-{self.port}",
+            "sniffing": json.dumps({"enabled": True, "destOverride": ["http", "tls"]})
+        }
+
+
+class FakeXUIPanel:
+    """The subset of the 3x-ui API that XUIClient uses, with latency and error injection."""
+
+    def __init__(self, config: Optional[FakePanelConfig] = None, url: str = "http://fake-xui.local"):
+        # Only used as the client's base URL; distinct URLs keep sessions of several fake panels apart.
+        self.url = url
+        self.config = config or FakePanelConfig()
+        self.inbounds: Dict[int, FakeInbound] = {}
+        self.sessions: Dict[str, float] = {}
+        self.stats: Counter = Counter()
+        self._injected_errors: List[int] = []
+        self._rng = random.Random(self.config.seed)
+        self.app = self._build_app()
+
+    # --- Test controls ---
+
+    def add_inbound(self, inbound_id: int, client_count: int = 0, port: int = 443, stream_settings: Optional[Dict[str, Any]] = None) -> FakeInbound:
+        inbound = FakeInbound(inbound_id, port, stream_settings or REALITY_STREAM_SETTINGS)
+        for index in range(client_count):
+            inbound.add(synthetic_client(index, self._rng))
+        self.inbounds[inbound_id] = inbound
+        return inbound
+
+    def inject_errors(self, *status_codes: int):
+        """The next API calls are answered with these HTTP statuses, in order."""
+        self._injected_errors.extend(status_codes)
+
+    def expire_sessions(self):
+        self.sessions.clear()
+
+    # --- Request handling ---
+
+    async def _simulate_conditions(self) -> Optional[Response]:
+        delay = self.config.latency + self._rng.uniform(0, self.config.latency_jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self._injected_errors:
+            return PlainTextResponse("injected error", status_code=self._injected_errors.pop(0))
+        if self.config.error_rate and self._rng.random() < self.config.error_rate:
+            return PlainTextResponse("random error", status_code=500)
+        return None
+
+    def _is_logged_in(self, request: Request) -> bool:
+        created = self.sessions.get(request.cookies.get(SESSION_COOKIE, ""))
+        if created is None:
+            return False
+        return self.config.session_ttl is None or time.monotonic() - created < self.config.session_ttl
+
+    async def _guard(self, request: Request, endpoint: str) -> Optional[Response]:
+        self.stats[endpoint] += 1
+        failure = await self._simulate_conditions()
+        if failure:
+            self.stats["errors"] += 1
+            return failure
+        if not self._is_logged_in(request):
+            # 3x-ui 2.x hides the API from anonymous callers behind a 404.
+            self.stats["unauthorized"] += 1
+            return PlainTextResponse("404 page not found", status_code=404)
+        return None
+
+    @staticmethod
+    async def _form(request: Request) -> Dict[str, str]:
+        fields = parse_qs((await request.body()).decode())
+        return {key: values[0] for key, values in fields.items()}
+
+    @staticmethod
+    def _result(success: bool, msg: str = "", obj: Any = None) -> JSONResponse:
+        return JSONResponse({"success": success, "msg": msg, "obj": obj})
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake 3x-ui panel")
+
+        @app.post("/login")
+        async def login(request: Request):
+            self.stats["login"] += 1
+            failure = await self._simulate_conditions()
+            if failure:
+                return failure
+            form = await self._form(request)
+            if form.get("username") != self.config.username or form.get("password") != self.config.password:
+                return self._result(False, "Invalid username or password")
+            token = secrets.token_hex(16)
+            self.sessions[token] = time.monotonic()
+            response = self._result(True, "Login successful")
+            response.set_cookie(SESSION_COOKIE, token, path="/", httponly=True)
+            return response
+
+        @app.get("/panel/api/inbounds/get/{inbound_id}")
+        async def get_inbound(inbound_id: int, request: Request):
+            if failure := await self._guard(request, "get"):
+                return failure
+            inbound = self.inbounds.get(inbound_id)
+            if not inbound:
+                return self._result(False, "record not found")
+            return self._result(True, obj=inbound.to_json())
+
+        @app.post("/panel/api/inbounds/addClient")
+        async def add_client(request: Request):
+            if failure := await self._guard(request, "addClient"):
+                return failure
+            form = await self._form(request)
+            inbound = self.inbounds.get(int(form.get("id", 0)))
+            if not inbound:
+                return self._result(False, "record not found")
+            clients = json.loads(form["settings"])["clients"]
+            # The real panel validates the whole batch before applying any of it.
+            emails = [client["email"] for client in clients]
+            for email in emails:
+                if inbound.has_email(email) or emails.count(email) > 1:
+                    return self._result(False, f"Duplicate email: {email}")
+            for client in clients:
+                inbound.add(client)
+            return self._result(True, "Client(s) added")
+
+        @app.post("/panel/api/inbounds/updateClient/{client_id}")
+        async def update_client(client_id: str, request: Request):
+            if failure := await self._guard(request, "updateClient"):
+                return failure
+            form = await self._form(request)
+            inbound = self.inbounds.get(int(form.get("id", 0)))
+            if not inbound:
+                return self._result(False, "record not found")
+            if client_id not in inbound.clients:
+                return self._result(False, "Client not found")
+            client = json.loads(form["settings"])["clients"][0]
+            inbound.remove(client_id)
+            inbound.add(client)
+            return self._result(True, "Client updated")
+
+        @app.post("/panel/api/inbounds/{inbound_id}/delClient/{client_id}")
+        async def delete_client(inbound_id: int, client_id: str, request: Request):
+            if failure := await self._guard(request, "delClient"):
+                return failure
+            inbound = self.inbounds.get(inbound_id)
+            if not inbound:
+                return self._result(False, "record not found")
+            if client_id not in inbound.clients:
+                return self._result(False, "Client not found")
+            inbound.remove(client_id)
+            return self._result(True, "Client deleted")
+
+        return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run a fake 3x-ui panel.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2053)
+    parser.add_argument("--inbound-id", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=1000, help="Clients in the inbound, up to 100k")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--latency-jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--session-ttl", type=float, default=None)
+    args = parser.parse_args()
+
+    panel = FakeXUIPanel(FakePanelConfig(
+        latency=args.latency,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        session_ttl=args.session_ttl
+    ))
+    panel.add_inbound(args.inbound_id, client_count=args.clients)
+    uvicorn.run(panel.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import StaticPool
+
+from core.database.models import Base
+
+
+@pytest.fixture
+async def sqlite_engine():
+    """A throwaway in-memory SQLite database with the full schema."""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def session_maker(sqlite_engine):
+    """Session factory for `sqlite_engine`. Test modules that seed data override it and build on this one."""
+    return async_sessionmaker(sqlite_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+@pytest.fixture
+def queries(sqlite_engine):
+    """SQL statements sent to `sqlite_engine` from the moment the fixture is set up."""
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(sqlite_engine.sync_engine, "before_cursor_execute", listener)
+    yield statements
+    event.remove(sqlite_engine.sync_engine, "before_cursor_execute", listener)
@@ -0,0 +1,91 @@
+import pytest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+from core.config import settings
+from core.database.models import User, Server, Subscription
+from core.handlers.admin_handlers import _get_users_page, cq_list_users, cq_list_users_page
+
+
+@pytest.fixture
+async def session_maker(session_maker, monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_USERS_PAGE_SIZE", 10)
+    now = datetime.utcnow()
+    async with session_maker() as session:
+        session.add(Server(id=1, name="S1", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+        session.add_all([User(telegram_id=1000 + i, username=f"user{i}") for i in range(25)])
+        await session.flush()
+        session.add_all([
+            Subscription(user_id=1000, server_id=1, xui_user_uuid="a", expires_at=now + timedelta(days=5), is_active=True),
+            Subscription(user_id=1000, server_id=1, xui_user_uuid="b", expires_at=now + timedelta(days=9), is_active=True),
+            # Deactivated and expired subscriptions don't count.
+            Subscription(user_id=1000, server_id=1, xui_user_uuid="c", expires_at=now + timedelta(days=9), is_active=False),
+            Subscription(user_id=1001, server_id=1, xui_user_uuid="d", expires_at=now - timedelta(days=1), is_active=True),
+        ])
+        await session.commit()
+    return session_maker
+
+
+def make_callback(data):
+    callback = MagicMock()
+    callback.data = data
+    callback.answer = AsyncMock()
+    callback.message.edit_text = AsyncMock()
+    return callback
+
+
+def button_data(callback):
+    keyboard = callback.message.edit_text.call_args.kwargs["reply_markup"]
+    return [button.callback_data for row in keyboard.inline_keyboard for button in row]
+
+
+@pytest.mark.asyncio
+async def test_pages_walk_forward_and_back(session_maker):
+    async with session_maker() as session:
+        first, has_prev, has_next = await _get_users_page(session)
+        assert [row.telegram_id for row in first] == list(range(1000, 1010))
+        assert (has_prev, has_next) == (False, True)
+        assert [row.active_subscriptions for row in first[:2]] == [2, 0]
+
+        second, has_prev, has_next = await _get_users_page(session, first[-1].id)
+        assert [row.telegram_id for row in second] == list(range(1010, 1020))
+        assert (has_prev, has_next) == (True, True)
+
+        last, has_prev, has_next = await _get_users_page(session, second[-1].id)
+        assert [row.telegram_id for row in last] == list(range(1020, 1025))
+        assert (has_prev, has_next) == (True, False)
+
+        back, has_prev, has_next = await _get_users_page(session, last[0].id, backwards=True)
+        assert [row.telegram_id for row in back] == list(range(1010, 1020))
+        assert (has_prev, has_next) == (True, True)
+
+        back, has_prev, has_next = await _get_users_page(session, back[0].id, backwards=True)
+        assert [row.telegram_id for row in back] == list(range(1000, 1010))
+        assert (has_prev, has_next) == (False, True)
+
+
+@pytest.mark.asyncio
+async def test_page_is_one_query_with_navigation(session_maker, queries):
+    callback = make_callback("admin_list_users")
+    async with session_maker() as session:
+        await cq_list_users(callback, session)
+
+    assert len(queries) == 1
+    text = callback.message.edit_text.call_args.args[0]
+    assert "<code>1009</code>" in text and "<code>1010</code>" not in text
+    assert button_data(callback) == ["admin_users_page_next_10", "admin_users_menu"]
+
+    callback = make_callback("admin_users_page_next_20")
+    async with session_maker() as session:
+        await cq_list_users_page(callback, session)
+    assert "<code>1020</code>" in callback.message.edit_text.call_args.args[0]
+    assert button_data(callback) == ["admin_users_page_prev_21", "admin_users_menu"]
+
+
+@pytest.mark.asyncio
+async def test_stale_cursor_restarts_from_the_first_page(session_maker):
+    callback = make_callback("admin_users_page_next_500")
+    async with session_maker() as session:
+        await cq_list_users_page(callback, session)
+    assert "<code>1000</code>" in callback.message.edit_text.call_args.args[0]
+    assert button_data(callback) == ["admin_users_page_next_10", "admin_users_menu"]
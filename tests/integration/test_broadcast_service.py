@@ -0,0 +1,197 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from aiogram import Bot
+from datetime import datetime, timedelta
+
+from core.database.models import Broadcast, User, Server, Subscription
+from core.services import broadcast_service
+from core.services.broadcast_service import (
+    BroadcastStatus, Segment, count_recipients, create_broadcast, resume_broadcasts, stop_broadcasts, start_broadcast
+)
+from core.services.message_dispatcher import MessageDispatcher
+
+
+@pytest.fixture(autouse=True)
+def small_pages():
+    with patch('core.services.broadcast_service.settings.BROADCAST_PAGE_SIZE', 3):
+        yield
+
+
+async def seed_users(session_maker, count, language_code="ru"):
+    """Users 1..count; user 1 has an active subscription, user 2 an expired one, user 3 is banned."""
+    now = datetime.utcnow()
+    async with session_maker() as session:
+        session.add(Server(id=1, name="S1", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+        for telegram_id in range(1, count + 1):
+            session.add(User(telegram_id=telegram_id, language_code=language_code, is_banned=telegram_id == 3))
+        await session.flush()
+        session.add(Subscription(user_id=1, server_id=1, xui_user_uuid="a", expires_at=now + timedelta(days=5), is_active=True))
+        session.add(Subscription(user_id=2, server_id=1, xui_user_uuid="b", expires_at=now - timedelta(days=5), is_active=False))
+        await session.commit()
+
+
+async def load(session_maker, broadcast_id) -> Broadcast:
+    async with session_maker() as session:
+        return await session.get(Broadcast, broadcast_id)
+
+
+def sent_to(bot):
+    return [call.kwargs["chat_id"] for call in bot.send_message.await_args_list]
+
+
+@pytest.mark.asyncio
+async def test_segments_select_expected_users(session_maker):
+    await seed_users(session_maker, 5)
+    async with session_maker() as session:
+        assert await count_recipients(session, Segment.ALL) == 4
+        assert await count_recipients(session, Segment.ACTIVE) == 1
+        assert await count_recipients(session, Segment.EXPIRED) == 1
+        assert await count_recipients(session, Segment.NO_SUBSCRIPTION) == 2
+        assert await count_recipients(session, Segment.ALL, "en") == 0
+
+
+@pytest.mark.asyncio
+async def test_broadcast_pages_through_all_recipients(session_maker):
+    await seed_users(session_maker, 10)
+    bot = AsyncMock(spec=Bot)
+
+    async with session_maker() as session:
+        broadcast = await create_broadcast(session, bot, session_maker, "Hello", Segment.ALL, None, created_by=1)
+    await broadcast_service._tasks[broadcast.id]
+
+    assert sent_to(bot) == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+    saved = await load(session_maker, broadcast.id)
+    assert saved.status == BroadcastStatus.COMPLETED
+    assert (saved.total, saved.sent, saved.failed) == (9, 9, 0)
+    assert saved.cursor_user_id == 10
+
+
+@pytest.mark.asyncio
+async def test_broadcast_counts_failures(session_maker):
+    await seed_users(session_maker, 4)
+    bot = AsyncMock(spec=Bot)
+    bot.send_message.side_effect = [None, Exception("bot was blocked by the user"), None]
+
+    async with session_maker() as session:
+        broadcast = await create_broadcast(session, bot, session_maker, "Hello", Segment.ALL, None, created_by=1)
+    await broadcast_service._tasks[broadcast.id]
+
+    saved = await load(session_maker, broadcast.id)
+    assert (saved.sent, saved.failed) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_running_broadcast_resumes_from_cursor(session_maker):
+    await seed_users(session_maker, 8)
+    async with session_maker() as session:
+        session.add(Broadcast(id=1, text="Hi", segment=Segment.ALL, status=BroadcastStatus.RUNNING,
+                              cursor_user_id=5, total=7, sent=4, failed=0, created_by=1))
+        await session.commit()
+    bot = AsyncMock(spec=Bot)
+
+    await resume_broadcasts(bot, session_maker)
+    await broadcast_service._tasks[1]
+
+    assert sent_to(bot) == [6, 7, 8]
+    saved = await load(session_maker, 1)
+    assert saved.status == BroadcastStatus.COMPLETED
+    assert saved.sent == 7
+
+
+@pytest.mark.asyncio
+async def test_interrupted_broadcast_does_not_repeat_delivered_messages(session_maker):
+    await seed_users(session_maker, 10)
+    bot = AsyncMock(spec=Bot)
+    first_sends = asyncio.Event()
+
+    async def slow_send(**kwargs):
+        if bot.send_message.await_count == 4:
+            first_sends.set()
+        await asyncio.sleep(0.01)
+
+    bot.send_message.side_effect = slow_send
+    dispatcher = MessageDispatcher(bot, global_rate=1000, per_chat_interval=0, lane_size=100, workers=1)
+    dispatcher.start()
+    with patch('core.services.broadcast_service.queue_message',
+               lambda bot, chat_id, text, priority, **kw: dispatcher.enqueue(chat_id, text, priority, **kw)):
+        async with session_maker() as session:
+            broadcast = await create_broadcast(session, bot, session_maker, "Hello", Segment.ALL, None, created_by=1)
+        await first_sends.wait()
+        await stop_broadcasts()
+        await dispatcher.stop()
+
+        saved = await load(session_maker, broadcast.id)
+        assert saved.status == BroadcastStatus.RUNNING
+        delivered = sent_to(bot)
+
+        dispatcher = MessageDispatcher(bot, global_rate=1000, per_chat_interval=0, lane_size=100, workers=1)
+        dispatcher.start()
+        await start_broadcast(bot, session_maker, broadcast.id)
+        await dispatcher.stop()
+
+    recipients = sent_to(bot)
+    assert sorted(set(recipients)) == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+    # At most the message in flight at shutdown goes out twice.
+    assert len(recipients) - 9 <= 1
+    assert len(delivered) < 9
+    assert (await load(session_maker, broadcast.id)).status == BroadcastStatus.COMPLETED
+
+
+@pytest.mark.asyncio
+async def test_page_with_nothing_delivered_keeps_the_cursor(session_maker):
+    await seed_users(session_maker, 4)
+    bot = AsyncMock(spec=Bot)
+
+    async def withdrawn(bot, chat_id, text, priority, **kwargs):
+        future = asyncio.get_running_loop().create_future()
+        future.cancel()
+        return future
+
+    with patch('core.services.broadcast_service.queue_message', withdrawn):
+        async with session_maker() as session:
+            broadcast = await create_broadcast(session, bot, session_maker, "Hello", Segment.ALL, None, created_by=1)
+        await broadcast_service._tasks[broadcast.id]
+
+    saved = await load(session_maker, broadcast.id)
+    assert saved.status == BroadcastStatus.RUNNING
+    assert (saved.cursor_user_id, saved.sent) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_broadcast_leased_by_another_instance_is_not_resumed(session_maker):
+    await seed_users(session_maker, 4)
+    now = datetime.utcnow()
+    async with session_maker() as session:
+        session.add(Broadcast(id=1, text="Hi", segment=Segment.ALL, status=BroadcastStatus.RUNNING, created_by=1,
+                              owner="replica-b:1", lease_until=now + timedelta(minutes=1)))
+        session.add(Broadcast(id=2, text="Hi", segment=Segment.ALL, status=BroadcastStatus.RUNNING, created_by=1,
+                              owner="replica-c:1", lease_until=now - timedelta(minutes=1)))
+        await session.commit()
+    bot = AsyncMock(spec=Bot)
+
+    # Only the broadcast whose owner stopped renewing its lease is taken over.
+    assert await resume_broadcasts(bot, session_maker) == 1
+    await broadcast_service._tasks[2]
+    assert 1 not in broadcast_service._tasks
+
+    assert sent_to(bot) == [1, 2, 4]
+    assert (await load(session_maker, 1)).status == BroadcastStatus.RUNNING
+    taken_over = await load(session_maker, 2)
+    assert taken_over.status == BroadcastStatus.COMPLETED
+    assert taken_over.owner == broadcast_service.INSTANCE
+
+
+@pytest.mark.asyncio
+async def test_only_one_instance_claims_a_broadcast(session_maker):
+    await seed_users(session_maker, 1)
+    async with session_maker() as session:
+        session.add(Broadcast(id=1, text="Hi", segment=Segment.ALL, status=BroadcastStatus.RUNNING, created_by=1))
+        await session.commit()
+
+    claims = []
+    for instance in ("replica-a:1", "replica-b:1"):
+        with patch('core.services.broadcast_service.INSTANCE', instance):
+            claims.append(await broadcast_service._claim(session_maker, 1))
+    assert claims == [True, False]
+    assert (await load(session_maker, 1)).owner == "replica-a:1"
@@ -0,0 +1,88 @@
+import pytest
+from unittest.mock import patch
+
+from core.database.models import Server, Tariff
+from core.services.app_state import get_state
+from core.services.catalog import CATALOG_VERSION_KEY, CatalogCache, bump_catalog_version
+
+
+@pytest.fixture
+async def session_maker(session_maker):
+    async with session_maker() as session:
+        session.add_all([
+            Server(id=1, name="Нидерланды", api_url="http://s1", api_user="u", api_password="p", inbound_id=1),
+            Server(id=2, name="Off", api_url="http://s2", api_user="u", api_password="p", inbound_id=1, is_active=False),
+            Tariff(id=1, name={"ru": "Год", "en": "Year"}, duration_days=365, price_rub=100000, price_stars=666),
+            Tariff(id=2, name={"ru": "Месяц", "en": "Month"}, duration_days=30, price_rub=9900, price_stars=66),
+        ])
+        await session.commit()
+    return session_maker
+
+
+async def change_tariff(session_maker, **values):
+    """What the admin handlers do: change the row and bump the version in the same transaction."""
+    async with session_maker() as session:
+        tariff = await session.get(Tariff, 2)
+        for key, value in values.items():
+            setattr(tariff, key, value)
+        await bump_catalog_version(session)
+        await session.commit()
+
+
+@pytest.mark.asyncio
+async def test_catalog_holds_active_entries_with_rendered_labels(session_maker):
+    cache = CatalogCache(check_interval=30)
+    async with session_maker() as session:
+        catalog = await cache.get(session)
+
+    assert [server.id for server in catalog.servers] == [1]
+    assert [tariff.id for tariff in catalog.tariffs] == [2, 1]
+    assert catalog.tariff(2).label("en") == "Month - 99.0₽ / 66"
+    assert catalog.tariff(2).label("ru") == "Месяц - 99.0₽ / 66"
+    # Languages without a translation fall back to Russian, like get_text.
+    assert catalog.tariff(2).label("de") == "Месяц - 99.0₽ / 66"
+    assert catalog.servers[0].label("ru") == "🇳🇱 Нидерланды 🔓"
+
+
+@pytest.mark.asyncio
+async def test_version_counter_increments(session_maker):
+    async with session_maker() as session:
+        assert await get_state(session, CATALOG_VERSION_KEY) is None
+    await change_tariff(session_maker, price_stars=70)
+    await change_tariff(session_maker, price_stars=71)
+    async with session_maker() as session:
+        assert await get_state(session, CATALOG_VERSION_KEY) == "2"
+
+
+@pytest.mark.asyncio
+async def test_local_invalidation_reloads_immediately(session_maker):
+    cache = CatalogCache(check_interval=30)
+    async with session_maker() as session:
+        await cache.get(session)
+    await change_tariff(session_maker, is_active=False)
+    cache.invalidate()
+    async with session_maker() as session:
+        catalog = await cache.get(session)
+    assert [tariff.id for tariff in catalog.tariffs] == [1]
+    assert catalog.version == 1
+
+
+@pytest.mark.asyncio
+async def test_other_replica_picks_up_change_after_check_interval(session_maker):
+    cache = CatalogCache(check_interval=30)
+    async with session_maker() as session:
+        await cache.get(session)
+    await change_tariff(session_maker, price_rub=5000)
+
+    async with session_maker() as session:
+        assert (await cache.get(session)).tariff(2).price_rub == 9900
+        with patch("core.services.catalog.time.monotonic", return_value=10**9):
+            assert (await cache.get(session)).tariff(2).price_rub == 5000
+
+
+@pytest.mark.asyncio
+async def test_unchanged_version_is_not_reloaded(session_maker):
+    cache = CatalogCache(check_interval=0)
+    async with session_maker() as session:
+        first = await cache.get(session)
+        assert await cache.get(session) is first
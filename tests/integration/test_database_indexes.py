@@ -0,0 +1,22 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from benchmarks.explain_hot_queries import hot_queries
+from core.database.models import Base
+
+
+@pytest.mark.asyncio
+async def test_hot_queries_use_indexes():
+    """SQLite's planner stands in for Postgres here: none of the hot queries may scan a whole table."""
+    engine = create_async_engine("sqlite+aiosqlite://")
+    try:
+        async with engine.connect() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            for name, query in hot_queries(users=1000).items():
+                plan = [row[-1] for row in (await conn.execute(text(f"EXPLAIN QUERY PLAN {query['sql']}"), query["params"])).all()]
+                # Subquery headers such as "CORRELATED SCALAR SUBQUERY 1" are neither a SEARCH nor a SCAN.
+                assert not any(step.startswith("SCAN") for step in plan), f"{name}: {plan}"
+                assert any(step.startswith("SEARCH") for step in plan), f"{name}: {plan}"
+    finally:
+        await engine.dispose()
@@ -0,0 +1,122 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiogram.dispatcher.event.handler import HandlerObject
+from sqlalchemy import select, update
+
+from core.database.models import User
+from core.middlewares.db_middleware import DbSessionMiddleware
+
+
+@pytest.fixture
+async def session_maker(session_maker):
+    async with session_maker() as session:
+        session.add(User(telegram_id=1, username="old"))
+        await session.commit()
+    return session_maker
+
+
+def spy(session_maker):
+    """Wraps the session maker to record every session it hands out."""
+    sessions = []
+
+    def make():
+        session = session_maker()
+        session.commit = AsyncMock(wraps=session.commit)
+        sessions.append(session)
+        return session
+
+    return make, sessions
+
+
+async def call(middleware, handler, flags=None):
+    data = {"handler": HandlerObject(callback=handler, flags=flags or {})}
+    return await middleware(handler, MagicMock(), data)
+
+
+async def username(session_maker):
+    async with session_maker() as session:
+        return await session.scalar(select(User.username).where(User.telegram_id == 1))
+
+
+@pytest.mark.asyncio
+async def test_session_is_not_opened_when_unused(session_maker):
+    make, sessions = spy(session_maker)
+
+    async def handler(event, data):
+        return "ok"
+
+    assert await call(DbSessionMiddleware(make), handler) == "ok"
+    assert sessions == []
+
+
+@pytest.mark.asyncio
+async def test_read_only_handler_skips_commit(session_maker):
+    make, sessions = spy(session_maker)
+
+    async def handler(event, data):
+        return await data["session"].scalar(select(User.username))
+
+    assert await call(DbSessionMiddleware(make), handler) == "old"
+    sessions[0].commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_orm_changes_are_committed(session_maker):
+    make, sessions = spy(session_maker)
+
+    async def handler(event, data):
+        user = await data["session"].scalar(select(User).where(User.telegram_id == 1))
+        user.username = "new"
+
+    await call(DbSessionMiddleware(make), handler)
+    sessions[0].commit.assert_awaited_once()
+    assert await username(session_maker) == "new"
+
+
+@pytest.mark.asyncio
+async def test_bulk_statements_are_committed(session_maker):
+    make, sessions = spy(session_maker)
+
+    async def handler(event, data):
+        await data["session"].execute(update(User).where(User.telegram_id == 1).values(username="bulk"))
+
+    await call(DbSessionMiddleware(make), handler)
+    assert await username(session_maker) == "bulk"
+
+
+@pytest.mark.asyncio
+async def test_handler_commit_is_not_repeated(session_maker):
+    make, sessions = spy(session_maker)
+
+    async def handler(event, data):
+        data["session"].add(User(telegram_id=2))
+        await data["session"].commit()
+
+    await call(DbSessionMiddleware(make), handler)
+    assert sessions[0].commit.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_handler_rolls_back(session_maker):
+    make, sessions = spy(session_maker)
+
+    async def handler(event, data):
+        await data["session"].execute(update(User).values(username="broken"))
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await call(DbSessionMiddleware(make), handler)
+    assert await username(session_maker) == "old"
+
+
+@pytest.mark.asyncio
+async def test_handlers_can_opt_out_of_the_database(session_maker):
+    make, sessions = spy(session_maker)
+    seen = {}
+
+    async def handler(event, data):
+        seen.update(data)
+
+    await call(DbSessionMiddleware(make), handler, flags={"db": False})
+    assert "session" not in seen
+    assert sessions == []
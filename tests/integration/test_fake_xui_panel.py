@@ -0,0 +1,168 @@
+import asyncio
+import uuid
+import httpx
+import pytest
+from unittest.mock import AsyncMock, patch
+from sqlalchemy import select
+
+from core import constants
+from core.database.models import User, Server, Subscription
+from core.handlers.user_handlers import _create_or_update_vpn_key
+from core.services import xui_client as xui_client_module
+from core.services.retry_policy import RetryPolicy, retry_policy
+from core.services.xui_client import XUIClient, XUIClientError, ClientConfig
+from tests.fake_xui_panel import FakeXUIPanel, FakePanelConfig
+
+FAST = RetryPolicy("test", max_attempts=3, budget=5, initial_backoff=0.01, max_backoff=0.02, jitter=0)
+
+
+@pytest.fixture(autouse=True)
+def clean_sessions():
+    xui_client_module._sessions.clear()
+    xui_client_module._login_locks.clear()
+    yield
+    xui_client_module._sessions.clear()
+    xui_client_module._login_locks.clear()
+
+
+def connect(panel: FakeXUIPanel, password: str = "admin") -> XUIClient:
+    return XUIClient(panel.url, "admin", password, transport=httpx.ASGITransport(app=panel.app))
+
+
+@pytest.mark.asyncio
+async def test_client_lifecycle():
+    panel = FakeXUIPanel()
+    panel.add_inbound(1)
+    client = connect(panel)
+    config = ClientConfig(id=str(uuid.uuid4()), email="42", expiryTime=1000)
+
+    await client.add_client(1, config)
+    client._client_index.clear()
+    await client.update_client(1, config.id, 2000)
+    assert panel.inbounds[1].clients[config.id]["expiryTime"] == 2000
+    await client.delete_client(1, config.id)
+    assert panel.inbounds[1].clients == {}
+    assert panel.stats["login"] == 1
+    await client.close()
+
+
+async def issue_key(session_maker, panel, user_id, days, is_trial=False):
+    async with session_maker() as session:
+        user = await session.get(User, user_id)
+        server = await session.get(Server, 1)
+        client = connect(panel)
+        with patch("core.handlers.user_handlers.get_client", AsyncMock(return_value=client)), \
+                patch("core.handlers.user_handlers._generate_vless_link", AsyncMock(return_value="vless://key")):
+            await _create_or_update_vpn_key(session, user, server, days, "en", is_trial=is_trial)
+        await session.commit()
+        await client.close()
+
+
+@pytest.fixture
+async def panel_session_maker(session_maker):
+    panel = FakeXUIPanel()
+    panel.add_inbound(1)
+    async with session_maker() as session:
+        session.add_all([
+            User(id=1, telegram_id=42, language_code="en"),
+            Server(id=1, name="S1", api_url=panel.url, api_user="admin", api_password="x", inbound_id=1),
+        ])
+        await session.commit()
+    return panel, session_maker
+
+
+@pytest.mark.asyncio
+async def test_trial_renewal_after_restart_is_built_from_the_subscription(panel_session_maker):
+    panel, session_maker = panel_session_maker
+    await issue_key(session_maker, panel, 1, 3, is_trial=True)
+    (client_id, trial), = panel.inbounds[1].clients.items()
+    gets = panel.stats["get"]
+
+    # A restarted process starts with an empty client index.
+    await issue_key(session_maker, panel, 1, 30)
+
+    renewed = panel.inbounds[1].clients[client_id]
+    assert renewed["expiryTime"] > trial["expiryTime"]
+    assert renewed["totalGB"] == constants.TRIAL_TRAFFIC_MB * 1024 * 1024
+    assert panel.stats["get"] == gets
+    assert panel.stats["updateClient"] == 1
+
+
+@pytest.mark.asyncio
+async def test_legacy_subscription_renewal_reads_the_panel_once(panel_session_maker):
+    panel, session_maker = panel_session_maker
+    await issue_key(session_maker, panel, 1, 3, is_trial=True)
+    (client_id, trial), = panel.inbounds[1].clients.items()
+    # Set by an admin on the panel for a subscription created before the bot recorded them.
+    trial.update(flow="xtls-rprx-vision", limitIp=2, subId="sub-42")
+    async with session_maker() as session:
+        subscription = await session.scalar(select(Subscription))
+        subscription.total_gb = subscription.flow = subscription.limit_ip = subscription.sub_id = None
+        await session.commit()
+
+    gets = panel.stats["get"]
+    await issue_key(session_maker, panel, 1, 30)
+    await issue_key(session_maker, panel, 1, 30)
+
+    renewed = panel.inbounds[1].clients[client_id]
+    assert renewed["totalGB"] == constants.TRIAL_TRAFFIC_MB * 1024 * 1024
+    assert (renewed["flow"], renewed["limitIp"], renewed["subId"]) == ("xtls-rprx-vision", 2, "sub-42")
+    assert panel.stats["get"] == gets + 1
+    async with session_maker() as session:
+        subscription = await session.scalar(select(Subscription))
+    assert (subscription.total_gb, subscription.flow, subscription.limit_ip, subscription.sub_id) == \
+        (constants.TRIAL_TRAFFIC_MB * 1024 * 1024, "xtls-rprx-vision", 2, "sub-42")
+
+
+@pytest.mark.asyncio
+async def test_wrong_credentials():
+    panel = FakeXUIPanel()
+    panel.add_inbound(1)
+    client = connect(panel, password="wrong")
+    with pytest.raises(XUIClientError, match="Login failed"):
+        await client.get_inbound_raw(1)
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_injected_errors_and_expired_session():
+    panel = FakeXUIPanel()
+    panel.add_inbound(1, client_count=10)
+    client = connect(panel)
+    await client.get_inbound_stream(1)
+
+    panel.expire_sessions()
+    panel.inject_errors(503)
+    with retry_policy(FAST):
+        inbound = await client.get_inbound(1)
+    assert len(inbound.settings.clients) == 10
+    assert panel.stats["errors"] == 1
+    assert panel.stats["login"] == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_duplicate_email_rejects_whole_batch():
+    panel = FakeXUIPanel()
+    panel.add_inbound(1, client_count=1)
+    existing_email = next(iter(panel.inbounds[1].clients.values()))["email"]
+    client = connect(panel)
+    configs = [ClientConfig(id=str(uuid.uuid4()), email=email) for email in ("new", existing_email)]
+
+    results = await client.add_clients(1, configs)
+    assert [r.success for r in results] == [True, False]
+    assert len(panel.inbounds[1].clients) == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_large_inbound_and_latency():
+    panel = FakeXUIPanel(FakePanelConfig(latency=0.05))
+    panel.add_inbound(1, client_count=20000)
+    target = list(panel.inbounds[1].clients)[15000]
+    client = connect(panel)
+    await client.get_inbound_stream(1)
+
+    found = await asyncio.gather(*[client.find_client(1, uuid=target) for _ in range(10)])
+    assert all(c.id == target for c in found)
+    await client.close()
@@ -15,6 +15,7 @@ async def test_start_command_new_user(mocker):
     """Integration test for the /start command with a new user."""
     # 1. Setup Mocks
     session_mock = AsyncMock()
+    session_mock.info = {}
 
     # Correctly mock the chain for fetching the user
     execute_result_user = MagicMock()
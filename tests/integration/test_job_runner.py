@@ -0,0 +1,115 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, patch
+from datetime import datetime, timedelta, timezone
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from sqlalchemy import select
+
+from core.database.models import JobRun
+from core.services import job_runner
+
+
+@pytest.fixture
+def session_maker(session_maker, sqlite_engine):
+    job_runner.configure(AsyncMock(), session_maker, sqlite_engine)
+    return session_maker
+
+
+async def job_runs(session_maker):
+    async with session_maker() as session:
+        return (await session.execute(select(JobRun).order_by(JobRun.id))).scalars().all()
+
+
+@pytest.mark.asyncio
+async def test_run_job_records_success(session_maker):
+    await job_runner.run_job("demo", AsyncMock(return_value=42))
+
+    [run] = await job_runs(session_maker)
+    assert (run.job_name, run.status, run.rows_processed) == ("demo", "success", 42)
+    assert run.instance == job_runner.INSTANCE
+    assert run.finished_at is not None and run.duration >= 0
+
+
+@pytest.mark.asyncio
+async def test_run_job_records_failure(session_maker):
+    await job_runner.run_job("demo", AsyncMock(side_effect=RuntimeError("panel down")))
+
+    [run] = await job_runs(session_maker)
+    assert run.status == "failed"
+    assert run.error == "panel down"
+
+
+@pytest.mark.asyncio
+async def test_run_job_skips_on_follower(session_maker):
+    job = AsyncMock()
+    with patch.object(job_runner._leader, "is_leader", AsyncMock(return_value=False)):
+        await job_runner.run_job("demo", job)
+
+    job.assert_not_called()
+    assert await job_runs(session_maker) == []
+
+
+@pytest.mark.asyncio
+async def test_job_wrappers_pass_configured_dependencies(session_maker):
+    with patch('core.services.job_runner.process_new_expirations', AsyncMock(return_value=3)) as job:
+        await job_runner.new_expirations_job()
+
+    job.assert_awaited_once_with(session_maker)
+    [run] = await job_runs(session_maker)
+    assert (run.job_name, run.rows_processed) == ("process_new_expirations", 3)
+
+
+@pytest.mark.asyncio
+async def test_prune_job_runs_keeps_recent_history(session_maker):
+    now = datetime.utcnow()
+    async with session_maker() as session:
+        session.add(JobRun(job_name="old", instance="x", status="success", started_at=now - timedelta(days=30)))
+        session.add(JobRun(job_name="new", instance="x", status="success", started_at=now - timedelta(hours=1)))
+        await session.commit()
+
+    assert await job_runner.prune_job_runs() == 1
+    assert [run.job_name for run in await job_runs(session_maker)] == ["new"]
+
+
+def leader_election(is_leader: bool):
+    election = AsyncMock(spec=job_runner.LeaderElection)
+    election.is_leader.return_value = is_leader
+    return election
+
+
+def add_prune_job(scheduler):
+    # Due right away, then again in an hour.
+    scheduler.add_job(job_runner.prune_job_runs_job, 'interval', hours=1, id="prune_job_runs",
+                      next_run_time=datetime.now(timezone.utc), replace_existing=True)
+
+
+@pytest.mark.asyncio
+async def test_only_the_leader_runs_a_scheduler_on_the_shared_store(session_maker, tmp_path):
+    store_url = f"sqlite:///{tmp_path / 'jobs.sqlite'}"
+    leader, follower = AsyncIOScheduler(timezone="UTC"), AsyncIOScheduler(timezone="UTC")
+    for scheduler in (leader, follower):
+        scheduler.configure(jobstores={"default": SQLAlchemyJobStore(url=store_url)})
+
+    await job_runner._follow_leadership(follower, add_prune_job, leader_election(False))
+    await job_runner._follow_leadership(leader, add_prune_job, leader_election(True))
+    try:
+        assert leader.running and not follower.running
+        for _ in range(100):
+            if await job_runs(session_maker):
+                break
+            await asyncio.sleep(0.02)
+        # The due run happened on the leader and was recorded.
+        [run] = await job_runs(session_maker)
+        assert (run.job_name, run.status) == ("prune_job_runs", "success")
+
+        # The leader goes away; the follower takes over the stored schedule as it is.
+        await job_runner._follow_leadership(leader, add_prune_job, leader_election(False))
+        await job_runner._follow_leadership(follower, lambda scheduler: None, leader_election(True))
+        assert follower.running and not leader.running
+        assert follower.get_job("prune_job_runs").next_run_time > datetime.now(timezone.utc) + timedelta(minutes=50)
+    finally:
+        for scheduler in (leader, follower):
+            if scheduler.running:
+                scheduler.shutdown(wait=False)
+        await asyncio.sleep(0)
@@ -0,0 +1,55 @@
+import pytest
+from aiogram.types import User as AiogramUser
+from datetime import datetime, timedelta
+
+from core.database.models import User, Server, Subscription
+from core.handlers.user_handlers import _get_main_menu_content
+
+
+@pytest.fixture
+async def session_maker(session_maker):
+    now = datetime.utcnow()
+    async with session_maker() as session:
+        session.add(Server(id=1, name="S1", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+        session.add(Server(id=2, name="S2", api_url="http://s2", api_user="u", api_password="p", inbound_id=1))
+        session.add(User(telegram_id=1, language_code="en", unassigned_days=3, referral_balance=1000,
+                         l2_referral_balance=500, referral_count=2))
+        session.add(User(telegram_id=2, language_code="en"))
+        await session.flush()
+        session.add_all([
+            Subscription(user_id=1, server_id=1, xui_user_uuid="a", expires_at=datetime(2100, 1, 1, 12, 0), is_active=True),
+            Subscription(user_id=1, server_id=2, xui_user_uuid="b", expires_at=now + timedelta(days=5), is_active=True),
+            # Deactivated and expired subscriptions don't count.
+            Subscription(user_id=1, server_id=2, xui_user_uuid="c", expires_at=datetime(2200, 1, 1), is_active=False),
+            Subscription(user_id=2, server_id=1, xui_user_uuid="d", expires_at=now - timedelta(days=1), is_active=True),
+        ])
+        await session.commit()
+    return session_maker
+
+
+def from_user(telegram_id):
+    return AiogramUser(id=telegram_id, is_bot=False, first_name="Test")
+
+
+@pytest.mark.asyncio
+async def test_menu_is_rendered_from_one_query(session_maker, queries):
+    async with session_maker() as session:
+        text, keyboard = await _get_main_menu_content(session, from_user(1))
+
+    assert len(queries) == 1
+    assert "2100-01-01 12:00" in text
+    assert "**3** unused days" in text and "**2** people" in text and "15.00" in text
+    assert keyboard.inline_keyboard[0][0].callback_data == "setup_vpn"
+
+
+@pytest.mark.asyncio
+async def test_menu_without_active_subscription(session_maker):
+    async with session_maker() as session:
+        text, _ = await _get_main_menu_content(session, from_user(2))
+    assert "You don't have an active subscription yet." in text
+
+
+@pytest.mark.asyncio
+async def test_menu_for_unknown_user(session_maker):
+    async with session_maker() as session:
+        assert await _get_main_menu_content(session, from_user(99)) is None
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from core.database.pool_metrics import MeteredQueuePool, instrument, pool_metrics
+
+
+@pytest.mark.asyncio
+async def test_pool_records_checkouts_and_waits(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", poolclass=MeteredQueuePool, pool_size=1, max_overflow=0)
+    instrument(engine)
+    before = pool_metrics.checkouts
+    try:
+        async with engine.connect() as first:
+            await first.execute(text("SELECT 1"))
+            assert pool_metrics.in_use >= 1
+
+            async def second_checkout():
+                async with engine.connect() as second:
+                    await second.execute(text("SELECT 1"))
+
+            waiter = asyncio.create_task(second_checkout())
+            await asyncio.sleep(0.05)
+            assert not waiter.done() # The only connection is taken
+        await waiter
+    finally:
+        await engine.dispose()
+
+    stats = pool_metrics.snapshot(engine.pool)
+    assert pool_metrics.checkouts - before == 2
+    assert stats["wait_max_ms"] >= 40
+    assert stats["pool_size"] == 1
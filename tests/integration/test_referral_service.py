@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import select, update
+
+from core.database.models import User
+from core.services import referral_service
+from core.services.referral_service import (
+    attach_referral, detach_referral, mark_first_vpn_activated, repair_referral_counters
+)
+
+
+async def get_user(session, telegram_id) -> User:
+    return (await session.execute(select(User).where(User.telegram_id == telegram_id))).scalars().first()
+
+
+async def counters(session_maker, telegram_id):
+    async with session_maker() as session:
+        user = await get_user(session, telegram_id)
+        return user.referral_count, user.inactive_referral_count, user.l2_referral_count
+
+
+async def attach(session_maker, telegram_id, referrer_id):
+    async with session_maker() as session:
+        await attach_referral(session, await get_user(session, telegram_id), await get_user(session, referrer_id))
+        await session.commit()
+
+
+@pytest.fixture
+async def chain(session_maker):
+    """1 invited 2, 2 invited 3 and 4."""
+    async with session_maker() as session:
+        session.add_all([User(telegram_id=telegram_id) for telegram_id in range(1, 6)])
+        await session.commit()
+    await attach(session_maker, 2, 1)
+    await attach(session_maker, 3, 2)
+    await attach(session_maker, 4, 2)
+    return session_maker
+
+
+@pytest.mark.asyncio
+async def test_attach_updates_both_referrer_levels(chain):
+    assert await counters(chain, 1) == (1, 1, 2)
+    assert await counters(chain, 2) == (2, 2, 0)
+    assert await counters(chain, 3) == (0, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_existing_referrals_become_second_level(chain):
+    await attach(chain, 1, 5)
+    assert await counters(chain, 5) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_first_activation_is_counted_once(chain):
+    for _ in range(2):
+        async with chain() as session:
+            await mark_first_vpn_activated(session, await get_user(session, 3))
+            await session.commit()
+    assert await counters(chain, 2) == (2, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_detach_before_delete(chain):
+    async with chain() as session:
+        user = await get_user(session, 4)
+        await detach_referral(session, user)
+        await session.delete(user)
+        await session.commit()
+    assert await counters(chain, 2) == (1, 1, 0)
+    assert await counters(chain, 1) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_repair_fixes_only_drifted_users(chain, monkeypatch):
+    monkeypatch.setattr(referral_service, "REPAIR_BATCH_SIZE", 2)
+    async with chain() as session:
+        await session.execute(update(User).where(User.telegram_id.in_([1, 5])).values(referral_count=7, l2_referral_count=3))
+        await session.commit()
+
+    assert await repair_referral_counters(chain) == 2
+    assert await counters(chain, 1) == (1, 1, 2)
+    assert await counters(chain, 5) == (0, 0, 0)
+    assert await repair_referral_counters(chain) == 0
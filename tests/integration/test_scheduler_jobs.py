@@ -1,19 +1,18 @@
+import asyncio
+import time
 import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
 from datetime import datetime, timedelta
+from sqlalchemy import select, update
 
-from core.services.scheduler_jobs import check_expiring_subscriptions, deactivate_expired_users
+from core.services.scheduler_jobs import check_expiring_subscriptions, deactivate_expired_users, process_new_expirations, EXPIRY_HIGH_WATER_MARK_KEY
+from core.services.app_state import get_state, set_state
 from core.database.models import Subscription, User, Server
-from core.services.xui_client import XUIClientError, XUIClient
-
-@pytest.fixture
-def mock_session():
-    mock_execute_result = AsyncMock()
-    mock_execute_result.scalars.return_value.all.return_value = [] # Default empty list
-    mock_session = AsyncMock()
-    mock_session.execute.return_value = mock_execute_result
-    return mock_session
+from core.services.xui_client import XUIClientError, XUIClient, XUIServerDegradedError
+from core.services.message_dispatcher import start_dispatcher, stop_dispatcher
+from core.services.retry_policy import RetryPolicy, current_retry_policy
 
 @pytest.fixture
 def mock_bot():
@@ -28,6 +27,48 @@ def mock_get_client(mock_xui_client):
     with patch('core.services.scheduler_jobs.get_client', return_value=mock_xui_client) as mock_gc:
         yield mock_gc
 
+async def seed_subscriptions(session_maker, servers=1, expired_per_server=1, active_per_server=0):
+    """Creates servers with expired and still valid subscriptions; returns {uuid: subscription id}."""
+    now = datetime.utcnow()
+    ids = {}
+    async with session_maker() as session:
+        session.add(User(telegram_id=123))
+        for s in range(1, servers + 1):
+            session.add(Server(id=s, name=f"Server{s}", api_url=f"http://s{s}", api_user="u", api_password="p", inbound_id=s))
+        await session.flush()
+        for s in range(1, servers + 1):
+            for i in range(expired_per_server + active_per_server):
+                expires_at = now - timedelta(days=1) if i < expired_per_server else now + timedelta(days=1)
+                sub = Subscription(user_id=123, server_id=s, xui_user_uuid=f"s{s}-uuid-{i}", expires_at=expires_at, is_active=True)
+                session.add(sub)
+                await session.flush()
+                ids[sub.xui_user_uuid] = sub.id
+        await session.commit()
+    return ids
+
+async def seed_expiring(session_maker, users):
+    """Creates one subscription expiring in ~3 days on server 1 for each (telegram_id, username, language)."""
+    expires_at = datetime.utcnow() + timedelta(days=2, hours=23, minutes=30)
+    async with session_maker() as session:
+        session.add(Server(id=1, name="TestServer", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+        for telegram_id, username, language_code in users:
+            session.add(User(telegram_id=telegram_id, username=username, language_code=language_code))
+            session.add(Subscription(user_id=telegram_id, server_id=1, xui_user_uuid=f"uuid-{telegram_id}", expires_at=expires_at, is_active=True))
+        await session.commit()
+
+async def active_uuids(session_maker):
+    async with session_maker() as session:
+        return set((await session.execute(
+            select(Subscription.xui_user_uuid).where(Subscription.is_active == True)
+        )).scalars().all())
+
+@pytest.fixture
+async def dispatcher(mock_bot):
+    with patch('core.services.message_dispatcher.settings.TELEGRAM_GLOBAL_RATE', 1000), \
+            patch('core.services.message_dispatcher.settings.TELEGRAM_PER_CHAT_INTERVAL', 0):
+        yield start_dispatcher(mock_bot)
+    await stop_dispatcher()
+
 @pytest.fixture
 def mock_logger():
     with patch('core.services.scheduler_jobs.logger') as mock_log:
@@ -36,113 +77,231 @@ def mock_logger():
 @pytest.mark.asyncio
 class TestSchedulerJobs:
 
-    async def test_check_expiring_subscriptions_no_expiring(self, mock_session, mock_bot, mock_logger):
-        mock_session.execute.return_value.scalars.return_value.all.return_value = []
-        await check_expiring_subscriptions(mock_bot, mock_session)
+    async def test_check_expiring_subscriptions_no_expiring(self, session_maker, mock_bot, mock_logger):
+        await seed_subscriptions(session_maker, expired_per_server=1, active_per_server=1)
+        await check_expiring_subscriptions(mock_bot, session_maker)
         mock_bot.send_message.assert_not_called()
         mock_logger.info.assert_any_call("Scheduler job: Checking for expiring subscriptions...")
         mock_logger.info.assert_any_call("Found 0 subscriptions expiring soon.")
 
-    async def test_check_expiring_subscriptions_with_expiring(self, mock_session, mock_bot, mock_logger):
-        user = AsyncMock(spec=User, telegram_id=123, username="testuser")
-        server = AsyncMock(spec=Server, name="TestServer")
-        sub = AsyncMock(spec=Subscription, user_id=123, server_id=456, expires_at=datetime.utcnow() + timedelta(days=2, hours=23, minutes=59))
-        
-        mock_session.execute.return_value.scalars.return_value.all.return_value = [sub]
-        mock_session.get.side_effect = [user, server]
-
-        await check_expiring_subscriptions(mock_bot, mock_session)
-
-        mock_bot.send_message.assert_called_once_with(
-            chat_id=user.telegram_id,
-            text=f"Здравствуйте, {user.username or 'пользователь'}!\n\n"
-                 f"Ваша подписка на сервер \"{server.name}\" истекает через 3 дня.\n\n"
-                 f"Чтобы продлить ее и не потерять доступ, пожалуйста, оплатите подписку."
+    async def test_check_expiring_subscriptions_with_expiring(self, session_maker, mock_bot, mock_logger):
+        await seed_expiring(session_maker, [(123, "testuser", "ru"), (456, None, "en")])
+
+        await check_expiring_subscriptions(mock_bot, session_maker)
+
+        assert mock_bot.send_message.await_count == 2
+        sent = {call.kwargs["chat_id"]: call.kwargs for call in mock_bot.send_message.await_args_list}
+        assert sent[123]["text"] == (
+            "Здравствуйте, testuser!\n\n"
+            "Ваша подписка на сервер \"TestServer\" истекает через 3 дня.\n\n"
+            "Чтобы продлить ее и не потерять доступ, пожалуйста, оплатите подписку."
         )
-        mock_logger.info.assert_any_call("Found 1 subscriptions expiring soon.")
-        mock_logger.info.assert_any_call(f"Sent renewal reminder to user {user.telegram_id} for server {server.name}")
-
-    async def test_check_expiring_subscriptions_send_message_error(self, mock_session, mock_bot, mock_logger):
-        user = AsyncMock(spec=User, telegram_id=123, username="testuser")
-        server = AsyncMock(spec=Server, name="TestServer")
-        sub = AsyncMock(spec=Subscription, user_id=123, server_id=456, expires_at=datetime.utcnow() + timedelta(days=2, hours=23, minutes=59))
-        
-        mock_session.execute.return_value.scalars.return_value.all.return_value = [sub]
-        mock_session.get.side_effect = [user, server]
+        assert sent[456]["text"].startswith("Hello, user!")
+        assert sent[456]["reply_markup"].inline_keyboard[0][0].callback_data == "select_server_1"
+        mock_logger.info.assert_any_call("Found 2 subscriptions expiring soon.")
+        mock_logger.info.assert_any_call("Renewal reminders: 2 sent, 0 failed.")
+
+    async def test_check_expiring_subscriptions_send_message_error(self, session_maker, mock_bot, mock_logger):
+        await seed_expiring(session_maker, [(123, "testuser", "ru")])
         mock_bot.send_message.side_effect = Exception("Telegram API error")
 
-        await check_expiring_subscriptions(mock_bot, mock_session)
+        await check_expiring_subscriptions(mock_bot, session_maker)
+
+        mock_logger.error.assert_called_once_with("Failed to send renewal reminder to 123: Telegram API error")
+        mock_logger.info.assert_any_call("Renewal reminders: 0 sent, 1 failed.")
+
+    async def test_check_expiring_subscriptions_waits_out_flood_control(self, session_maker, mock_bot, dispatcher, mock_logger):
+        await seed_expiring(session_maker, [(123, "testuser", "ru")])
+        mock_bot.send_message.side_effect = [TelegramRetryAfter(method=MagicMock(), message="Flood control", retry_after=0), None]
+
+        await check_expiring_subscriptions(mock_bot, session_maker)
 
-        mock_logger.error.assert_called_once_with(f"Failed to send renewal reminder to {user.telegram_id}: Telegram API error")
+        assert mock_bot.send_message.await_count == 2
+        assert dispatcher.stats()["flood_waits"] == 1
+        mock_logger.info.assert_any_call("Renewal reminders: 1 sent, 0 failed.")
 
-    async def test_deactivate_expired_users_no_expired(self, mock_session, mock_xui_client, mock_logger):
-        mock_session.execute.return_value.scalars.return_value.all.return_value = []
-        await deactivate_expired_users(mock_session)
-        mock_xui_client.delete_user.assert_not_called()
-        mock_session.commit.assert_called_once()
+    async def test_deactivate_expired_users_no_expired(self, session_maker, mock_xui_client, mock_logger):
+        await seed_subscriptions(session_maker, expired_per_server=0, active_per_server=2)
+        await deactivate_expired_users(session_maker)
+        mock_xui_client.delete_client.assert_not_called()
         mock_logger.info.assert_any_call("Scheduler job: Deactivating expired users...")
         mock_logger.info.assert_any_call("Found 0 expired subscriptions to deactivate.")
 
-    async def test_deactivate_expired_users_with_expired(self, mock_session, mock_xui_client, mock_logger):
-        user = AsyncMock(spec=User, telegram_id=123)
-        server = AsyncMock(spec=Server, name="TestServer")
-        sub = AsyncMock(spec=Subscription, user_id=123, server_id=456, xui_user_uuid="test_uuid", is_active=True, expires_at=datetime.utcnow() - timedelta(days=1))
-        
-        mock_session.execute.return_value.scalars.return_value.all.return_value = [sub]
-        mock_session.get.side_effect = [user, server]
-        mock_xui_client.delete_user.return_value = {"success": True}
-
-        await deactivate_expired_users(mock_session)
-
-        mock_xui_client.delete_user.assert_called_once_with(server.inbound_id, sub.xui_user_uuid)
-        assert sub.is_active is False
-        mock_session.commit.assert_called_once()
-        mock_logger.info.assert_any_call(f"Successfully deactivated user {user.telegram_id} from server {server.name}")
-
-    async def test_deactivate_expired_users_xui_client_not_found_error(self, mock_session, mock_xui_client, mock_logger):
-        user = AsyncMock(spec=User, telegram_id=123)
-        server = AsyncMock(spec=Server, name="TestServer")
-        sub = AsyncMock(spec=Subscription, user_id=123, server_id=456, xui_user_uuid="test_uuid", is_active=True, expires_at=datetime.utcnow() - timedelta(days=1))
-        
-        mock_session.execute.return_value.scalars.return_value.all.return_value = [sub]
-        mock_session.get.side_effect = [user, server]
-        mock_xui_client.delete_user.side_effect = XUIClientError("Client not found in X-UI")
-
-        await deactivate_expired_users(mock_session)
-
-        mock_xui_client.delete_user.assert_called_once_with(server.inbound_id, sub.xui_user_uuid)
-        assert sub.is_active is False
-        mock_session.commit.assert_called_once()
-        mock_logger.warning.assert_called_once_with(f"Client {sub.xui_user_uuid} was already deleted in X-UI. Marking as inactive in DB.")
-
-    async def test_deactivate_expired_users_other_xui_client_error(self, mock_session, mock_xui_client, mock_logger):
-        user = AsyncMock(spec=User, telegram_id=123)
-        server = AsyncMock(spec=Server, name="TestServer")
-        sub = AsyncMock(spec=Subscription, user_id=123, server_id=456, xui_user_uuid="test_uuid", is_active=True, expires_at=datetime.utcnow() - timedelta(days=1))
-        
-        mock_session.execute.return_value.scalars.return_value.all.return_value = [sub]
-        mock_session.get.side_effect = [user, server]
-        mock_xui_client.delete_user.side_effect = XUIClientError("Some other XUI error")
-
-        await deactivate_expired_users(mock_session)
-
-        mock_xui_client.delete_user.assert_called_once_with(server.inbound_id, sub.xui_user_uuid)
-        assert sub.is_active is True # Should not be deactivated if it's another XUI error
-        mock_session.commit.assert_called_once()
-        mock_logger.error.assert_called_once_with(f"XUI error deactivating {user.telegram_id} from server {server.name}: Some other XUI error")
-
-    async def test_deactivate_expired_users_unexpected_error(self, mock_session, mock_xui_client, mock_logger):
-        user = AsyncMock(spec=User, telegram_id=123)
-        server = AsyncMock(spec=Server, name="TestServer")
-        sub = AsyncMock(spec=Subscription, user_id=123, server_id=456, xui_user_uuid="test_uuid", is_active=True, expires_at=datetime.utcnow() - timedelta(days=1))
-        
-        mock_session.execute.return_value.scalars.return_value.all.return_value = [sub]
-        mock_session.get.side_effect = [user, server]
-        mock_xui_client.delete_user.side_effect = Exception("Unexpected error")
-
-        await deactivate_expired_users(mock_session)
-
-        mock_xui_client.delete_user.assert_called_once_with(server.inbound_id, sub.xui_user_uuid)
-        assert sub.is_active is True # Should not be deactivated if it's an unexpected error
-        mock_session.commit.assert_called_once()
-        mock_logger.error.assert_called_once_with(f"Unexpected error deactivating {user.telegram_id} from server {server.name}: Unexpected error")
\ No newline at end of file
+    async def test_deactivate_expired_users_across_servers(self, session_maker, mock_xui_client, mock_logger):
+        await seed_subscriptions(session_maker, servers=3, expired_per_server=4, active_per_server=1)
+        mock_xui_client.delete_client.return_value = {"success": True}
+
+        await deactivate_expired_users(session_maker)
+
+        assert mock_xui_client.delete_client.await_count == 12
+        mock_xui_client.delete_client.assert_any_await(2, "s2-uuid-3")
+        assert await active_uuids(session_maker) == {"s1-uuid-4", "s2-uuid-4", "s3-uuid-4"}
+        mock_logger.info.assert_any_call("Deactivated 12 of 12 expired subscriptions on 3 servers.")
+
+    async def test_deactivate_expired_users_xui_client_not_found_error(self, session_maker, mock_xui_client, mock_logger):
+        await seed_subscriptions(session_maker)
+        mock_xui_client.delete_client.side_effect = XUIClientError("Failed to delete client s1-uuid-0: Client not found")
+
+        await deactivate_expired_users(session_maker)
+
+        assert await active_uuids(session_maker) == set()
+        mock_logger.warning.assert_called_once_with("Client s1-uuid-0 was already deleted in X-UI. Marking as inactive in DB.")
+
+    async def test_deactivate_expired_users_other_xui_client_error(self, session_maker, mock_xui_client, mock_logger):
+        await seed_subscriptions(session_maker)
+        mock_xui_client.delete_client.side_effect = XUIClientError("Some other XUI error")
+
+        await deactivate_expired_users(session_maker)
+
+        assert await active_uuids(session_maker) == {"s1-uuid-0"} # Should not be deactivated if it's another XUI error
+        mock_logger.error.assert_called_once_with("XUI error deactivating client s1-uuid-0 on server Server1: Some other XUI error")
+
+    async def test_deactivate_expired_users_unexpected_error(self, session_maker, mock_xui_client, mock_logger):
+        await seed_subscriptions(session_maker)
+        mock_xui_client.delete_client.side_effect = Exception("Unexpected error")
+
+        await deactivate_expired_users(session_maker)
+
+        assert await active_uuids(session_maker) == {"s1-uuid-0"}
+        mock_logger.error.assert_called_once_with("Unexpected error deactivating client s1-uuid-0 on server Server1: Unexpected error")
+
+    async def test_deactivate_expired_users_respects_per_server_cap(self, session_maker, mock_xui_client):
+        await seed_subscriptions(session_maker, servers=2, expired_per_server=20)
+        in_flight = {1: 0, 2: 0}
+        peak = {1: 0, 2: 0}
+
+        async def slow_delete(inbound_id, uuid):
+            in_flight[inbound_id] += 1
+            peak[inbound_id] = max(peak[inbound_id], in_flight[inbound_id])
+            await asyncio.sleep(0.001)
+            in_flight[inbound_id] -= 1
+            return {"success": True}
+
+        mock_xui_client.delete_client.side_effect = slow_delete
+        with patch('core.services.scheduler_jobs.settings.EXPIRY_DELETE_CONCURRENCY', 3):
+            await deactivate_expired_users(session_maker)
+
+        assert peak == {1: 3, 2: 3}
+        assert await active_uuids(session_maker) == set()
+
+    async def test_each_delete_gets_its_own_retry_budget(self, session_maker, mock_xui_client):
+        await seed_subscriptions(session_maker, expired_per_server=10)
+
+        async def slow_delete(inbound_id, uuid):
+            if current_retry_policy()[1] <= time.monotonic():
+                raise XUIClientError("Retry budget exhausted")
+            await asyncio.sleep(0.02)
+            return {"success": True}
+
+        mock_xui_client.delete_client.side_effect = slow_delete
+        # The whole job takes about four budgets.
+        short = RetryPolicy("short", max_attempts=1, budget=0.05, initial_backoff=0.01, max_backoff=0.01, jitter=0)
+        with patch('core.services.scheduler_jobs.BACKGROUND', short), \
+                patch('core.services.scheduler_jobs.settings.EXPIRY_DELETE_CONCURRENCY', 1):
+            assert await deactivate_expired_users(session_maker) == 10
+
+        assert await active_uuids(session_maker) == set()
+
+    async def test_subscription_renewed_during_the_job_keeps_its_client(self, session_maker, mock_xui_client):
+        ids = await seed_subscriptions(session_maker, expired_per_server=2)
+
+        async def delete_and_renew_the_next(inbound_id, uuid):
+            # The user renews s1-uuid-1 after the job has picked it as expired.
+            async with session_maker() as session:
+                await session.execute(
+                    update(Subscription).where(Subscription.id == ids["s1-uuid-1"])
+                    .values(expires_at=datetime.utcnow() + timedelta(days=30))
+                )
+                await session.commit()
+            return {"success": True}
+
+        mock_xui_client.delete_client.side_effect = delete_and_renew_the_next
+        with patch('core.services.scheduler_jobs.settings.EXPIRY_DELETE_CONCURRENCY', 1):
+            await deactivate_expired_users(session_maker)
+
+        mock_xui_client.delete_client.assert_awaited_once_with(1, "s1-uuid-0")
+        assert await active_uuids(session_maker) == {"s1-uuid-1"}
+
+    async def test_deactivate_expired_users_stops_on_degraded_server(self, session_maker, mock_xui_client):
+        await seed_subscriptions(session_maker, expired_per_server=10)
+        mock_xui_client.delete_client.side_effect = XUIServerDegradedError("http://s1", 30)
+
+        with patch('core.services.scheduler_jobs.settings.EXPIRY_DELETE_CONCURRENCY', 2):
+            await deactivate_expired_users(session_maker)
+
+        assert mock_xui_client.delete_client.await_count <= 2
+        assert len(await active_uuids(session_maker)) == 10
+
+    async def test_process_new_expirations_handles_only_the_delta(self, session_maker, mock_xui_client):
+        now = datetime.utcnow()
+        async with session_maker() as session:
+            session.add(User(telegram_id=123))
+            session.add(Server(id=1, name="Server1", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+            await session.flush()
+            for uuid, expires_at in [("old", now - timedelta(hours=2)), ("new", now - timedelta(seconds=30)), ("future", now + timedelta(hours=1))]:
+                session.add(Subscription(user_id=123, server_id=1, xui_user_uuid=uuid, expires_at=expires_at, is_active=True))
+            await set_state(session, EXPIRY_HIGH_WATER_MARK_KEY, (now - timedelta(minutes=1)).isoformat())
+            await session.commit()
+        mock_xui_client.delete_client.return_value = {"success": True}
+
+        await process_new_expirations(session_maker)
+
+        mock_xui_client.delete_client.assert_awaited_once_with(1, "new")
+        assert await active_uuids(session_maker) == {"old", "future"}
+        async with session_maker() as session:
+            high_water_mark = datetime.fromisoformat(await get_state(session, EXPIRY_HIGH_WATER_MARK_KEY))
+        assert high_water_mark >= now
+
+        # Nothing new expired: the next run deletes nothing.
+        mock_xui_client.delete_client.reset_mock()
+        await process_new_expirations(session_maker)
+        mock_xui_client.delete_client.assert_not_called()
+
+    async def test_process_new_expirations_first_run_looks_back_one_day(self, session_maker, mock_xui_client):
+        now = datetime.utcnow()
+        async with session_maker() as session:
+            session.add(User(telegram_id=123))
+            session.add(Server(id=1, name="Server1", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+            await session.flush()
+            session.add(Subscription(user_id=123, server_id=1, xui_user_uuid="last-week", expires_at=now - timedelta(days=7), is_active=True))
+            session.add(Subscription(user_id=123, server_id=1, xui_user_uuid="last-hour", expires_at=now - timedelta(hours=1), is_active=True))
+            await session.commit()
+        mock_xui_client.delete_client.return_value = {"success": True}
+
+        await process_new_expirations(session_maker)
+
+        # Older leftovers belong to the daily sweep.
+        mock_xui_client.delete_client.assert_awaited_once_with(1, "last-hour")
+        assert await active_uuids(session_maker) == {"last-week"}
+
+    async def test_process_new_expirations_retries_failed_deletes(self, session_maker, mock_xui_client):
+        now = datetime.utcnow()
+        failed_expiry = now - timedelta(seconds=30)
+        async with session_maker() as session:
+            session.add(User(telegram_id=123))
+            session.add(Server(id=1, name="Server1", api_url="http://s1", api_user="u", api_password="p", inbound_id=1))
+            await session.flush()
+            session.add(Subscription(user_id=123, server_id=1, xui_user_uuid="failing", expires_at=failed_expiry, is_active=True))
+            session.add(Subscription(user_id=123, server_id=1, xui_user_uuid="deleted", expires_at=now - timedelta(seconds=10), is_active=True))
+            await set_state(session, EXPIRY_HIGH_WATER_MARK_KEY, (now - timedelta(minutes=1)).isoformat())
+            await session.commit()
+
+        async def fail_one(inbound_id, uuid):
+            if uuid == "failing":
+                raise XUIClientError("Panel unavailable")
+            return {"success": True}
+
+        mock_xui_client.delete_client.side_effect = fail_one
+        assert await process_new_expirations(session_maker) == 1
+        assert await active_uuids(session_maker) == {"failing"}
+        async with session_maker() as session:
+            assert datetime.fromisoformat(await get_state(session, EXPIRY_HIGH_WATER_MARK_KEY)) == failed_expiry
+
+        # The panel is back: the next run picks the row up again and moves the mark on.
+        mock_xui_client.delete_client.reset_mock(side_effect=True)
+        mock_xui_client.delete_client.return_value = {"success": True}
+        assert await process_new_expirations(session_maker) == 1
+        mock_xui_client.delete_client.assert_awaited_once_with(1, "failing")
+        assert await active_uuids(session_maker) == set()
+        async with session_maker() as session:
+            assert datetime.fromisoformat(await get_state(session, EXPIRY_HIGH_WATER_MARK_KEY)) >= now
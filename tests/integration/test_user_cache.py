@@ -0,0 +1,113 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from aiogram.types import User as AiogramUser
+from sqlalchemy import update
+
+from core.database.models import User
+from core.handlers.user_handlers import _get_user_and_lang, _get_lang, callback_set_language
+from core.services.user_cache import UserCache, user_cache
+
+
+@pytest.fixture
+async def session_maker(session_maker):
+    async with session_maker() as session:
+        session.add_all([User(telegram_id=1, language_code="en"), User(telegram_id=2, language_code="fa")])
+        await session.commit()
+    user_cache.invalidate()
+    yield session_maker
+    user_cache.invalidate()
+
+
+@pytest.mark.asyncio
+async def test_snapshot_is_loaded_once(session_maker, queries):
+    cache = UserCache(ttl=60, max_size=10)
+    async with session_maker() as session:
+        first = await cache.get(session, 1)
+        second = await cache.get(session, 1)
+    assert first.language_code == second.language_code == "en"
+    assert len(queries) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_unknown_users_are_not_cached(session_maker, queries):
+    cache = UserCache(ttl=60, max_size=10)
+    async with session_maker() as session:
+        assert await cache.get(session, 99) is None
+        assert await cache.get(session, 99) is None
+    assert len(queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_entries_expire(session_maker):
+    cache = UserCache(ttl=60, max_size=10)
+    async with session_maker() as session:
+        await cache.get(session, 1)
+        with patch("core.services.user_cache.time.monotonic", return_value=10**9):
+            assert cache.peek(1) is None
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted(session_maker):
+    cache = UserCache(ttl=60, max_size=1)
+    async with session_maker() as session:
+        await cache.get(session, 1)
+        await cache.get(session, 2)
+    assert cache.peek(1) is None
+    assert cache.peek(2).language_code == "fa"
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_a_load_is_not_overwritten(session_maker):
+    cache = UserCache(ttl=60, max_size=10)
+    async with session_maker() as session:
+        original_execute = session.execute
+
+        async def execute_then_invalidate(*args, **kwargs):
+            result = await original_execute(*args, **kwargs)
+            cache.invalidate(1)
+            return result
+
+        with patch.object(session, "execute", execute_then_invalidate):
+            assert (await cache.get(session, 1)).language_code == "en"
+    assert cache.peek(1) is None
+
+
+@pytest.mark.asyncio
+async def test_language_change_is_visible_after_invalidation(session_maker):
+    async with session_maker() as session:
+        assert await _get_lang(session, 1) == "en"
+        await session.execute(update(User).where(User.telegram_id == 1).values(language_code="ru"))
+        await session.commit()
+        assert await _get_lang(session, 1) == "en"
+        user_cache.invalidate(1)
+        assert await _get_lang(session, 1) == "ru"
+
+
+@pytest.mark.asyncio
+async def test_set_language_invalidates_the_snapshot(session_maker):
+    async with session_maker() as session:
+        assert await _get_lang(session, 1) == "en"
+
+    callback = MagicMock()
+    callback.data = "set_lang_ru"
+    callback.from_user = AiogramUser(id=1, is_bot=False, first_name="Test")
+    callback.answer = AsyncMock()
+    callback.message.edit_text = AsyncMock()
+    async with session_maker() as session:
+        await callback_set_language(callback, session, MagicMock())
+
+    async with session_maker() as session:
+        assert await _get_lang(session, 1) == "ru"
+
+
+@pytest.mark.asyncio
+async def test_user_row_is_loaded_once_per_update(session_maker, queries):
+    async with session_maker() as session:
+        user, lang = await _get_user_and_lang(session, 2)
+        again, _ = await _get_user_and_lang(session, 2)
+        assert again is user and lang == "fa"
+        assert len(queries) == 1
+        # The full row refreshes the snapshot, so lang-only handlers skip the query.
+        assert await _get_lang(session, 2) == "fa"
+        assert len(queries) == 1
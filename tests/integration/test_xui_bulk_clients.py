@@ -0,0 +1,105 @@
+import json
+import httpx
+import pytest
+
+from core.services.xui_client import XUIClient, ClientConfig
+
+
+def make_client(handler) -> XUIClient:
+    client = XUIClient(api_url="http://test.xui.com", username="test_user", password="test_password")
+    client.client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(handler))
+    client._is_authenticated = True
+    return client
+
+
+def configs(count: int):
+    return [ClientConfig(id=f"uuid-{i}", email=f"user-{i}") for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_add_clients_sends_one_request_per_chunk():
+    batches = []
+
+    def handler(request: httpx.Request):
+        form = dict(httpx.QueryParams(request.content.decode()))
+        batches.append(json.loads(form["settings"])["clients"])
+        return httpx.Response(200, json={"success": True})
+
+    client = make_client(handler)
+    results = await client.add_clients(1, configs(250), chunk_size=100)
+    await client.close()
+
+    assert [len(batch) for batch in batches] == [100, 100, 50]
+    assert len(results) == 250
+    assert all(result.success for result in results)
+
+
+@pytest.mark.asyncio
+async def test_add_clients_reports_failures_per_client():
+    def handler(request: httpx.Request):
+        form = dict(httpx.QueryParams(request.content.decode()))
+        emails = [c["email"] for c in json.loads(form["settings"])["clients"]]
+        if "user-1" in emails:
+            return httpx.Response(200, json={"success": False, "msg": "Duplicate email: user-1"})
+        return httpx.Response(200, json={"success": True})
+
+    client = make_client(handler)
+    results = await client.add_clients(1, configs(3))
+    await client.close()
+
+    assert [(r.uuid, r.success) for r in results] == [("uuid-0", True), ("uuid-1", False), ("uuid-2", True)]
+    assert "Duplicate email" in results[1].error
+
+
+@pytest.mark.asyncio
+async def test_update_clients_fetches_inbound_once():
+    inbound = {
+        "id": 1, "port": 443,
+        "settings": json.dumps({"clients": [{"id": "uuid-0", "email": "user-0", "totalGB": 5}]}),
+        "streamSettings": json.dumps({"network": "tcp", "security": "none"}),
+        "sniffing": json.dumps({"enabled": False, "destOverride": []})
+    }
+    calls = {"get": 0, "update": []}
+
+    def handler(request: httpx.Request):
+        if request.method == "GET":
+            calls["get"] += 1
+            return httpx.Response(200, json={"success": True, "obj": inbound})
+        form = dict(httpx.QueryParams(request.content.decode()))
+        calls["update"].append((request.url.path, json.loads(form["settings"])["clients"][0]))
+        return httpx.Response(200, json={"success": True})
+
+    client = make_client(handler)
+    results = await client.update_clients(1, {"uuid-0": 123, "missing": 456})
+    await client.close()
+
+    assert calls["get"] == 1
+    assert calls["update"][0][0] == "/panel/api/inbounds/updateClient/uuid-0"
+    assert calls["update"][0][1]["expiryTime"] == 123
+    assert calls["update"][0][1]["totalGB"] == 5
+    assert [(r.uuid, r.success) for r in results] == [("uuid-0", True), ("missing", False)]
+
+
+@pytest.mark.asyncio
+async def test_update_clients_validates_only_the_updated_clients():
+    # The other client would fail full Inbound validation; the cold-index path must not parse it.
+    inbound = {
+        "id": 1, "port": 443,
+        "settings": json.dumps({"clients": [
+            {"id": "uuid-0", "email": "user-0"},
+            {"id": "uuid-1", "email": "user-1", "totalGB": "not-a-number"},
+        ]}),
+    }
+
+    def handler(request: httpx.Request):
+        if request.method == "GET":
+            return httpx.Response(200, json={"success": True, "obj": inbound})
+        return httpx.Response(200, json={"success": True})
+
+    client = make_client(handler)
+    results = await client.update_clients(1, {"uuid-0": 123})
+    await client.close()
+
+    assert [(r.uuid, r.success) for r in results] == [("uuid-0", True)]
+    assert client.get_indexed_client(1, "uuid-0").expiryTime == 123
+    assert client.get_indexed_client(1, "uuid-1") is None
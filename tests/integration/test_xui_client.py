@@ -1,8 +1,10 @@
+import asyncio
 import pytest
 from unittest.mock import AsyncMock, patch
 import httpx # Added import for httpx
 import json # Added import for json
-from core.services.xui_client import XUIClient, XUIClientError, get_client
+from core.services import xui_client as xui_client_module
+from core.services.xui_client import XUIClient, XUIClientError, get_client, invalidate_client, close_all_clients
 from core.database.models import Server
 # from core.utils.security import decrypt_password # Removed direct import, will patch where it's used
 
@@ -36,6 +38,7 @@ def xui_client(mock_httpx_client):
 def mock_server():
     """Fixture for a mocked Server object."""
     server = AsyncMock(spec=Server)
+    server.id = 1
     server.api_url = "http://mock.server.com"
     server.api_user = "mock_user"
     server.api_password = "encrypted_password" # This will be decrypted by get_client
@@ -197,9 +200,53 @@ class TestXUIClient:
 
     @pytest.mark.asyncio
     async def test_get_client(self, mock_server, mock_decrypt_password):
-        client = get_client(mock_server)
+        xui_client_module._client_registry.clear()
+        client = await get_client(mock_server)
         assert isinstance(client, XUIClient)
         assert client.api_url == "http://mock.server.com"
         assert client.username == "mock_user"
         assert client.password == "decrypted_password"
         mock_decrypt_password.assert_called_once_with("encrypted_password")
+        await close_all_clients()
+
+
+class TestClientRegistry:
+
+    @pytest.fixture(autouse=True)
+    async def clean_registry(self):
+        xui_client_module._client_registry.clear()
+        yield
+        await close_all_clients()
+
+    @pytest.mark.asyncio
+    async def test_get_client_reuses_instance(self, mock_server, mock_decrypt_password):
+        first = await get_client(mock_server)
+        second = await get_client(mock_server)
+        assert first is second
+        mock_decrypt_password.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_get_client_recreated_on_credentials_change(self, mock_server, monkeypatch):
+        monkeypatch.setattr(xui_client_module, "RETIRED_CLIENT_GRACE", 0.01)
+        first = await get_client(mock_server)
+        first.in_flight = 1 # A request still running on the old client
+        mock_server.api_password = "new_encrypted_password"
+        second = await get_client(mock_server)
+        assert first is not second
+        await asyncio.sleep(0.05)
+        assert not first.client.is_closed
+        first.in_flight = 0
+        await asyncio.sleep(0.05)
+        assert first.client.is_closed
+        assert not second.client.is_closed
+
+    @pytest.mark.asyncio
+    async def test_invalidate_and_close_all(self, mock_server):
+        first = await get_client(mock_server)
+        invalidate_client(mock_server.id)
+        second = await get_client(mock_server)
+        assert second is not first
+        await close_all_clients()
+        assert first.client.is_closed and second.client.is_closed
+        assert xui_client_module._client_registry == {}
+        assert xui_client_module._retired_clients == {}
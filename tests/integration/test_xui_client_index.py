@@ -0,0 +1,70 @@
+import json
+import httpx
+import pytest
+
+from core.config import settings
+from core.services.xui_client import XUIClient, ClientConfig
+
+INBOUND = {
+    "id": 1, "port": 443,
+    "settings": json.dumps({"clients": [{"id": "uuid-0", "email": "user-0", "totalGB": 5, "expiryTime": 1}]}),
+    "streamSettings": json.dumps({"network": "tcp", "security": "none"}),
+    "sniffing": json.dumps({"enabled": False, "destOverride": []})
+}
+
+
+@pytest.fixture
+def panel():
+    calls = {"get": 0, "update": [], "delete": []}
+
+    def handler(request: httpx.Request):
+        if request.method == "GET":
+            calls["get"] += 1
+            return httpx.Response(200, json={"success": True, "obj": INBOUND})
+        if "delClient" in request.url.path:
+            calls["delete"].append(request.url.path)
+            return httpx.Response(200, json={"success": True})
+        form = dict(httpx.QueryParams(request.content.decode()))
+        calls["update"].append(json.loads(form["settings"])["clients"][0])
+        return httpx.Response(200, json={"success": True})
+
+    client = XUIClient(api_url="http://test.xui.com", username="test_user", password="test_password")
+    client.client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(handler))
+    client._is_authenticated = True
+    return client, calls
+
+
+@pytest.mark.asyncio
+async def test_update_client_uses_index_after_first_download(panel):
+    client, calls = panel
+    await client.update_client(1, "uuid-0", 100)
+    await client.update_client(1, "uuid-0", 200)
+    await client.close()
+
+    assert calls["get"] == 1
+    assert [c["expiryTime"] for c in calls["update"]] == [100, 200]
+    assert all(c["totalGB"] == 5 for c in calls["update"])
+    assert client.get_indexed_client(1, "uuid-0").expiryTime == 200
+
+
+@pytest.mark.asyncio
+async def test_indexed_clients_expire(panel, monkeypatch):
+    client, calls = panel
+    await client.update_client(1, "uuid-0", 100)
+    monkeypatch.setattr(settings, "XUI_CLIENT_INDEX_TTL", 0)
+    await client.update_client(1, "uuid-0", 200)
+    await client.close()
+
+    # The expired entry is read from the panel again instead of being trusted.
+    assert calls["get"] == 2
+
+
+@pytest.mark.asyncio
+async def test_index_follows_add_and_delete(panel):
+    client, calls = panel
+    await client.add_client(1, ClientConfig(id="uuid-5", email="user-5"))
+    assert client.get_indexed_client(1, "uuid-5") is not None
+
+    await client.delete_client(1, "uuid-5")
+    await client.close()
+    assert client.get_indexed_client(1, "uuid-5") is None
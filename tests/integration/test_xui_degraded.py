@@ -0,0 +1,59 @@
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+
+from core.services import xui_client as xui_client_module
+from core.services.retry_policy import RetryPolicy, retry_policy
+from core.services.xui_client import XUIClient, XUIClientError, XUIServerDegradedError
+
+
+def make_client(handler) -> XUIClient:
+    client = XUIClient(api_url="http://test.xui.com", username="test_user", password="test_password")
+    client.client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(handler))
+    client._is_authenticated = True
+    return client
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast():
+    calls = 0
+
+    def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        return httpx.Response(502)
+
+    with patch.object(xui_client_module.settings, "XUI_BREAKER_FAILURE_THRESHOLD", 2):
+        client = make_client(handler)
+    with retry_policy(RetryPolicy("once", max_attempts=1, budget=5, initial_backoff=0, max_backoff=0, jitter=0)):
+        for _ in range(2):
+            with pytest.raises(XUIClientError):
+                await client.delete_client(1, "uuid-0")
+
+        with pytest.raises(XUIServerDegradedError) as exc_info:
+            await client.delete_client(1, "uuid-0")
+    assert calls == 2
+    assert exc_info.value.retry_after > 0
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_full_request_queue_reports_degraded():
+    release = asyncio.Event()
+
+    async def handler(request: httpx.Request):
+        await release.wait()
+        return httpx.Response(200, json={"success": True})
+
+    with patch.object(xui_client_module.settings, "XUI_MAX_CONCURRENT_REQUESTS", 1), \
+            patch.object(xui_client_module.settings, "XUI_QUEUE_TIMEOUT", 0.05):
+        client = make_client(handler)
+        slow_call = asyncio.create_task(client.delete_client(1, "uuid-0"))
+        await asyncio.sleep(0)
+        with pytest.raises(XUIServerDegradedError):
+            await client.delete_client(1, "uuid-1")
+
+    release.set()
+    assert (await slow_call)["success"] is True
+    await client.close()
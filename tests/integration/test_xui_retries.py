@@ -0,0 +1,67 @@
+import time
+import httpx
+import pytest
+
+from core.services.retry_policy import RetryPolicy, retry_policy
+from core.services.xui_client import XUIClient, XUIClientError
+
+FAST = RetryPolicy("test", max_attempts=3, budget=5, initial_backoff=0.01, max_backoff=0.02, jitter=0)
+
+
+def make_client(handler) -> XUIClient:
+    client = XUIClient(api_url="http://test.xui.com", username="test_user", password="test_password")
+    client.client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(handler))
+    client._is_authenticated = True
+    return client
+
+
+@pytest.mark.asyncio
+async def test_gateway_errors_are_retried():
+    statuses = [503, 502, 200]
+
+    def handler(request: httpx.Request):
+        status = statuses.pop(0)
+        return httpx.Response(status, json={"success": True})
+
+    client = make_client(handler)
+    with retry_policy(FAST):
+        assert (await client.delete_client(1, "uuid-0"))["success"] is True
+    assert statuses == []
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_attempts_are_bounded_by_policy():
+    calls = 0
+
+    def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        raise httpx.ConnectError("connection refused", request=request)
+
+    client = make_client(handler)
+    with retry_policy(FAST):
+        with pytest.raises(XUIClientError):
+            await client.delete_client(1, "uuid-0")
+    assert calls == FAST.max_attempts
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_deadline_stops_retries():
+    calls = 0
+
+    def handler(request: httpx.Request):
+        nonlocal calls
+        calls += 1
+        raise httpx.ConnectError("connection refused", request=request)
+
+    slow_backoff = RetryPolicy("slow", max_attempts=10, budget=60, initial_backoff=0.2, max_backoff=0.2, jitter=0)
+    client = make_client(handler)
+    started = time.monotonic()
+    with retry_policy(slow_backoff, deadline=time.monotonic() + 0.5):
+        with pytest.raises(XUIClientError):
+            await client.delete_client(1, "uuid-0")
+    assert time.monotonic() - started < 1
+    assert calls < slow_backoff.max_attempts
+    await client.close()
@@ -0,0 +1,146 @@
+import asyncio
+import json
+import httpx
+import pytest
+from unittest.mock import patch
+
+from core.services import xui_client as xui_client_module
+from core.services.xui_client import XUIClient, XUIClientError
+
+INBOUND = {
+    "id": 1, "port": 443,
+    "settings": json.dumps({"clients": []}),
+    "streamSettings": json.dumps({"network": "tcp", "security": "none"}),
+    "sniffing": json.dumps({"enabled": False, "destOverride": []})
+}
+
+
+class FakePanel:
+    """Issues a session cookie on /login and answers 401 to API calls without a current one."""
+
+    def __init__(self):
+        self.logins = 0
+        self.api_calls = 0
+        self.valid_sessions = set()
+        self.reject_all = False
+
+    def expire_sessions(self):
+        self.valid_sessions.clear()
+
+    async def handler(self, request: httpx.Request):
+        if request.url.path == "/login":
+            self.logins += 1
+            await asyncio.sleep(0.01)
+            session = f"session-{self.logins}"
+            self.valid_sessions.add(session)
+            return httpx.Response(200, json={"success": True}, headers={"set-cookie": f"3x-ui={session}; Path=/"})
+        self.api_calls += 1
+        session = request.headers.get("cookie", "").removeprefix("3x-ui=")
+        if self.reject_all or session not in self.valid_sessions:
+            return httpx.Response(401)
+        return httpx.Response(200, json={"success": True, "obj": INBOUND})
+
+    def make_client(self) -> XUIClient:
+        client = XUIClient(api_url="http://panel.example.com", username="admin", password="secret")
+        client.client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(self.handler))
+        return client
+
+
+@pytest.fixture(autouse=True)
+def clean_sessions():
+    xui_client_module._sessions.clear()
+    xui_client_module._login_locks.clear()
+    xui_client_module._sessions_loaded = False
+    yield
+    xui_client_module._sessions.clear()
+    xui_client_module._login_locks.clear()
+    xui_client_module._sessions_loaded = False
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_login():
+    panel = FakePanel()
+    first, second = panel.make_client(), panel.make_client()
+    await asyncio.gather(*[c.get_inbound_raw(1) for c in (first, second) for _ in range(5)])
+    assert panel.logins == 1
+    await first.close()
+    await second.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_session_triggers_one_relogin_and_replay():
+    panel = FakePanel()
+    client = panel.make_client()
+    await client.get_inbound_raw(1)
+    panel.expire_sessions()
+
+    results = await asyncio.gather(*[client.get_inbound_raw(1) for _ in range(5)])
+    assert all(r["id"] == 1 for r in results)
+    assert panel.logins == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_persistent_rejection_is_reported():
+    panel = FakePanel()
+    client = panel.make_client()
+    panel.reject_all = True
+    with pytest.raises(XUIClientError, match="after a fresh login"):
+        await client.get_inbound_raw(1)
+    assert panel.logins == 2
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_sessions_survive_restart(tmp_path):
+    panel = FakePanel()
+    store = tmp_path / "xui_sessions.json"
+    with patch.object(xui_client_module.settings, "XUI_SESSION_STORE_PATH", str(store)):
+        client = panel.make_client()
+        await client.get_inbound_raw(1)
+        await client.close()
+        assert "session-1" not in store.read_text()  # cookies are stored encrypted
+
+        # Simulate a new process: in-memory sessions are gone, the file remains.
+        xui_client_module._sessions.clear()
+        xui_client_module._sessions_loaded = False
+        restarted = panel.make_client()
+        await restarted.get_inbound_raw(1)
+        await restarted.close()
+
+    assert panel.logins == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path, response, expired", [
+    ("/panel/api/inbounds/get/1", httpx.Response(404), True),
+    ("/panel/inbounds/unknown", httpx.Response(404), False),
+    ("/panel/api/inbounds/list", httpx.Response(401), True),
+    ("/panel/api/inbounds/list", httpx.Response(302, headers={"location": "/"}), True),
+    ("/panel/api/inbounds/list", httpx.Response(307, headers={"location": "/login"}), True),
+    ("/panel/api/inbounds/list", httpx.Response(302, headers={"location": "/panel/api/inbounds/list/"}), False),
+])
+async def test_session_expiry_detection(path, response, expired):
+    client = XUIClient(api_url="http://panel.example.com", username="admin", password="secret")
+    response.request = httpx.Request("GET", f"http://panel.example.com{path}")
+    assert client._is_session_expired(response) is expired
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_not_found_outside_the_api_does_not_log_in_again():
+    panel = FakePanel()
+    original_handler = panel.handler
+
+    async def handler(request: httpx.Request):
+        if request.url.path == "/panel/missing":
+            panel.api_calls += 1
+            return httpx.Response(404)
+        return await original_handler(request)
+
+    client = panel.make_client()
+    client.client = httpx.AsyncClient(base_url=client.api_url, transport=httpx.MockTransport(handler))
+    response = await client._request("GET", "/panel/missing")
+    assert response.status_code == 404
+    assert (panel.logins, panel.api_calls) == (1, 1)
+    await client.close()
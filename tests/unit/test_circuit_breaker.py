@@ -0,0 +1,36 @@
+from unittest.mock import patch
+
+from core.services.circuit_breaker import CircuitBreaker, CircuitState
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+    assert 0 < breaker.retry_after() <= 30
+
+
+def test_half_open_allows_single_probe():
+    with patch("core.services.circuit_breaker.time.monotonic", return_value=100.0) as clock:
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        breaker.record_failure()
+        clock.return_value = 131.0
+        assert breaker.allow_request()
+        assert breaker.state == CircuitState.HALF_OPEN
+        assert not breaker.allow_request()
+
+        breaker.record_failure()
+        assert breaker.state == CircuitState.OPEN
+
+        clock.return_value = 162.0
+        assert breaker.allow_request()
+        breaker.record_success()
+        assert breaker.state == CircuitState.CLOSED
+        assert breaker.allow_request()
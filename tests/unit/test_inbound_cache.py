@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from core.services.inbound_cache import InboundCache, InboundMetadata
+from core.services.xui_client import Inbound, parse_inbound_stream
+
+RAW_INBOUND = {
+    "id": 1,
+    "port": 443,
+    "protocol": "vless",
+    "settings": "{\"clients\": [], \"decryption\": \"none\"}",
+    "streamSettings": "{\"network\": \"tcp\", \"security\": \"reality\", \"realitySettings\": {"
+                      "\"show\": false, \"xver\": 0, \"dest\": \"yahoo.com:443\", \"serverNames\": [\"yahoo.com\"],"
+                      "\"privateKey\": \"priv\", \"minClient\": \"\", \"maxClient\": \"\", \"maxTimediff\": 0,"
+                      "\"shortIds\": [\"bb\"], \"settings\": {\"publicKey\": \"pub\", \"fingerprint\": \"chrome\", \"spiderX\": \"/\"}}}",
+    "sniffing": "{\"enabled\": true, \"destOverride\": [\"http\", \"tls\"]}"
+}
+
+
+@pytest.fixture
+def server():
+    server = MagicMock()
+    server.id = 7
+    server.inbound_id = 1
+    server.api_url = "https://vpn.example.com:2053"
+    return server
+
+
+@pytest.fixture
+def mock_xui_client():
+    client = AsyncMock()
+
+    async def slow_get_inbound_stream(inbound_id):
+        await asyncio.sleep(0.01)
+        return parse_inbound_stream(RAW_INBOUND)
+
+    client.get_inbound_stream.side_effect = slow_get_inbound_stream
+    with patch('core.services.inbound_cache.get_client', AsyncMock(return_value=client)):
+        yield client
+
+
+def test_metadata_from_inbound():
+    metadata = InboundMetadata.from_inbound(1, Inbound.model_validate(RAW_INBOUND))
+    assert metadata.port == 443
+    assert metadata.network == "tcp"
+    assert metadata.security == "reality"
+    assert metadata.public_key == "pub"
+    assert metadata.fingerprint == "chrome"
+    assert metadata.spider_x == "/"
+    assert metadata.server_name == "yahoo.com"
+    assert metadata.short_id == "bb"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch(server, mock_xui_client):
+    cache = InboundCache(ttl=60)
+    results = await asyncio.gather(*[cache.get(server) for _ in range(10)])
+    assert mock_xui_client.get_inbound_stream.call_count == 1
+    assert all(result.port == 443 for result in results)
+
+    await cache.get(server)
+    assert mock_xui_client.get_inbound_stream.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_refreshed(server, mock_xui_client):
+    cache = InboundCache(ttl=0)
+    await cache.get(server)
+    await cache.get(server)
+    assert mock_xui_client.get_inbound_stream.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_forces_refetch(server, mock_xui_client):
+    cache = InboundCache(ttl=60)
+    await cache.get(server)
+    cache.invalidate(server.id)
+    await cache.get(server)
+    assert mock_xui_client.get_inbound_stream.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_link_template_rebuilt_only_on_refresh(server, mock_xui_client):
+    cache = InboundCache(ttl=60)
+    first = await cache.get_template(server)
+    second = await cache.get_template(server)
+    assert first is second
+    assert first.authority == "vpn.example.com:443"
+
+    cache.invalidate(server.id)
+    third = await cache.get_template(server)
+    assert third is not first
@@ -0,0 +1,45 @@
+import json
+import pytest
+
+from core.services.xui_client import Inbound, parse_inbound_stream, find_client_in_settings
+
+
+def raw_inbound(client_count: int) -> dict:
+    clients = [{"id": f"uuid-{i}", "email": f"user-{i}", "expiryTime": i, "totalGB": 0} for i in range(client_count)]
+    return {
+        "id": 3,
+        "port": 443,
+        "protocol": "vless",
+        "settings": json.dumps({"clients": clients, "decryption": "none"}),
+        "streamSettings": json.dumps({"network": "tcp", "security": "tls"}),
+        "sniffing": json.dumps({"enabled": True, "destOverride": ["http"]})
+    }
+
+
+def test_stream_parse_matches_full_validation():
+    raw = raw_inbound(50)
+    full = Inbound.model_validate(raw)
+    light = parse_inbound_stream(raw)
+    assert light.port == full.port
+    assert light.protocol == full.protocol
+    assert light.streamSettings == full.streamSettings
+
+
+def test_stream_parse_ignores_broken_client_list():
+    raw = raw_inbound(1)
+    raw["settings"] = "{not valid json"
+    assert parse_inbound_stream(raw).streamSettings.network == "tcp"
+
+
+def test_find_client_by_uuid_and_email():
+    raw = raw_inbound(1000)
+    by_uuid = find_client_in_settings(raw["settings"], uuid="uuid-500")
+    by_email = find_client_in_settings(raw["settings"], email="user-42")
+    assert by_uuid.email == "user-500" and by_uuid.expiryTime == 500
+    assert by_email.id == "uuid-42"
+    assert find_client_in_settings(raw["settings"], uuid="missing") is None
+
+
+def test_find_client_requires_a_key():
+    with pytest.raises(ValueError):
+        find_client_in_settings("{}")
@@ -0,0 +1,128 @@
+import asyncio
+import time
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramNetworkError
+
+from core.services.message_dispatcher import MessageDispatcher, Priority, queue_message
+
+
+def make_dispatcher(bot, per_chat_interval=0.0, lane_size=100, workers=1):
+    return MessageDispatcher(bot, global_rate=1000, per_chat_interval=per_chat_interval, lane_size=lane_size, workers=workers)
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_lanes_go_first():
+    bot = AsyncMock(spec=Bot)
+    dispatcher = make_dispatcher(bot)
+    futures = [
+        await dispatcher.enqueue(1, "broadcast", Priority.BROADCAST),
+        await dispatcher.enqueue(2, "reminder", Priority.REMINDER),
+        await dispatcher.enqueue(3, "payment", Priority.PAYMENT),
+        await dispatcher.enqueue(4, "admin", Priority.ADMIN)
+    ]
+    dispatcher.start()
+    await asyncio.gather(*futures)
+    await dispatcher.stop()
+
+    order = [call.kwargs["text"] for call in bot.send_message.await_args_list]
+    assert order == ["payment", "admin", "reminder", "broadcast"]
+
+
+@pytest.mark.asyncio
+async def test_messages_to_one_chat_are_paced():
+    bot = AsyncMock(spec=Bot)
+    sent_at = []
+    bot.send_message.side_effect = lambda **kwargs: sent_at.append(time.monotonic())
+    dispatcher = make_dispatcher(bot, per_chat_interval=0.05, workers=4)
+    dispatcher.start()
+    await asyncio.gather(*[await dispatcher.enqueue(42, f"m{i}") for i in range(3)])
+    await dispatcher.stop()
+
+    assert sent_at[2] - sent_at[0] >= 0.09
+
+
+@pytest.mark.asyncio
+async def test_paced_chat_does_not_hold_the_worker():
+    bot = AsyncMock(spec=Bot)
+    sent = []
+    bot.send_message.side_effect = lambda **kwargs: sent.append((kwargs["text"], time.monotonic()))
+    dispatcher = make_dispatcher(bot, per_chat_interval=0.2, workers=1)
+    dispatcher.start()
+    admin = [await dispatcher.enqueue(1, f"admin{i}", Priority.ADMIN) for i in range(3)]
+    await asyncio.sleep(0.01)
+    started = time.monotonic()
+    await asyncio.wait_for(dispatcher.send(2, "payment"), timeout=0.1)
+    assert time.monotonic() - started < 0.1
+    assert dispatcher.stats()["deferred"] == 2
+    await asyncio.gather(*admin)
+    await dispatcher.stop()
+
+    assert [text for text, _ in sent] == ["admin0", "payment", "admin1", "admin2"]
+    assert sent[3][1] - sent[0][1] >= 0.39
+
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_and_resends():
+    bot = AsyncMock(spec=Bot)
+    bot.send_message.side_effect = [TelegramRetryAfter(method=MagicMock(), message="Flood control", retry_after=0), "ok"]
+    dispatcher = make_dispatcher(bot)
+    dispatcher.start()
+    result = await dispatcher.send(1, "hello")
+    await dispatcher.stop()
+
+    assert result == "ok"
+    stats = dispatcher.stats()
+    assert stats["sent"] == 1
+    assert stats["flood_waits"] == 1
+    assert stats["retried"] == 1
+
+
+@pytest.mark.asyncio
+async def test_gives_up_after_max_attempts():
+    bot = AsyncMock(spec=Bot)
+    bot.send_message.side_effect = TelegramNetworkError(method=MagicMock(), message="connection reset")
+    dispatcher = make_dispatcher(bot)
+    dispatcher.start()
+    with pytest.raises(TelegramNetworkError):
+        await dispatcher.send(1, "hello")
+    await dispatcher.stop()
+
+    assert bot.send_message.await_count == 3
+    assert dispatcher.stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_full_bulk_lane_makes_producers_wait():
+    bot = AsyncMock(spec=Bot)
+    dispatcher = make_dispatcher(bot, lane_size=2)
+    await dispatcher.enqueue(1, "a", Priority.BROADCAST)
+    await dispatcher.enqueue(2, "b", Priority.BROADCAST)
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(dispatcher.enqueue(3, "c", Priority.BROADCAST), timeout=0.05)
+    # Payments are never held back by a full bulk lane.
+    await asyncio.wait_for(dispatcher.enqueue(4, "d", Priority.PAYMENT), timeout=0.05)
+
+
+@pytest.mark.asyncio
+async def test_queue_message_sends_directly_without_dispatcher():
+    bot = AsyncMock(spec=Bot)
+    future = await queue_message(bot, 7, "hi", priority=Priority.PAYMENT, parse_mode="HTML")
+    assert future.done()
+    bot.send_message.assert_awaited_once_with(chat_id=7, text="hi", parse_mode="HTML")
+
+
+@pytest.mark.asyncio
+async def test_past_chat_slots_are_pruned():
+    bot = AsyncMock(spec=Bot)
+    dispatcher = make_dispatcher(bot, per_chat_interval=0.01)
+    dispatcher.start()
+    await asyncio.gather(*[await dispatcher.enqueue(chat_id, "hi", Priority.BROADCAST) for chat_id in range(50)])
+    await dispatcher.enqueue(999, "later", Priority.BROADCAST)
+    await asyncio.sleep(0.02)
+    dispatcher._chat_next_at[1000] = time.monotonic() + 60 # A chat still waiting for its slot
+    dispatcher._prune_chat_slots()
+    await dispatcher.stop()
+
+    assert dispatcher._chat_next_at.keys() == {1000}
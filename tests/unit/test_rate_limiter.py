@@ -0,0 +1,17 @@
+import asyncio
+import time
+import pytest
+
+from core.services.rate_limiter import TokenBucket
+
+
+@pytest.mark.asyncio
+async def test_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate=100, capacity=5)
+    started = time.monotonic()
+    await asyncio.gather(*[bucket.acquire() for _ in range(5)])
+    assert time.monotonic() - started < 0.02
+
+    started = time.monotonic()
+    await asyncio.gather(*[bucket.acquire() for _ in range(10)])
+    assert time.monotonic() - started >= 0.09
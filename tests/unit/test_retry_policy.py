@@ -0,0 +1,63 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from aiogram.types import CallbackQuery
+
+from core.middlewares.retry_policy_middleware import RetryPolicyMiddleware
+from core.services.retry_policy import RetryPolicy, retry_policy, current_retry_policy, INTERACTIVE, BACKGROUND
+
+
+def test_default_policy_is_background():
+    policy, deadline = current_retry_policy()
+    assert policy is BACKGROUND
+    assert deadline > time.monotonic()
+
+
+def test_nested_block_keeps_earliest_deadline():
+    outer_deadline = time.monotonic() + 1
+    with retry_policy(BACKGROUND, deadline=outer_deadline):
+        with retry_policy(INTERACTIVE):
+            policy, deadline = current_retry_policy()
+            assert policy is INTERACTIVE
+            assert deadline <= outer_deadline
+        assert current_retry_policy() == (BACKGROUND, outer_deadline)
+    assert current_retry_policy()[0] is BACKGROUND
+
+
+def test_backoff_never_sleeps_past_deadline():
+    policy = RetryPolicy("test", max_attempts=10, budget=60, initial_backoff=5, max_backoff=30, jitter=0)
+    wait = policy.wait(time.monotonic() + 1)
+
+    class State:
+        attempt_number = 4
+
+    assert wait(State()) <= 1
+
+
+async def policies_seen_by_handler(flags):
+    seen = []
+
+    async def handler(event, data):
+        seen.append(current_retry_policy())
+        await asyncio.sleep(0.01)
+        seen.append(current_retry_policy())
+
+    await RetryPolicyMiddleware()(handler, MagicMock(spec=CallbackQuery), {"handler": SimpleNamespace(flags=flags)})
+    return seen
+
+
+@pytest.mark.asyncio
+async def test_handler_calls_share_one_interactive_deadline():
+    (first, first_deadline), (second, second_deadline) = await policies_seen_by_handler({})
+    assert first is second is INTERACTIVE
+    assert first_deadline == second_deadline
+
+
+@pytest.mark.asyncio
+async def test_background_flag_gives_each_call_its_own_budget():
+    (first, first_deadline), (second, second_deadline) = await policies_seen_by_handler({"retry_policy": "background"})
+    assert first is second is BACKGROUND
+    assert second_deadline > first_deadline
@@ -0,0 +1,41 @@
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from core.services.inbound_cache import InboundMetadata
+from core.services.vless_links import VlessLinkTemplate
+
+
+def reality_metadata():
+    return InboundMetadata(
+        inbound_id=1, port=443, network="tcp", security="reality",
+        public_key="pub", fingerprint="chrome", spider_x="/", server_name="yahoo.com", short_id="bb"
+    )
+
+
+def test_template_contains_reality_params():
+    template = VlessLinkTemplate.compile("https://vpn.example.com:2053/", reality_metadata())
+    link = template.render("11111111-2222-3333-4444-555555555555", "Server-11111111")
+
+    parts = urlsplit(link)
+    assert parts.scheme == "vless"
+    assert parts.netloc == "11111111-2222-3333-4444-555555555555@vpn.example.com:443"
+    params = parse_qs(parts.query)
+    assert params == {
+        "encryption": ["none"], "type": ["tcp"], "security": ["reality"],
+        "pbk": ["pub"], "fp": ["chrome"], "spx": ["/"], "sni": ["yahoo.com"], "sid": ["bb"]
+    }
+
+
+def test_fragment_is_url_encoded():
+    template = VlessLinkTemplate.compile("https://vpn.example.com", reality_metadata())
+    link = template.render("uuid", "Нидерланды #1 & co")
+
+    fragment = link.split("#", 1)[1]
+    assert " " not in fragment and "#" not in fragment and "&" not in fragment
+    assert unquote(fragment) == "Нидерланды #1 & co"
+
+
+def test_non_reality_template_and_ipv6_host():
+    metadata = InboundMetadata(inbound_id=2, port=8443, network="ws", security="tls")
+    template = VlessLinkTemplate.compile("http://[2001:db8::1]:54321", metadata)
+    link = template.render("uuid", "x")
+    assert link == "vless://uuid@[2001:db8::1]:8443?encryption=none&type=ws&security=tls#x"